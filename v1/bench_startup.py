@@ -0,0 +1,75 @@
+'''
+Benchmarks the cold start of quote_shufl.py: interpreter start, imports and the first paint
+of the greeting, measured by running the script with --no-wait in a fresh process. The first
+run is not counted, since it fills the local quote cache and the banner cache.
+
+Exits with status 1 if the median run is over the budget, so it can guard the start time in CI.
+
+Usage:
+    python bench_startup.py [--runs N] [--budget MS] [--columns N] [-- ARGS...]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def run(argv, columns):
+    '''
+    Runs a Python command line from the script's directory (where conf/db.ini is found),
+    with its output discarded and the terminal width set by COLUMNS.
+
+    Args:
+        argv (list): arguments after the interpreter
+        columns (int): terminal width the greeting is laid out for
+
+    Returns:
+        elapsed_ms (float): wall-clock milliseconds until the process exited
+    '''
+    env = dict(os.environ, COLUMNS=str(columns))
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *argv], cwd=SCRIPT_DIR, env=env, check=True,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+    return (time.perf_counter() - start) * 1e3
+
+def bench(argv, runs, columns):
+    '''
+    Returns:
+        times (list): milliseconds of each of `runs` runs, after one warm-up run
+    '''
+    run(argv, columns)
+
+    return [run(argv, columns) for _ in range(runs)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--budget', type=float, default=100, help='median milliseconds allowed for a greeting')
+    parser.add_argument('--columns', type=int, default=120)
+    parser.add_argument('args', nargs='*', help='extra arguments for quote_shufl.py')
+    args = parser.parse_args()
+
+    cases = (
+        ('interpreter', ['-c', 'pass']),
+        ('import', ['-c', 'import quote_shufl']),
+        ('greeting', ['quote_shufl.py', '--no-wait', *args.args]),
+    )
+
+    print(f'{"":>12} {"min (ms)":>10} {"median":>10} {"max":>10}')
+
+    for name, argv in cases:
+        times = bench(argv, args.runs, args.columns)
+        median = statistics.median(times)
+        print(f'{name:>12} {min(times):>10.1f} {median:>10.1f} {max(times):>10.1f}')
+
+    if median > args.budget:
+        print(f'greeting median {median:.1f} ms is over the budget of {args.budget:.0f} ms')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
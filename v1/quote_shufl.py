@@ -1,23 +1,52 @@
 #!/path/to/python/virtual/env
 
 # standard libs
+import io
 import os
+import sys
+import csv
+import mmap
+import time
+import struct
+import argparse
 import getpass
 import random
+import shutil
+import sqlite3
 import textwrap
 import configparser
 import logging
+from array import array
 
-# third-party libs
-import psycopg2
-import pyfiglet
+# heavier modules (psycopg2, pyfiglet, subprocess, qotd, corpus) are imported where they are used,
+# so a greeting served from the local caches never loads them
 
-def load_ini(filename):
+# qotd.py and corpus.py are shared with the v3 app and imported from there
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'v3'))
+
+# local copy of the quote table (see refresh_cache)
+CACHE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS quote (n INTEGER PRIMARY KEY, id INTEGER, body TEXT, source TEXT);
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+'''
+CACHE_TTL = 3600 # seconds before a cache is refreshed, unless set in the [cache] section
+REFRESH_TIMEOUT = 600 # seconds after which an unfinished refresh is presumed dead
+BANNER_DIR = 'banners' # rendered banners, unless set as banners in the [cache] section
+BANNER_FONT = 'slant'
+
+# line-offset index of a quote CSV (see build_csv_index): a header, then the byte offset of
+# each record and the end of the file, as little-endian 64-bit integers
+CSV_INDEX_MAGIC = b'QSCSVIX1'
+CSV_INDEX_HEADER = struct.Struct('<8sQQQ') # magic, size and mtime (ns) of the CSV, number of records
+CSV_INDEX_SUFFIX = '.idx'
+
+def load_ini(filename, section=None):
     '''
-    Parses INI file to a dictionary. This function assumes that there are one or more sections in the INI file with unique parameter names.
+    Parses INI file to a dictionary. Without a section, this function assumes that there are one or more sections in the INI file with unique parameter names.
 
     Args:
         filename (str): INI configuration file path
+        section (str): name of the only section to read (all sections if None); a missing section gives an empty dict
     
     Returns:
         ini_params (dict): dictionary containing INI configuration parameters
@@ -30,9 +59,12 @@ def load_ini(filename):
     parser.read(filename)
     
     # get list of sections stored in INI file and iterate through each
-    sections = parser.sections()
+    sections = parser.sections() if section is None else [section]
 
     for section in sections:
+        if not parser.has_section(section):
+            continue
+
         # get list of params stored in the section
         params = parser.items(section)
 
@@ -42,20 +74,433 @@ def load_ini(filename):
     
     return ini_params
 
-def greet_user(quote, source):
+def select_random_quote(cur, tries=10):
+    '''
+    Selects a uniformly random quote without scanning the quote table. Random ids are drawn
+    between the smallest and largest id (both read from the primary key index) and looked up
+    directly; ids that fall into gaps left by deleted quotes are simply drawn again. If the ids
+    are too sparse to hit within `tries` draws, it falls back to a COUNT + OFFSET scan.
+
+    Args:
+        cur (cursor): open cursor on the quote database
+        tries (int): number of random ids to try before falling back to a scan
+
+    Returns:
+        record (tuple): (body, source) of the selected quote, or None if there are no quotes
+    '''
+    cur.execute('SELECT min(id), max(id) FROM quote;')
+    min_id, max_id = cur.fetchone()
+
+    if min_id is None:
+        return None
+
+    for _ in range(tries):
+        cur.execute(
+            """
+            SELECT
+                body,
+                source
+            FROM
+                quote
+            WHERE
+                id = %s;
+            """,
+            (random.randint(min_id, max_id),)
+        )
+        record = cur.fetchone()
+
+        if record:
+            return record
+
+    cur.execute(
+        """
+        SELECT
+            body,
+            source
+        FROM
+            quote
+        OFFSET
+            floor(random() * (SELECT COUNT(id) FROM quote))
+        LIMIT 1;
+        """
+    )
+
+    return cur.fetchone()
+
+def refresh_cache(filename, db_params):
+    '''
+    Copies every quote from the database into a local SQLite file, numbered 1..n so that a
+    random quote is a single primary key lookup. The copy is written to a temporary file and
+    renamed over the cache, so greetings keep reading the old copy until it is complete.
+
+    Args:
+        filename (str): cache file path
+        db_params (dict): psycopg2 connection parameters
+
+    Returns:
+        count (int): number of quotes cached, or None if another refresh is running
+    '''
+    tmp = filename + '.tmp'
+
+    # the temporary file doubles as a lock, so concurrent shells start one refresh between them
+    try:
+        os.close(os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+
+    except FileExistsError:
+        if time.time() - os.path.getmtime(tmp) < REFRESH_TIMEOUT:
+            return None
+
+        os.unlink(tmp)
+        os.close(os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+
+    import psycopg2
+
+    conn = None
+
+    try:
+        conn = psycopg2.connect(**db_params)
+        cur = conn.cursor()
+        cur.execute('SELECT id, body, source FROM quote ORDER BY id;')
+        rows = cur.fetchall()
+
+        cache = sqlite3.connect(tmp)
+        cache.executescript(CACHE_SCHEMA)
+        cache.executemany('INSERT INTO quote(n, id, body, source) VALUES (?, ?, ?, ?);',
+                          ((n, *row) for n, row in enumerate(rows, 1)))
+        cache.executemany('INSERT INTO meta(key, value) VALUES (?, ?);',
+                          (('refreshed_at', time.time()), ('count', len(rows))))
+        cache.commit()
+        cache.close()
+
+        os.replace(tmp, filename)
+
+        return len(rows)
+
+    finally:
+        if conn:
+            conn.close()
+
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+def build_csv_index(data, stat):
+    '''
+    Builds the line-offset index of a quote CSV in one pass. A newline only ends a record
+    when an even number of double quotes precede it (an escaped quote "" counts twice), so
+    quoted fields that span several lines stay in one record. Blank lines are skipped.
+
+    Args:
+        data (mmap): contents of the CSV
+        stat (os.stat_result): stat of the CSV, recorded so a changed file is indexed again
+
+    Returns:
+        index (bytes): the index, as written to the index file
+    '''
+    offsets = array('Q')
+    quoted = False
+    pos = 0
+
+    while pos < len(data):
+        end = data.find(b'\n', pos)
+        end = len(data) if end == -1 else end + 1
+        line = data[pos:end]
+
+        if not quoted and line.strip():
+            offsets.append(pos)
+
+        if line.count(b'"') % 2:
+            quoted = not quoted
+
+        pos = end
+
+    # the first record is the header; the end of the file closes the last record
+    offsets = offsets[1:]
+    offsets.append(len(data))
+
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+
+    return CSV_INDEX_HEADER.pack(CSV_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets) - 1) + offsets.tobytes()
+
+def load_csv_index(filename, data, stat):
+    '''
+    Maps the index cached next to the CSV, or builds it and writes it there if it is missing
+    or does not match the CSV's size and modification time.
+
+    Args:
+        filename (str): CSV file path
+        data (mmap): contents of the CSV
+        stat (os.stat_result): stat of the CSV
+
+    Returns:
+        index (mmap or bytes): the index; it is kept in memory if it cannot be written
+    '''
+    index_file = filename + CSV_INDEX_SUFFIX
+
+    try:
+        with open(index_file, 'rb') as file:
+            index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, size, mtime, count = CSV_INDEX_HEADER.unpack_from(index)
+
+        if (magic, size, mtime) == (CSV_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns) \
+                and len(index) == CSV_INDEX_HEADER.size + 8 * (count + 1):
+            return index
+
+        index.close()
+
+    except (OSError, ValueError, struct.error):
+        # missing, empty or cut short
+        pass
+
+    index = build_csv_index(data, stat)
+
+    try:
+        # written aside and renamed, so a concurrent reader never sees part of an index
+        tmp = f'{index_file}.{os.getpid()}.tmp'
+
+        with open(tmp, 'wb') as file:
+            file.write(index)
+
+        os.replace(tmp, index_file)
+
+    except OSError as e:
+        logging.error(f'could not cache index {index_file}: {e}')
+
+    return index
+
+def select_csv_quote(filename):
+    '''
+    Selects a uniformly random quote from a CSV in the format of data/quote.csv (a header,
+    then body and source in the first two columns), without a database. The CSV is
+    memory-mapped and only the chosen record is read and parsed, using the line-offset index
+    cached in FILE.idx, so the pick takes the same time however large the file is. The index
+    is built on the first run and again whenever the CSV changes.
+
+    Args:
+        filename (str): CSV file path
+
+    Returns:
+        record (tuple): (body, source) of the selected quote, or None if the CSV has no quotes
+    '''
+    with open(filename, 'rb') as file:
+        stat = os.fstat(file.fileno())
+
+        if not stat.st_size:
+            return None
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = load_csv_index(filename, data, stat)
+            count = CSV_INDEX_HEADER.unpack_from(index)[3]
+
+            if not count:
+                return None
+
+            start, end = struct.unpack_from('<2Q', index, CSV_INDEX_HEADER.size + 8 * random.randrange(count))
+            row = next(csv.reader(io.StringIO(data[start:end].decode('utf-8'))))
+
+            if isinstance(index, mmap.mmap):
+                index.close()
+
+    return row[0], row[1] if len(row) > 1 else ''
+
+def select_cached_quote(filename):
+    '''
+    Selects a uniformly random quote from the local cache, without contacting the database.
+
+    Args:
+        filename (str): cache file path
+
+    Returns:
+        record (tuple): (body, source) of the selected quote, or None if the cache is missing or empty
+        age (float): seconds since the cache was refreshed, or None if it is missing
+    '''
+    if not os.path.exists(filename):
+        return None, None
+
+    cache = sqlite3.connect(f'file:{filename}?mode=ro', uri=True)
+
+    try:
+        meta = dict(cache.execute('SELECT key, value FROM meta;'))
+        age = time.time() - float(meta['refreshed_at'])
+        count = int(meta['count'])
+
+        if not count:
+            return None, age
+
+        record = cache.execute('SELECT body, source FROM quote WHERE n = ?;', (random.randint(1, count),)).fetchone()
+
+        return record, age
+
+    except (sqlite3.Error, KeyError, ValueError) as e:
+        logging.error(f'unreadable cache {filename}: {e}')
+
+        return None, None
+
+    finally:
+        cache.close()
+
+def export_corpus(filename, db_params):
+    '''
+    Writes the quote, tag and quote_tag tables to a binary corpus file (see corpus.py), the
+    same format `flask export-corpus` writes in v3.
+
+    Args:
+        filename (str): corpus file path
+        db_params (dict): psycopg2 connection parameters
+
+    Returns:
+        counts (tuple): number of quotes, tags and links written
+    '''
+    import psycopg2
+    from corpus import write_corpus
+
+    conn = None
+
+    try:
+        conn = psycopg2.connect(**db_params)
+        quotes, tags, links = conn.cursor(), conn.cursor(), conn.cursor()
+        quotes.execute('SELECT id, body, source FROM quote ORDER BY id;')
+        tags.execute('SELECT id, name FROM tag ORDER BY id;')
+        links.execute('SELECT quote_id, tag_id FROM quote_tag;')
+
+        return write_corpus(filename, quotes, tags, links)
+
+    finally:
+        if conn:
+            conn.close()
+
+def select_corpus_quote(filename, tag=None):
+    '''
+    Selects a uniformly random quote from a corpus file, without contacting the database.
+
+    Args:
+        filename (str): corpus file path
+        tag (str): pick among the quotes with this tag (case-insensitive) instead
+
+    Returns:
+        record (tuple): (body, source) of the selected quote, or None if there is none
+    '''
+    from corpus import Corpus
+
+    with Corpus(filename) as corpus:
+        quote = corpus.pick_by_tag(tag) if tag else corpus.pick()
+
+    return (quote['body'], quote['source']) if quote else None
+
+def refresh_in_background():
+    '''
+    Runs this script again with --refresh-cache, detached in its own session, so the
+    greeting neither waits for the refresh nor stops it by exiting.
+
+    Returns:
+        None
+    '''
+    import subprocess
+
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '--refresh-cache'],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+def quote_of_the_day(filename, connect, ini_params=None):
+    '''
+    Reads today's quote from the quote-of-the-day schedule in a JSON file (see v3/qotd.py). The
+    database is only queried when the schedule does not cover today yet; the schedule is
+    then brought up to date with the quote table and saved.
+
+    Args:
+        filename (str): schedule file, written by this function or by `flask qotd` in v3
+        connect (function): opens a connection and returns a cursor on the quote database
+        ini_params (dict): seed and horizon of a new schedule
+
+    Returns:
+        record (tuple): (body, source) of today's quote, or None if there are no quotes
+    '''
+    from qotd import QuoteSchedule
+
+    if os.path.exists(filename):
+        schedule = QuoteSchedule.load(filename)
+    else:
+        schedule = QuoteSchedule(**(ini_params or {}))
+
+    quote = schedule.quote()
+
+    if quote is None or quote['body'] is None:
+        cur = connect()
+        cur.execute('SELECT id FROM quote;')
+        missing = schedule.reconcile(row[0] for row in cur.fetchall())
+
+        if missing:
+            cur.execute('SELECT id, body, source FROM quote WHERE id = ANY(%s);', (missing,))
+            schedule.fill({'id': id, 'body': body, 'source': source} for id, body, source in cur.fetchall())
+
+        schedule.save(filename)
+        quote = schedule.quote()
+
+    return (quote['body'], quote['source']) if quote else None
+
+def render_banner(message, font, width, cache_dir=None):
+    '''
+    Renders a message as a figlet banner. Banners are cached on disk by message, font and
+    width, so pyfiglet (slow to import) is only loaded the first time a banner is needed.
+
+    Args:
+        message (str): text of the banner
+        font (str): figlet font name
+        width (int): terminal width the banner is centered in
+        cache_dir (str): directory of cached banners (None to always render)
+
+    Returns:
+        banner (str): the rendered banner
+    '''
+    path = None
+
+    if cache_dir:
+        path = os.path.join(cache_dir, f'{font}-{width}-{message.encode().hex()}.txt')
+
+        try:
+            with open(path) as file:
+                return file.read()
+
+        except OSError:
+            pass
+
+    import pyfiglet
+
+    banner = pyfiglet.figlet_format(message, font=font, justify='center', width=width)
+
+    if path:
+        try:
+            # written aside and renamed, so a concurrent reader never sees part of a banner
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+
+            with open(tmp, 'w') as file:
+                file.write(banner)
+
+            os.replace(tmp, path)
+
+        except OSError as e:
+            logging.error(f'could not cache banner {path}: {e}')
+
+    return banner
+
+def greet_user(quote, source, banner_dir=None, wait=True):
     '''
     Greets the current user with a welcome message and a quote
 
     Args:
         quote (str): desired quote or message to display
         source (str): author of the quote
+        banner_dir (str): directory of cached banners (see render_banner)
+        wait (bool): wait for a keypress before returning
     
     Returns:
         None
     '''
     # print greeting message for current user (with some additional formatting)
     username = getpass.getuser()
-    terminal = os.get_terminal_size()
+    terminal = shutil.get_terminal_size()
 
     message = f'hello, {username}!'
 
@@ -64,7 +509,7 @@ def greet_user(quote, source):
     print('-' * terminal.columns)
     print()
 
-    print(pyfiglet.figlet_format(message, font='slant', justify='center', width=terminal.columns))
+    print(render_banner(message, BANNER_FONT, terminal.columns, banner_dir))
 
     print()
     print('-' * terminal.columns)
@@ -81,14 +526,43 @@ def greet_user(quote, source):
     print(f'\n{source.center(terminal.columns)}')
 
     # terminate program after keypress
-    input('')
+    if wait:
+        input('')
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Greets the current user with a random quote.')
+    parser.add_argument('--qotd', metavar='FILE',
+                        help='show the quote of the day from the schedule in FILE instead (created if missing)')
+    parser.add_argument('--csv', metavar='FILE',
+                        help='pick the quote from FILE (in the format of data/quote.csv) instead of the database')
+    parser.add_argument('--corpus', metavar='FILE',
+                        help='pick the quote from the corpus FILE (see --export-corpus) instead of the database')
+    parser.add_argument('--tag', help='with --corpus, pick among the quotes with this tag')
+    parser.add_argument('--export-corpus', metavar='FILE',
+                        help='write the quote, tag and quote_tag tables to the corpus FILE and exit')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='copy the quotes into the local cache ([cache] in conf/db.ini) and exit')
+    parser.add_argument('--no-wait', action='store_true',
+                        help='exit right after the greeting instead of waiting for a keypress')
+    cli_args = parser.parse_args()
+
     # set variable for db conn and cursor
     conn = None
     cur = None
 
+    def connect():
+        nonlocal conn, cur
+        import psycopg2
+
+        # open connection to db
+        conn = psycopg2.connect(**args)
+
+        # open cursor to perform db ops
+        cur = conn.cursor()
+
+        return cur
+
     try:
         # set up logging
         logging.basicConfig(
@@ -99,34 +573,56 @@ def main():
         )
 
         # load db config params
-        args = load_ini('conf/db.ini')
+        args = load_ini('conf/db.ini', 'postgresql')
+        cache_params = load_ini('conf/db.ini', 'cache')
+        cache_file = cache_params.get('file')
 
-        # open connection to db
-        conn = psycopg2.connect(**args)
+        if cli_args.refresh_cache:
+            if not cache_file:
+                raise ValueError('no cache file set in the [cache] section of conf/db.ini')
 
-        # open cursor to perform db ops
-        cur = conn.cursor()
+            count = refresh_cache(cache_file, args)
+            logging.debug(f'cache refresh: {count} quotes' if count is not None else 'cache refresh already running')
 
-        # execute query on db to pull a random record from the quote table
-        cur.execute(
-            """
-            SELECT
-                body,
-                source
-            FROM
-                quote
-            OFFSET
-                floor(random() * (SELECT COUNT(id) FROM quote))
-            LIMIT 1;
-            """
-        )
+            return
 
-        # fetch the result of the above query
-        record = cur.fetchone()
+        if cli_args.export_corpus:
+            counts = export_corpus(cli_args.export_corpus, args)
+            print('{} quotes, {} tags and {} links written to {}'.format(*counts, cli_args.export_corpus))
+
+            return
+
+        if cli_args.qotd:
+            # today's quote from the schedule; the db is only opened to extend it
+            record = quote_of_the_day(cli_args.qotd, connect, load_ini('conf/db.ini', 'qotd'))
+        elif cli_args.corpus:
+            # offline: picked from the memory-mapped corpus file
+            record = select_corpus_quote(cli_args.corpus, cli_args.tag)
+
+            if record is None:
+                raise ValueError(f'no quotes in {cli_args.corpus}' + (f' tagged {cli_args.tag}' if cli_args.tag else ''))
+        elif cli_args.csv:
+            # offline: one record read from the CSV through its cached line index
+            record = select_csv_quote(cli_args.csv)
+
+            if record is None:
+                raise ValueError(f'no quotes in {cli_args.csv}')
+        elif cache_file:
+            # pick from the local copy; a missing or stale copy is refreshed in the background
+            record, age = select_cached_quote(cache_file)
+
+            if age is None or age > float(cache_params.get('ttl', CACHE_TTL)):
+                refresh_in_background()
+
+            if record is None:
+                record = select_random_quote(connect())
+        else:
+            # pull a random record from the quote table
+            record = select_random_quote(connect())
         logging.debug('query result = ' + str(record))
 
         # display welcome message
-        greet_user(record[0], record[1])
+        greet_user(record[0], record[1], cache_params.get('banners', BANNER_DIR), wait=not cli_args.no_wait)
 
     except(Exception) as e:
         # TODO clean up error handling and logging
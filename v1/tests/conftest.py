@@ -0,0 +1,5 @@
+import os
+import sys
+
+# quote_shufl is a script, imported from v1/ as when it is run from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
@@ -0,0 +1,12 @@
+# quote_shufl puts v3/ on the path, where corpus lives
+from quote_shufl import select_corpus_quote
+from corpus import write_corpus
+
+def test_picks_from_a_v3_corpus(tmp_path):
+    path = str(tmp_path / 'quotes.corpus')
+    write_corpus(path, [(1, 'First', 'One'), (2, 'Second', None), (5, 'Third', 'Three')],
+                 [(1, 'Courage')], [(2, 1), (5, 1)])
+
+    assert {select_corpus_quote(path) for _ in range(100)} == {('First', 'One'), ('Second', ''), ('Third', 'Three')}
+    assert {select_corpus_quote(path, 'courage') for _ in range(100)} == {('Second', ''), ('Third', 'Three')}
+    assert select_corpus_quote(path, 'nope') is None
@@ -0,0 +1,92 @@
+import mmap
+import os
+import random
+import struct
+
+import quote_shufl
+from quote_shufl import CSV_INDEX_HEADER, build_csv_index, load_csv_index, select_csv_quote
+
+CSV = (
+    'body,source\n'
+    '"Be yourself; everyone else is already taken.",Oscar Wilde\n'
+    '"A quote\n'
+    'over three\n'
+    'lines",Anonymous\n'
+    '\n'
+    '"He said ""stop,""\n'
+    'then left.",\n'
+    'Plain words,"Source, with comma"\n'
+)
+RECORDS = [
+    ('Be yourself; everyone else is already taken.', 'Oscar Wilde'),
+    ('A quote\nover three\nlines', 'Anonymous'),
+    ('He said "stop,"\nthen left.', ''),
+    ('Plain words', 'Source, with comma'),
+]
+
+def write(tmp_path, text):
+    path = tmp_path / 'quote.csv'
+    path.write_text(text, encoding='utf-8')
+
+    return str(path)
+
+def records(filename):
+    # the records the index points at, in file order
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        index = build_csv_index(data, os.fstat(file.fileno()))
+        count = CSV_INDEX_HEADER.unpack_from(index)[3]
+        offsets = struct.unpack_from(f'<{count + 1}Q', index, CSV_INDEX_HEADER.size)
+
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+def test_multiline_records_stay_whole(tmp_path):
+    filename = write(tmp_path, CSV)
+
+    assert [record.rstrip('\n') for record in records(filename)] == [
+        '"Be yourself; everyone else is already taken.",Oscar Wilde',
+        '"A quote\nover three\nlines",Anonymous',
+        '"He said ""stop,""\nthen left.",',
+        'Plain words,"Source, with comma"',
+    ]
+
+def test_every_record_is_picked(tmp_path, monkeypatch):
+    filename = write(tmp_path, CSV)
+    monkeypatch.setattr(quote_shufl, 'random', random.Random(3))
+
+    assert {select_csv_quote(filename) for _ in range(200)} == set(RECORDS)
+
+def test_no_trailing_newline(tmp_path):
+    filename = write(tmp_path, CSV.rstrip('\n'))
+
+    assert len(records(filename)) == 4
+    assert records(filename)[-1] == 'Plain words,"Source, with comma"'
+
+def test_header_only_or_empty(tmp_path):
+    assert select_csv_quote(write(tmp_path, 'body,source\n')) is None
+    assert select_csv_quote(write(tmp_path, '')) is None
+
+def test_index_is_cached_and_rebuilt_when_the_csv_changes(tmp_path):
+    filename = write(tmp_path, CSV)
+    select_csv_quote(filename)
+    index_file = filename + '.idx'
+    cached = open(index_file, 'rb').read()
+
+    assert CSV_INDEX_HEADER.unpack_from(cached)[3] == 4
+
+    with open(filename, 'a', encoding='utf-8') as file:
+        file.write('"One more\nquote",Someone\n')
+
+    assert select_csv_quote(filename) in RECORDS + [('One more\nquote', 'Someone')]
+    assert CSV_INDEX_HEADER.unpack_from(open(index_file, 'rb').read())[3] == 5
+
+    # a cut-short index is rebuilt rather than read
+    with open(index_file, 'r+b') as file:
+        file.truncate(CSV_INDEX_HEADER.size + 8)
+
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        index = load_csv_index(filename, data, os.fstat(file.fileno()))
+
+        assert CSV_INDEX_HEADER.unpack_from(index)[3] == 5
+
+        if isinstance(index, mmap.mmap):
+            index.close()
@@ -0,0 +1,180 @@
+import json
+
+from flask import Blueprint, Response, abort, request
+from werkzeug.exceptions import HTTPException
+
+from paging import MAX_PAGE_SIZE, decode_cursor
+
+# orjson is optional: it serializes several times faster, but the json module gives the same output
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON API for scripts and dashboards, served next to the HTML pages:
+#
+#   GET /api/v1/quotes/random                   a random quote
+#   GET /api/v1/quotes/sample?n=50&tag=courage  n distinct random quotes (the same ones
+#                                               every time with &seed=...)
+#   GET /api/v1/quotes/<id>                     one quote
+#   GET /api/v1/quotes?tag=courage&cursor=...   a page of quotes (of any of the tags with
+#                                               mode=any, without exclude=...), oldest first
+#   GET /api/v1/tags                            every tag
+#
+# Every endpoint takes ?fields=id,body to return only some fields. Errors are returned as
+# {"error": message} with the HTTP status.
+
+API_PREFIX = '/api/v1'
+
+QUOTE_FIELDS = ('id', 'body', 'source')
+TAG_FIELDS = ('id', 'name')
+
+def dumps(obj):
+    '''
+    Serializes obj to compact UTF-8 JSON, with orjson if it is installed.
+
+    Returns:
+        data (bytes): the JSON document
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+def json_response(obj, status=200):
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+def select_fields(allowed):
+    # ?fields=id,body: the fields to return, in the order given; all of them by default
+    arg = request.args.get('fields')
+
+    if arg is None:
+        return allowed
+
+    fields = tuple(dict.fromkeys(field.strip() for field in arg.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+
+    if unknown or not fields:
+        abort(400, f"unknown fields {', '.join(unknown)}; expected some of {', '.join(allowed)}")
+
+    return fields
+
+def quote_object(row, fields):
+    # a quote as the API returns it, from a quote row (id, body) or a combined_tables row (quote_id, quote)
+    values = {
+        'id': row['id'] if 'id' in row else row['quote_id'],
+        'body': row['body'] if 'body' in row else row['quote'],
+        'source': row['source'],
+    }
+
+    return {field: values[field] for field in fields}
+
+def check(result):
+    # PostgresDB methods return the error message instead of raising
+    if isinstance(result, str):
+        abort(500, result)
+
+    return result
+
+def create_api(db):
+    '''
+    Args:
+        db (PostgresDB): the app's database, whose methods (and caches) the API reuses
+
+    Returns:
+        api (Blueprint): the API routes, to register on the app
+    '''
+    api = Blueprint('api', __name__, url_prefix=API_PREFIX)
+
+    @api.errorhandler(HTTPException)
+    def error(exc):
+        return json_response({'error': exc.description}, exc.code)
+
+    @api.route('/quotes/random')
+    def quote_random():
+        fields = select_fields(QUOTE_FIELDS)
+        quote = check(db.quote_select_random())
+
+        if quote is None:
+            abort(404, 'there are no quotes')
+
+        response = json_response(quote_object(quote, fields))
+        # a different quote every time
+        response.cache_control.no_store = True
+
+        return response
+
+    @api.route('/quotes/sample')
+    def quote_sample():
+        fields = select_fields(QUOTE_FIELDS)
+        n = request.args.get('n', '1')
+        tag = request.args.get('tag')
+        seed = request.args.get('seed')
+
+        try:
+            n = int(n)
+
+        except ValueError:
+            abort(400, f'n must be an integer, not {n!r}')
+
+        if not 1 <= n <= MAX_PAGE_SIZE:
+            abort(400, f'n must be between 1 and {MAX_PAGE_SIZE}')
+
+        rows = check(db.quote_sample(n, tag=tag, seed=seed))
+        response = json_response({'quotes': [quote_object(row, fields) for row in rows]})
+
+        if seed is None:
+            response.cache_control.no_store = True
+
+        return response
+
+    @api.route('/quotes/<int:id>')
+    def quote_by_id(id):
+        fields = select_fields(QUOTE_FIELDS)
+        quote = check(db.quote_select_by_id(id))
+
+        if quote is None:
+            abort(404, f'no quote with id {id}')
+
+        return json_response(quote_object(dict(quote, id=id), fields))
+
+    @api.route('/quotes')
+    def quotes():
+        fields = select_fields(QUOTE_FIELDS)
+        tags = tuple(name.strip() for name in request.args.get('tag', '').split(',') if name.strip())
+        exclude = tuple(name.strip() for name in request.args.get('exclude', '').split(',') if name.strip())
+        mode = request.args.get('mode', 'all')
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+
+        if mode not in ('all', 'any'):
+            abort(400, f'unknown mode {mode!r}; expected all or any')
+
+        try:
+            after = decode_cursor(cursor, ('id',)) if cursor else None
+
+            if after is not None and not isinstance(after[0], int):
+                raise ValueError(cursor)
+
+        except ValueError:
+            abort(400, f'invalid cursor {cursor!r}')
+
+        # tag queries are answered by the tag index, other pages by the quote table
+        if tags:
+            page = check(db.combined_tables_select_page_by_tags(tags, mode, exclude, after=after, limit=limit))
+        else:
+            page = check(db.quote_select_page(after=after, limit=limit))
+
+        return json_response({
+            'quotes': [quote_object(row, fields) for row in page.rows],
+            'next': page.next,
+        })
+
+    @api.route('/tags')
+    def tags():
+        fields = select_fields(TAG_FIELDS)
+        rows = check(db.tag_select_all())
+
+        return json_response({'tags': [{field: row[field] for field in fields} for row in rows]})
+
+    return api
@@ -1,14 +1,29 @@
+import io
 import os
+import csv
+import json
+import itertools
+import functools
+import hashlib
+import time
 import getpass
 
+import click
 import psycopg2
 from dotenv import load_dotenv
-from flask import Flask, render_template, url_for, flash, redirect
+from werkzeug.http import http_date, parse_date, quote_etag
+from flask import Flask, render_template, url_for, flash, redirect, request, abort, Response, stream_with_context, jsonify, session
 import flask_login
 
+from api import create_api
+from combined import COMBINED_TABLE
+from corpus import write_corpus
 from db import PostgresDB
-from forms import QuoteForm, QuoteTagForm, TagForm, LoginForm, PublicSelectTagForm
-from user import User
+from forms import QuoteForm, QuoteTagForm, TagForm, LoginForm, PublicSelectTagForm, BulkForm
+from paging import MAX_PAGE_SIZE, decode_cursor
+from qotd import HORIZON, QuoteSchedule
+from search import highlight
+from user import User, password_fingerprint
 
 # TODO set up logging
 # TODO clean up error handling 
@@ -18,18 +33,287 @@ proj_dir = os.path.dirname(__file__)
 env_path = os.path.join(proj_dir, '.env')
 load_dotenv(env_path)
 
+# columns of the rows each /admin/bulk action takes, as in the headers of data/*.csv
+BULK_COLUMNS = {
+    'quote_insert': ('body', 'source'),
+    'tag_insert': ('name',),
+    'quotetag_insert': ('quote_id', 'tag_id'),
+    'quotetag_delete': ('quote_id', 'tag_id'),
+}
+BULK_MAX_ROWS = 10000
+
+# seconds a login verified against the database is trusted from the signed session alone
+SESSION_AUTH_TTL = float(os.environ.get('SESSION_AUTH_TTL', 300))
+
+# JSON file of weights for the random quote on /, e.g. {"tags": {"Courage": 3}, "sources": {"Anonymous": 0.5}}
+QUOTE_WEIGHTS = os.environ.get('QUOTE_WEIGHTS')
+
+# schedule file of the quote of the day shown on / (written by `flask qotd`); unset for a random quote
+QOTD_FILE = os.environ.get('QOTD_FILE')
+
+# seconds browsers and proxies may reuse a public page before asking whether it changed
+HTTP_MAX_AGE = int(os.environ.get('HTTP_MAX_AGE', 0))
+
 # create application instance
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 
-# create database instance
-db = PostgresDB(os.environ.get('PG_DB'), os.environ.get('PG_USER'), os.environ.get('PG_PW'))
+# create database instance (backed by a pool shared by all worker threads)
+db = PostgresDB(os.environ.get('PG_DB'), os.environ.get('PG_USER'), os.environ.get('PG_PW'),
+                minconn=int(os.environ.get('PG_POOL_MIN', 1)),
+                maxconn=int(os.environ.get('PG_POOL_MAX', 10)),
+                timeout=float(os.environ.get('PG_POOL_TIMEOUT', 30)),
+                ids_ttl=float(os.environ.get('RANDOM_IDS_TTL', 300)),
+                cache_size=int(os.environ.get('CACHE_SIZE', 1024)),
+                cache_ttl=float(os.environ.get('CACHE_TTL', 60)),
+                search_fallback=os.environ.get('SEARCH_FALLBACK', '1') == '1')
+
+# keep this process's caches in step with writes made by other app processes
+db.start_listener()
+
+# table and column names are read once here and again only after a DDL change
+schema_error = db.load_schema()
+
+def missing_objects():
+    # database objects the pages need, which `flask init-db` creates; the app only checks for
+    # them, since its database user need not be allowed to create tables
+    missing = []
+
+    if COMBINED_TABLE not in db.schema.tables():
+        missing.append(f'table {COMBINED_TABLE}')
+
+    if 'search' not in db.schema.columns('quote'):
+        missing.append('column quote.search')
+
+    if 'source' not in db.schema.tables():
+        missing.append('table source')
+
+    # public pages are validated by data version (see conditional())
+    if db.data_version() is None:
+        missing.append('sequence data_version')
+
+    return missing
+
+if schema_error:
+    app.logger.error('could not read the database schema: %s', schema_error)
+elif missing_objects():
+    app.logger.error('the database is missing %s; run `flask init-db` as a user allowed to create them',
+                     ', '.join(missing_objects()))
+
+# marks search matches in templates: {{ row['quote'] | highlight }}
+app.add_template_filter(highlight)
+
+def templates_digest():
+    # identifies this release's templates, so pages cached before a deploy are not reused
+    digest = hashlib.md5()
+
+    for dirpath, dirnames, filenames in sorted(os.walk(os.path.join(proj_dir, 'templates'))):
+        for filename in sorted(filenames):
+            with open(os.path.join(dirpath, filename), 'rb') as file:
+                digest.update(file.read())
+
+    return digest.hexdigest()[:8]
+
+TEMPLATES_DIGEST = templates_digest()
+
+# users whose password changed or who were removed, with the time it happened; sessions
+# verified before then must be checked against the database again
+revoked_users = {}
+
+def on_users_change(event):
+    revoked_users[event['key'].get('username')] = time.time()
+
+db.changes.subscribe(on_users_change, tables=('users',))
+
+# JSON API under /api/v1, on the same database and caches as the pages
+app.register_blueprint(create_api(db))
+
+# quote of the day, read from QOTD_FILE by load_qotd()
+qotd = None
+qotd_mtime = None
+
+def on_quote_change(event):
+    # keeps the loaded schedule in step with quotes added, edited and deleted since it was
+    # written; every process makes the same adjustments, as `flask qotd` does on its next run
+    if qotd is None or event['table'] is None:
+        return
+
+    key = event['key']
+
+    for id in key['ids'] if 'ids' in key else [key.get('id')]:
+        if event['op'] == 'insert':
+            qotd.add(id)
+        elif event['op'] == 'delete':
+            qotd.remove(id)
+        elif event['op'] == 'update':
+            qotd.update(id)
+
+db.changes.subscribe(on_quote_change, tables=('quote',))
 
 # set up + configure login manager
 login_manager = flask_login.LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
        
+@app.cli.command('load-data')
+@click.argument('data_dir', default=os.path.join(proj_dir, os.pardir, 'data'))
+def load_data(data_dir):
+    """Bulk-loads quote.csv, tag.csv and quote_tag.csv from DATA_DIR."""
+    start = time.perf_counter()
+
+    with open(os.path.join(data_dir, 'quote.csv'), newline='') as quote_file, \
+         open(os.path.join(data_dir, 'tag.csv'), newline='') as tag_file, \
+         open(os.path.join(data_dir, 'quote_tag.csv'), newline='') as quotetag_file:
+        result = db.bulk_load(quote_file, tag_file, quotetag_file)
+
+    elapsed = time.perf_counter() - start
+
+    if isinstance(result, str):
+        raise click.ClickException(result)
+
+    for table, (read, inserted) in result.items():
+        click.echo(f'{table}: {read} rows read, {inserted} inserted')
+
+    rows = sum(read for read, inserted in result.values())
+    click.echo(f'{rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s)')
+
+@app.cli.command('init-db')
+def init_db():
+    """Creates the tables, columns and triggers the app needs; running it again is harmless."""
+    if COMBINED_TABLE not in db.schema.tables():
+        response = db.combined_tables_rebuild()
+
+        if response:
+            raise click.ClickException(response)
+
+        click.echo(f'created {COMBINED_TABLE}')
+
+    if 'search' not in db.schema.columns('quote'):
+        response = db.quote_search_setup()
+
+        if response:
+            raise click.ClickException(response)
+
+        click.echo('added quote.search')
+
+    if 'source' not in db.schema.tables():
+        response = db.source_setup()
+
+        if response:
+            raise click.ClickException(response)
+
+        click.echo('created source')
+
+    if db.data_version() is None:
+        response = db.data_version_setup()
+
+        if response:
+            raise click.ClickException(response)
+
+        click.echo('created data_version')
+
+    click.echo('the database is ready')
+
+@app.cli.command('rebuild-combined')
+def rebuild_combined():
+    """Rebuilds combined_tables_mat, its indexes and triggers from scratch."""
+    start = time.perf_counter()
+    response = db.combined_tables_rebuild()
+
+    if response:
+        raise click.ClickException(response)
+
+    click.echo(f'rebuilt {COMBINED_TABLE} in {time.perf_counter() - start:.2f}s')
+
+@app.cli.command('qotd')
+@click.option('--days', type=int, help=f'Days to schedule ahead (default {HORIZON}).')
+@click.option('--seed', default='quote-shufl', help='Seed of a new schedule.')
+def schedule_qotd(days, seed):
+    """Schedules the quote of the day in QOTD_FILE, adjusting it for added and deleted quotes."""
+    if not QOTD_FILE:
+        raise click.ClickException('set QOTD_FILE in .env first')
+
+    path = os.path.join(proj_dir, QOTD_FILE)
+    schedule = QuoteSchedule.load(path) if os.path.exists(path) else QuoteSchedule(seed)
+
+    if days is not None:
+        schedule.horizon = days
+
+    ids = db.quote_select_ids()
+
+    if isinstance(ids, str):
+        raise click.ClickException(ids)
+
+    missing = schedule.reconcile(row['id'] for row in ids)
+    rows = db.quote_select_by_ids(missing) if missing else []
+
+    if isinstance(rows, str):
+        raise click.ClickException(rows)
+
+    schedule.fill(rows)
+    schedule.save(path)
+
+    quote = schedule.quote()
+    click.echo(f'{len(schedule.days)} days scheduled from {schedule.start}')
+
+    if quote:
+        click.echo(f"today: {quote['body']} ({quote['source']})")
+
+@app.cli.command('export-corpus')
+@click.argument('path')
+def export_corpus(path):
+    """Writes the quote, tag and quote_tag tables to the binary corpus file PATH (see corpus.py)."""
+    start = time.perf_counter()
+
+    try:
+        quotes, tags, links = write_corpus(
+            path,
+            ((row['id'], row['body'], row['source']) for row in db.quote_select_iter()),
+            ((row['id'], row['name']) for row in db.tag_select_iter()),
+            ((row['quote_id'], row['tag_id']) for row in db.quotetag_select_iter()),
+        )
+
+    except (psycopg2.Error, OSError) as exc:
+        raise click.ClickException(str(exc))
+
+    click.echo(f'{quotes} quotes, {tags} tags and {links} links written to {path} '
+               f'({os.path.getsize(path):,} bytes) in {time.perf_counter() - start:.2f}s')
+
+@app.cli.command('set-password')
+@click.argument('username')
+@click.password_option()
+def set_password(username, password):
+    """Changes an admin user's password, signing out their sessions."""
+    response = db.users_update_password(username, password)
+
+    if response:
+        raise click.ClickException(response)
+
+@app.cli.command('delete-user')
+@click.argument('username')
+def delete_user(username):
+    """Removes an admin user, signing out their sessions."""
+    response = db.users_delete_one(username)
+
+    if response:
+        raise click.ClickException(response)
+
+def table_columns(table, rows):
+    # column names of a streamed export, from its first row (the schema registry's if there
+    # are no rows); returns them with the rows, first row included
+    rows = iter(rows)
+    first = next(rows, None)
+
+    if first is not None:
+        return list(first.keys()), itertools.chain([first], rows)
+
+    cols = db.table_get_all_colnames(table)
+
+    if isinstance(cols, str):
+        abort(500, cols)
+
+    return [col['column_name'] for col in cols], rows
+
 def flash_validation_errors(form):
     if form.errors:
         keys = form.errors.keys()
@@ -38,13 +322,241 @@ def flash_validation_errors(form):
             # TODO clean up message flashing 
             flash(f'{key}: {form.errors[key]}', 'error')
 
+def page_args(keys):
+    # reads the keyset pagination arguments (?after=, ?before=, ?limit=) of a table page
+    try:
+        after = request.args.get('after')
+        before = request.args.get('before')
+        limit = request.args.get('limit', type=int)
+
+        return {
+            'after': decode_cursor(after, keys) if after else None,
+            'before': decode_cursor(before, keys) if before else None,
+            'limit': limit,
+        }
+
+    except ValueError:
+        abort(400)
+
+def tag_args():
+    # reads a multi-tag query: ?tags=courage,wisdom&mode=all|any&exclude=love
+    def names(arg):
+        return tuple(name.strip() for name in request.args.get(arg, '').split(',') if name.strip())
+
+    mode = request.args.get('mode', 'all')
+
+    if mode not in ('all', 'any'):
+        abort(400)
+
+    return {'tags': names('tags'), 'mode': mode, 'exclude': names('exclude')}
+
+def tag_query_title(tags, mode, exclude):
+    # e.g. '.[courage & wisdom - love]'
+    title = f' {"&" if mode == "all" else "|"} '.join(tags)
+
+    if exclude:
+        title += ' - ' + ' - '.join(exclude)
+
+    return f'.[{title.lower()}]'
+
+def iter_tagged_rows(tags, mode, exclude):
+    # every row of a multi-tag query, a page at a time
+    after = None
+
+    while True:
+        page = db.combined_tables_select_page_by_tags(tags, mode, exclude, after=after, limit=MAX_PAGE_SIZE)
+
+        if isinstance(page, str):
+            return
+
+        yield from page.rows
+
+        if page.next is None:
+            return
+
+        after = decode_cursor(page.next, ('quote_id',))
+
+def stream_template(template_name, **context):
+    # renders the template incrementally, sending each chunk as soon as its rows arrive
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(64)
+
+    return Response(stream_with_context(stream))
+
+def wants_export():
+    # ?export=all streams every row of a table page instead of one page
+    return request.args.get('export') == 'all'
+
+def load_qotd():
+    # (re)reads QOTD_FILE when `flask qotd` has rewritten it
+    global qotd, qotd_mtime
+
+    if not QOTD_FILE:
+        return
+
+    path = os.path.join(proj_dir, QOTD_FILE)
+
+    try:
+        mtime = os.stat(path).st_mtime
+
+    except OSError:
+        return
+
+    if mtime == qotd_mtime:
+        return
+
+    qotd_mtime = mtime
+
+    try:
+        qotd = QuoteSchedule.load(path)
+
+    except (OSError, ValueError, KeyError) as exc:
+        app.logger.warning('could not read the quote of the day from %s: %s', path, exc)
+
+def todays_quote():
+    # the quote of the day from memory; only a quote that took over the day of a deleted
+    # quote since the schedule was written is read (once) from the database
+    load_qotd()
+    quote = qotd.quote() if qotd is not None else None
+
+    if quote and quote['body'] is None:
+        row = db.quote_select_by_id(quote['id'])
+
+        if not row or isinstance(row, str):
+            return None
+
+        qotd.fill([dict(row, id=quote['id'])])
+        quote = qotd.quote()
+
+    return quote
+
+weights_mtime = None
+
+def load_weights():
+    # (re)reads QUOTE_WEIGHTS when the file has changed, so weights can be edited without a
+    # restart; only the quotes whose weight changed are moved by the weighted selector
+    global weights_mtime
+
+    if not QUOTE_WEIGHTS:
+        return
+
+    path = os.path.join(proj_dir, QUOTE_WEIGHTS)
+
+    try:
+        mtime = os.stat(path).st_mtime
+
+    except OSError:
+        return
+
+    if mtime == weights_mtime:
+        return
+
+    # a file that cannot be used is not read again until it changes; the last weights stay
+    weights_mtime = mtime
+
+    try:
+        with open(path) as file:
+            weights = json.load(file)
+
+        db.weights.set_weights(weights.get('tags'), weights.get('sources'))
+
+    except (OSError, ValueError, TypeError, AttributeError) as exc:
+        app.logger.warning('could not read weights from %s: %s', path, exc)
+
+def page_validators(version, private=False):
+    # ETag, Last-Modified and Cache-Control headers of a public page, from the data version
+    # (None while it is unknown). Private pages carry a CSRF token, which is tied to the
+    # session and expires, so only the browser may keep them and only until it expires
+    if version is None:
+        return None
+
+    value, modified = version
+    etag = f'{TEMPLATES_DIGEST}-{value}'
+
+    if private:
+        etag += f"-{int(time.time() // app.config.get('WTF_CSRF_TIME_LIMIT', 3600))}"
+
+    return {
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(modified),
+        'Cache-Control': f"{'private' if private else 'public'}, max-age={HTTP_MAX_AGE}, must-revalidate",
+    }
+
+def not_modified(headers):
+    # whether the client's copy (If-None-Match, or If-Modified-Since without it) is current
+    etag = headers['ETag'].strip('"')
+
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since:
+        return parse_date(headers['Last-Modified']) <= request.if_modified_since
+
+    return False
+
+def conditional(private=False):
+    # public pages change only when the data does: GET responses get validators from the
+    # data version, and a request for the version the client already has is answered with
+    # 304 before the view runs, so no query is made and no template rendered
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            headers = page_validators(db.data_version(), private) if request.method == 'GET' else None
+
+            if headers is None:
+                return view(*args, **kwargs)
+
+            if not_modified(headers):
+                return Response(status=304, headers=headers)
+
+            response = app.make_response(view(*args, **kwargs))
+
+            if response.status_code == 200:
+                response.headers.update(headers)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+def parse_bulk_rows(text, fmt, columns):
+    # CSV input needs a header row naming `columns`; JSON input is a list of objects with
+    # those keys, or a list of lists in that order. *_id columns must be integers
+    if fmt == 'json':
+        items = json.loads(text)
+        rows = [tuple(item[col] for col in columns) if isinstance(item, dict) else tuple(item) for item in items]
+    else:
+        rows = [tuple(item[col] for col in columns) for item in csv.DictReader(io.StringIO(text))]
+
+    for row in rows:
+        if len(row) != len(columns):
+            raise ValueError(f'expected {len(columns)} values per row, got {row}')
+
+    return [tuple(int(value) if col.endswith('_id') else value for col, value in zip(columns, row)) for row in rows]
+
 @login_manager.user_loader
 def load_user(username):
+    fingerprint = session.get('auth_fp')
+    verified_at = session.get('auth_at', 0)
+
+    if not fingerprint:
+        return
+
+    # recently verified and not revoked since (a resync revokes everyone): no lookup needed
+    revoked_at = max(revoked_users.get(username, 0), revoked_users.get(None, 0))
+
+    if time.time() - verified_at < SESSION_AUTH_TTL and verified_at > revoked_at:
+        return User(username)
+
+    # otherwise check the (cached) user row; a changed password invalidates the session
     is_in_db = db.users_select_by_username(username)
 
-    if not is_in_db:
+    if not is_in_db or isinstance(is_in_db, str) or password_fingerprint(is_in_db['password']) != fingerprint:
         return 
     else:
+        session['auth_at'] = time.time()
         user = User(username)      
 
         return user
@@ -52,9 +564,20 @@ def load_user(username):
 @app.route('/admin')
 @flask_login.login_required
 def admin():
-    rows = db.combined_tables_select_all(distinct=False)
+    if wants_export():
+        return stream_template('admin.html', rows=db.combined_tables_select_iter(distinct=False))
+
+    page = db.combined_tables_select_page(distinct=False, **page_args(('quote_id', 'tag_id')))
+
+    if isinstance(page, str):
+        abort(500, page)
 
-    return render_template('admin.html', rows=rows)
+    return render_template('admin.html', rows=page.rows, pager=page)
+
+@app.route('/admin/stats')
+@flask_login.login_required
+def stats():
+    return jsonify(db.stats())
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -63,11 +586,15 @@ def login():
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
-        user_id_found = db.users_verify_password(username, password) # user id from Postgres; password hashed in backend
+        user_found = db.users_verify_password(username, password) # user id and hash from Postgres; password hashed in backend
         
-        if user_id_found:
+        if user_found and not isinstance(user_found, str):
             user = User(username)
             flask_login.login_user(user)
+
+            # carry the verified identity in the signed session so later requests can skip the lookup
+            session['auth_fp'] = password_fingerprint(user_found['password'])
+            session['auth_at'] = time.time()
             return redirect(url_for('admin'))
                 
         else:
@@ -81,6 +608,8 @@ def login():
 @app.route('/logout')
 def logout():
     flask_login.logout_user()
+    session.pop('auth_fp', None)
+    session.pop('auth_at', None)
     flash('Successfully logged out.', 'message')
     
     return redirect(url_for('login'))
@@ -88,21 +617,116 @@ def logout():
 @app.route('/')
 def index():
     username = getpass.getuser()
-    quote = db.quote_select_random()
+    quote = todays_quote()
+
+    if quote is None:
+        load_weights()
+        quote = db.quote_select_weighted() if db.weights.configured else db.quote_select_random()
+
+    if isinstance(quote, str):
+        abort(500, quote)
 
     return render_template('index.html',
                             quote=quote, 
                             username=username)   
 
 @app.route('/quotes')
+@conditional()
 def quotes_public():
-    rows = db.combined_tables_select_all()
-    
+    if request.args.get('tags'):
+        return quotes_by_tags_public()
+
+    if wants_export():
+        return stream_template('table_auto_public.html', 
+                                page='[quotes]', 
+                                rows=db.combined_tables_select_iter())
+
+    pager = db.combined_tables_select_page(**page_args(('quote_id',)))
+
+    if isinstance(pager, str):
+        abort(500, pager)
+
     return render_template('table_auto_public.html', 
                             page='[quotes]', 
-                            rows=rows)
+                            rows=pager.rows,
+                            pager=pager)
+
+def quotes_by_tags_public():
+    # /quotes?tags=...: intersection, union and exclusion queries answered by the tag index
+    args = tag_args()
+    page = tag_query_title(**args)
+
+    if wants_export():
+        return stream_template('table_auto_public.html',
+                                page=page,
+                                rows=iter_tagged_rows(**args))
+
+    pager = db.combined_tables_select_page_by_tags(**args, **page_args(('quote_id',)))
+
+    if isinstance(pager, str):
+        abort(500, pager)
+
+    return render_template('table_auto_public.html',
+                            page=page,
+                            rows=pager.rows,
+                            pager=pager)
+
+@app.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    pager = None
+
+    if q:
+        pager = db.quote_search(q, offset=request.args.get('offset', 0, type=int),
+                                   limit=request.args.get('limit', type=int))
+
+        if isinstance(pager, str):
+            abort(500, pager)
+
+    return render_template('search.html',
+                            q=q,
+                            rows=pager.rows if pager else [],
+                            pager=pager)
+
+@app.route('/sources')
+def sources_public():
+    q = request.args.get('q', '').strip()
+
+    # a lookup lists the best matches; browsing lists every source a page at a time
+    if q:
+        rows = db.source_lookup(q)
+        pager = None
+    else:
+        pager = db.source_select_page(**page_args(('name',)))
+        rows = pager.rows if not isinstance(pager, str) else pager
+
+    if isinstance(rows, str):
+        abort(500, rows)
+
+    return render_template('sources.html', q=q, rows=rows, pager=pager)
+
+@app.route('/sources/<int:id>')
+def source_public(id):
+    source = db.source_select_by_id(id)
+
+    if not source:
+        abort(404)
+
+    if isinstance(source, str):
+        abort(500, source)
+
+    pager = db.quote_select_page_by_source(source['name'], **page_args(('id',)))
+
+    if isinstance(pager, str):
+        abort(500, pager)
+
+    return render_template('table_auto_public.html',
+                            page=f".[{source['name']}]",
+                            rows=pager.rows,
+                            pager=pager)
 
 @app.route('/tags', methods=['GET', 'POST'])
+@conditional(private=True)
 def tags_public():
     choices = [(row['name'], row['name']) for row in db.tag_select_all()]
 
@@ -116,23 +740,42 @@ def tags_public():
     return render_template('tags_public.html', form=form)
 
 @app.route('/quotes/<string:tag>')
+@conditional()
 def quotes_tagged_public(tag):
-    rows = db.combined_tables_select_by_tag(tag)
+    pager = db.combined_tables_select_page_by_tag(tag, **page_args(('quote_id',)))
+
+    if isinstance(pager, str):
+        abort(500, pager)
+
     page = f'.[{tag.lower()}]'
-    
+
     return render_template('table_auto_public.html', 
                             page=page, 
-                            rows=rows)
+                            rows=pager.rows,
+                            pager=pager)
 
 @app.route('/admin/quotes') 
 @flask_login.login_required
 def quote():
-    cols = db.table_get_all_colnames('quote')
-    rows = db.quote_select_all()
+    if wants_export():
+        cols, rows = table_columns('quote', db.quote_select_iter())
+
+        return stream_template('table_auto.html',
+                                cols=cols,
+                                rows=rows,
+                                h_value='[quote]',
+                                function_new='quote_new',
+                                function_update='quote_update')
+
+    page = db.quote_select_page(**page_args(('id',)))
+
+    if isinstance(page, str):
+        abort(500, page)
 
     return render_template('table_auto.html', 
-                            cols=cols, 
-                            rows=rows, 
+                            cols=page.cols,
+                            rows=page.rows, 
+                            pager=page,
                             h_value='[quote]', 
                             function_new='quote_new', 
                             function_update= 'quote_update')
@@ -186,12 +829,25 @@ def quote_new():
 @app.route('/admin/quote_tags')
 @flask_login.login_required
 def quote_tag():
-    cols = db.table_get_all_colnames('quote_tag')
-    rows = db.quotetag_select_all()
+    if wants_export():
+        cols, rows = table_columns('quote_tag', db.quotetag_select_iter())
+
+        return stream_template('table_auto.html',
+                                cols=cols,
+                                rows=rows,
+                                h_value='[quote_tag]',
+                                function_new='quote_tag_new',
+                                function_update='quote_tag_update')
+
+    page = db.quotetag_select_page(**page_args(('quote_id', 'tag_id')))
+
+    if isinstance(page, str):
+        abort(500, page)
 
     return render_template('table_auto.html',
-                            cols=cols, 
-                            rows=rows, 
+                            cols=page.cols,
+                            rows=page.rows, 
+                            pager=page,
                             h_value='[quote_tag]', 
                             function_new='quote_tag_new',
                             function_update='quote_tag_update')
@@ -239,12 +895,25 @@ def quote_tag_new():
 @app.route('/admin/tags')
 @flask_login.login_required
 def tag():
-    cols = db.table_get_all_colnames('tag')
-    rows = db.tag_select_all()
+    if wants_export():
+        cols, rows = table_columns('tag', db.tag_select_iter())
+
+        return stream_template('table_auto.html',
+                                cols=cols,
+                                rows=rows,
+                                h_value='[tag]',
+                                function_new='tag_new',
+                                function_update='tag_update')
+
+    page = db.tag_select_page(**page_args(('id',)))
+
+    if isinstance(page, str):
+        abort(500, page)
 
     return render_template('table_auto.html',
-                            cols=cols, 
-                            rows=rows, 
+                            cols=page.cols,
+                            rows=page.rows, 
+                            pager=page,
                             h_value='[tag]', 
                             function_new='tag_new',
                             function_update='tag_update')
@@ -269,6 +938,49 @@ def tag_new():
     return render_template('form_tag_new.html', 
                             form=form)
 
+@app.route('/admin/bulk', methods=['GET', 'POST'])
+@flask_login.login_required
+def bulk():
+    form = BulkForm()
+    results = None
+
+    if form.validate_on_submit():
+        action = form.bulk_action.data
+        upload = form.bulk_file.data
+        text = upload.read().decode('utf-8') if upload and upload.filename else form.bulk_data.data
+
+        try:
+            rows = parse_bulk_rows(text, form.bulk_format.data, BULK_COLUMNS[action])
+
+        except (ValueError, KeyError, TypeError) as exc:
+            flash(f'invalid {form.bulk_format.data} input: {exc!r}', 'error')
+            rows = []
+
+        if len(rows) > BULK_MAX_ROWS:
+            flash(f'too many rows ({len(rows)}); the limit is {BULK_MAX_ROWS}', 'error')
+
+        elif rows:
+            if action == 'quote_insert':
+                results = db.quote_insert_many(rows)
+            elif action == 'tag_insert':
+                results = db.tag_insert_many([name for (name,) in rows])
+            elif action == 'quotetag_insert':
+                results = db.quotetag_insert_many(rows)
+            elif action == 'quotetag_delete':
+                results = db.quotetag_delete_many(rows)
+
+            if isinstance(results, str):
+                flash(results, 'error')
+                results = None
+            else:
+                flash(f'{len(results)} rows processed', 'message')
+
+    flash_validation_errors(form)
+
+    return render_template('form_bulk.html',
+                            form=form,
+                            results=results)
+
 @app.route('/admin/tags/<int:id>', methods=['GET', 'POST'])
 @flask_login.login_required
 def tag_update(id):
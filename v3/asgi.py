@@ -0,0 +1,180 @@
+import os
+import getpass
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response, render_template, request
+from werkzeug.exceptions import HTTPException, InternalServerError
+
+from app import QOTD_FILE, QUOTE_WEIGHTS, app, db, not_modified, page_args, page_validators, wants_export
+from db_async import AsyncPostgresDB
+
+# ASGI entry point: `uvicorn asgi:application`
+#
+# The hot public pages (/, /quotes, /quotes/<tag>) run as coroutines on AsyncPostgresDB, so
+# a single process can keep thousands of them waiting on Postgres without a thread each.
+# Every other request (admin pages, forms, exports) is handed to the Flask app unchanged.
+
+# shares the Flask app's query cache, random-id selector, schema registry, data version and
+# change feed
+adb = AsyncPostgresDB(os.environ.get('PG_DB'), os.environ.get('PG_USER'), os.environ.get('PG_PW'),
+                      minconn=int(os.environ.get('PG_POOL_MIN', 1)),
+                      maxconn=int(os.environ.get('PG_POOL_MAX', 10)),
+                      timeout=float(os.environ.get('PG_POOL_TIMEOUT', 30)),
+                      cache=db.cache,
+                      selector=db.selector,
+                      schema=db.schema,
+                      version=db.version,
+                      changes=db.changes)
+
+wsgi_app = WsgiToAsgi(app)
+url_adapter = app.url_map.bind('')
+
+def request_context(scope):
+    # Flask request context built from the ASGI scope, for url_for() and request.args;
+    # never hold it across an await, since other requests run on the same thread
+    headers = [(key.decode('latin-1'), value.decode('latin-1')) for key, value in scope['headers']]
+    host = dict(headers).get('host') or '{}:{}'.format(*scope.get('server') or ('localhost', 80))
+
+    return app.test_request_context(scope['path'],
+                                    base_url=f"{scope.get('scheme', 'http')}://{host}",
+                                    query_string=scope['query_string'].decode('latin-1'),
+                                    headers=[(key, value) for key, value in headers if key != 'host'])
+
+def server_error(ctx, description):
+    # the response abort(500, description) gives in a Flask view
+    with ctx:
+        return app.make_response(app.handle_http_exception(InternalServerError(description)))
+
+async def validators(ctx):
+    # the validators app.conditional() gives the Flask views, with the data version read
+    # through asyncpg if this process does not know it yet
+    version = await adb.data_version()
+
+    with ctx:
+        return page_validators(version)
+
+###########################################################
+#   async views (return None to defer to the Flask app)   #
+###########################################################
+
+async def index(scope):
+    # the quote of the day and weighted picks are served by the Flask app
+    if QOTD_FILE or QUOTE_WEIGHTS:
+        return None
+
+    quote = await adb.quote_select_random()
+
+    if isinstance(quote, str):
+        return server_error(request_context(scope), quote)
+
+    with request_context(scope):
+        return app.make_response(render_template('index.html',
+                                                  quote=quote,
+                                                  username=getpass.getuser()))
+
+async def quotes_public(scope):
+    ctx = request_context(scope)
+
+    with ctx:
+        # multi-tag queries use the tag index of the Flask app's PostgresDB
+        if wants_export() or request.args.get('tags'):
+            return None
+
+        args = page_args(('quote_id',))
+
+    headers = await validators(ctx)
+
+    with ctx:
+        if headers and not_modified(headers):
+            return Response(status=304, headers=headers)
+
+    pager = await adb.combined_tables_select_page(**args)
+
+    if isinstance(pager, str):
+        return server_error(ctx, pager)
+
+    with ctx:
+        response = app.make_response(render_template('table_auto_public.html',
+                                                      page='[quotes]',
+                                                      rows=pager.rows,
+                                                      pager=pager))
+        response.headers.update(headers or {})
+
+        return response
+
+async def quotes_tagged_public(scope, tag):
+    ctx = request_context(scope)
+
+    with ctx:
+        args = page_args(('quote_id',))
+
+    headers = await validators(ctx)
+
+    with ctx:
+        if headers and not_modified(headers):
+            return Response(status=304, headers=headers)
+
+    pager = await adb.combined_tables_select_page_by_tag(tag, **args)
+
+    if isinstance(pager, str):
+        return server_error(ctx, pager)
+
+    with ctx:
+        response = app.make_response(render_template('table_auto_public.html',
+                                                      page=f'.[{tag.lower()}]',
+                                                      rows=pager.rows,
+                                                      pager=pager))
+        response.headers.update(headers or {})
+
+        return response
+
+# Flask endpoint name -> async view
+async_views = {
+    'index': index,
+    'quotes_public': quotes_public,
+    'quotes_tagged_public': quotes_tagged_public,
+}
+
+###########################################################
+#   ASGI plumbing                                         #
+###########################################################
+
+async def send_response(send, response):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await adb.open()
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif message['type'] == 'lifespan.shutdown':
+            await adb.db_close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        try:
+            endpoint, view_args = url_adapter.match(scope['path'], method='GET')
+            view = async_views.get(endpoint)
+            response = await view(scope, **view_args) if view else None
+
+        except HTTPException:
+            # unknown path, redirect or bad arguments: let Flask produce the response
+            response = None
+
+        if response is not None:
+            return await send_response(send, response)
+
+    await wsgi_app(scope, receive, send)
@@ -0,0 +1,123 @@
+'''
+Benchmarks PostgresDB.quote_select_random() end to end across corpus sizes, to show that
+picking a random quote costs the same for 100 rows as for 10M rows: the id is picked from the
+in-memory id array and the quote fetched by primary key.
+
+The quotes are generated in a scratch schema (quote_bench) of the database in .env, which
+is dropped afterwards; every third id is deleted to mimic the gaps left by deleted quotes.
+For each size it reports the first call (which loads the ids), the median and 99th
+percentile of later calls, and a call made right after the ids went stale (answered from
+the old ids while fresh ones are read in the background).
+
+Usage:
+    python bench_random.py [--calls N] [--max-rows N]
+'''
+import argparse
+import os
+import statistics
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+from db import PostgresDB
+
+SIZES = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+SCHEMA = 'quote_bench'
+
+def fill(conn, rows):
+    '''
+    Grows the scratch quote table to `rows` quotes (ids 1 to rows * 3 / 2, without every third).
+    '''
+    with conn.cursor() as cur:
+        cur.execute('SELECT coalesce(max(id), 0) FROM quote;')
+        top = cur.fetchone()[0]
+        cur.execute(
+            """
+            INSERT INTO quote (id, body, source)
+            SELECT id, 'quote ' || id, 'source ' || (id %% 1000)
+            FROM generate_series(%s, %s) id
+            WHERE id %% 3 <> 0;
+            """,
+            (top + 1, rows + rows // 2)
+        )
+
+    conn.commit()
+
+def bench(rows, calls):
+    '''
+    Times quote_select_random() on a fresh PostgresDB, with the query cache turned off so
+    every call reaches the database.
+
+    Returns:
+        first_ms (float): milliseconds of the first call, which loads the ids
+        median_ms, p99_ms (float): of the next `calls` calls
+        stale_ms (float): of a call made with the ids just expired
+    '''
+    db = PostgresDB(os.environ.get('PG_DB'), os.environ.get('PG_USER'), os.environ.get('PG_PW'),
+                    maxconn=2, cache_size=0, search_fallback=False)
+
+    try:
+        def timed():
+            start = time.perf_counter()
+            quote = db.quote_select_random()
+            elapsed = (time.perf_counter() - start) * 1e3
+
+            if not isinstance(quote, dict):
+                raise RuntimeError(f'quote_select_random() returned {quote!r}')
+
+            return elapsed
+
+        first_ms = timed()
+        times = sorted(timed() for _ in range(calls))
+
+        db.selector.expire()
+        stale_ms = timed()
+
+        # the pool stays open until the background reload is done
+        while not db.selector.loaded:
+            time.sleep(0.01)
+
+        return first_ms, statistics.median(times), times[int(len(times) * 0.99)], stale_ms
+
+    finally:
+        db.db_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--max-rows', type=int, default=SIZES[-1])
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+
+    conn = psycopg2.connect(dbname=os.environ.get('PG_DB'), user=os.environ.get('PG_USER'),
+                            password=os.environ.get('PG_PW'))
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};')
+            cur.execute(f'CREATE TABLE {SCHEMA}.quote (id serial PRIMARY KEY, body text NOT NULL, source text);')
+
+        conn.commit()
+
+        print(f'{"rows":>12} {"first (ms)":>11} {"median":>8} {"p99":>8} {"stale":>8}')
+
+        for rows in SIZES:
+            if rows > args.max_rows:
+                break
+
+            fill(conn, rows)
+            first_ms, median_ms, p99_ms, stale_ms = bench(rows, args.calls)
+            print(f'{rows:>12,} {first_ms:>11.1f} {median_ms:>8.3f} {p99_ms:>8.3f} {stale_ms:>8.3f}')
+
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;')
+
+        conn.commit()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+class QueryCache:
+    '''
+    Thread-safe, size-bounded LRU cache for query results.
+
+    Every entry records the tables its result was read from, so a write to a table can
+    drop exactly the entries that depend on it. Entries also expire after `ttl` seconds,
+    which bounds how long a result can stay stale when another process changes the data.
+
+    Args:
+        maxsize (int): maximum number of entries; the least recently used entry is evicted
+        ttl (float): seconds an entry stays valid (None never expires)
+    '''
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (value, expires, tables)
+        self._by_table = {}           # table -> set of keys
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def generation(self):
+        # changes on every invalidation; lets a reader detect that a write raced its query
+        return self._generation
+
+    def get(self, key):
+        '''
+        Looks up a cached result.
+
+        Returns:
+            hit (bool): whether a live entry was found
+            value: the cached result (None on a miss)
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                if entry is not None:
+                    self._discard(key)
+
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return True, entry[0]
+
+    def set(self, key, value, tables, generation=None):
+        with self._lock:
+            # a write invalidated these tables while the result was being read
+            if generation is not None and generation != self._generation:
+                return
+
+            if key in self._entries:
+                self._discard(key)
+
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (value, expires, tables)
+
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, *tables):
+        with self._lock:
+            self._generation += 1
+
+            for table in tables:
+                for key in self._by_table.pop(table, ()):
+                    if key in self._entries:
+                        self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_table.clear()
+
+    def _discard(self, key):
+        value, expires, tables = self._entries.pop(key)
+
+        for table in tables:
+            keys = self._by_table.get(table)
+
+            if keys:
+                keys.discard(key)
@@ -0,0 +1,177 @@
+import json
+import logging
+import select
+import threading
+import uuid
+
+import psycopg2
+import psycopg2.extensions
+
+CHANNEL = 'quote_shufl_changes'
+NOTIFY_LIMIT = 8000 # bytes; Postgres rejects NOTIFY payloads of this size or longer
+VERSION_ROOM = 40 # bytes of a payload left for the data version added by the writer
+
+class ChangeFeed:
+    '''
+    Publish/subscribe feed of data changes, shared between processes with Postgres LISTEN/NOTIFY.
+
+    A change event is a dict such as {'table': 'quote', 'op': 'insert', 'key': {'id': 7}}.
+    publish() hands the event to this process's subscribers straight away and sends it to
+    every other process with NOTIFY. start() runs a listener thread that receives events sent
+    by other processes and hands them to the subscribers within milliseconds.
+
+    If the listener loses its connection, events sent in the meantime are lost. So after it
+    reconnects, it sends subscribers a {'table': None, 'op': 'resync'} event, which tells them
+    to throw away all of their derived state.
+
+    Args:
+        channel (str): NOTIFY channel name
+        poll_interval (float): seconds the listener waits on its socket before checking for stop()
+        **conn_kwargs: passed to psycopg2.connect() for the listener connection
+    '''
+    def __init__(self, channel=CHANNEL, poll_interval=5, **conn_kwargs):
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.origin = uuid.uuid4().hex # tags events published by this process
+
+        self._conn_kwargs = conn_kwargs
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback, tables=None):
+        '''
+        Registers callback(event) for changes to `tables` (all tables if None). Resync events
+        are delivered to every subscriber.
+
+        Returns:
+            unsubscribe (function): removes the subscription when called
+        '''
+        subscription = (callback, frozenset(tables) if tables else None)
+
+        with self._lock:
+            self._subscribers.append(subscription)
+
+        def unsubscribe():
+            with self._lock:
+                if subscription in self._subscribers:
+                    self._subscribers.remove(subscription)
+
+        return unsubscribe
+
+    def event(self, table, op, **key):
+        return {'table': table, 'op': op, 'key': key, 'origin': self.origin}
+
+    def chunks(self, table, op, field, keys):
+        '''
+        Splits the keys of a batch write into runs that each fit one NOTIFY payload, as the
+        event {field: run} with a data version added.
+
+        Yields:
+            keys (list): consecutive keys, at least one per run
+        '''
+        room = NOTIFY_LIMIT - 1 - VERSION_ROOM - len(json.dumps(self.event(table, op, **{field: []})))
+        chunk, size = [], 0
+
+        for key in keys:
+            length = len(json.dumps(key)) + 2 # with the ', ' separating it from the previous key
+
+            if chunk and size + length > room:
+                yield chunk
+                chunk, size = [], 0
+
+            chunk.append(key)
+            size += length
+
+        if chunk:
+            yield chunk
+
+    def publish(self, event, cur=None):
+        '''
+        Dispatches the event locally, then queues a NOTIFY on `cur` (if given). NOTIFY is
+        delivered when the cursor's transaction commits.
+        '''
+        self.dispatch(event)
+
+        if cur is not None:
+            cur.execute('SELECT pg_notify(%s, %s);', (self.channel, json.dumps(event)))
+
+    def dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for callback, tables in subscribers:
+            if tables is not None and event['table'] is not None and event['table'] not in tables:
+                continue
+
+            try:
+                callback(event)
+
+            except Exception:
+                logging.exception('change feed subscriber failed on %s', event)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name='changefeed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+        if self._thread:
+            self._thread.join(self.poll_interval)
+
+    def _listen(self):
+        backoff = 0.5
+        connected_before = False
+
+        while not self._stop.is_set():
+            conn = None
+
+            try:
+                conn = psycopg2.connect(**self._conn_kwargs)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {self.channel};')
+
+                # anything published while we were disconnected was missed
+                if connected_before:
+                    self.dispatch({'table': None, 'op': 'resync', 'key': {}, 'origin': None})
+
+                connected_before = True
+                backoff = 0.5
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+
+                    conn.poll()
+
+                    while conn.notifies:
+                        self._receive(conn.notifies.pop(0).payload)
+
+            except Exception:
+                logging.exception('change feed listener disconnected')
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _receive(self, payload):
+        try:
+            event = json.loads(payload)
+
+        except ValueError:
+            logging.error('malformed change event: %s', payload)
+            return
+
+        # events from this process were already dispatched by publish()
+        if event.get('origin') != self.origin:
+            self.dispatch(event)
@@ -0,0 +1,181 @@
+# combined_tables_mat: a table holding the rows of the combined_tables VIEW (quote joined
+# to tag through quote_tag), so the public pages read one indexed table instead of running
+# the three-way join on every request.
+#
+# It is kept current by statement-level triggers on quote, tag and quote_tag, which apply
+# each statement's changed rows (its transition tables) in the same transaction as the
+# write; a batch insert of a million links is one INSERT ... SELECT, not a million. That
+# covers every writer: the PostgresDB and AsyncPostgresDB write methods, bulk loads and
+# changes made in psql.
+#
+# COMBINED_REBUILD_SQL creates (or re-creates) the table, its indexes and the triggers.
+# The new copy is built next to the old one and swapped in at the end, so readers keep
+# using the old copy until the swap; writers wait (SHARE lock) so no change falls between.
+
+COMBINED_TABLE = 'combined_tables_mat'
+
+COMBINED_REBUILD_SQL = """
+    -- one rebuild at a time, across all app processes
+    SELECT pg_advisory_xact_lock(hashtext('combined_tables_mat'));
+
+    LOCK TABLE quote, tag, quote_tag IN SHARE MODE;
+
+    DROP TABLE IF EXISTS combined_tables_mat_new;
+
+    CREATE TABLE combined_tables_mat_new AS
+    SELECT
+        q.id AS quote_id,
+        q.body AS quote,
+        q.source AS source,
+        t.name AS tag,
+        t.id AS tag_id
+    FROM
+        quote q
+    INNER JOIN
+        quote_tag qt
+    ON
+        q.id = qt.quote_id
+    INNER JOIN
+        tag t
+    ON
+        qt.tag_id = t.id
+    ORDER BY
+        q.id,
+        t.id
+    ;
+
+    ALTER TABLE combined_tables_mat_new ADD CONSTRAINT combined_tables_mat_new_pkey PRIMARY KEY (quote_id, tag_id);
+    CREATE INDEX combined_tables_mat_new_tag_idx ON combined_tables_mat_new (tag, quote_id);
+    CREATE INDEX combined_tables_mat_new_tag_id_idx ON combined_tables_mat_new (tag_id);
+    ANALYZE combined_tables_mat_new;
+
+    DROP TABLE IF EXISTS combined_tables_mat;
+    ALTER TABLE combined_tables_mat_new RENAME TO combined_tables_mat;
+    ALTER INDEX combined_tables_mat_new_pkey RENAME TO combined_tables_mat_pkey;
+    ALTER INDEX combined_tables_mat_new_tag_idx RENAME TO combined_tables_mat_tag_idx;
+    ALTER INDEX combined_tables_mat_new_tag_id_idx RENAME TO combined_tables_mat_tag_id_idx;
+
+    -- quote_tag: links added or removed
+    CREATE OR REPLACE FUNCTION combined_tables_mat_link() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            DELETE FROM
+                combined_tables_mat m
+            USING
+                old_links o
+            WHERE
+                m.quote_id = o.quote_id
+            AND
+                m.tag_id = o.tag_id;
+        END IF;
+
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO
+                combined_tables_mat(quote_id, quote, source, tag, tag_id)
+            SELECT
+                q.id, q.body, q.source, t.name, t.id
+            FROM
+                new_links n
+            INNER JOIN
+                quote q ON q.id = n.quote_id
+            INNER JOIN
+                tag t ON t.id = n.tag_id
+            ON CONFLICT DO NOTHING;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- quote: body or source edited (updates of other columns are skipped), or quote removed
+    CREATE OR REPLACE FUNCTION combined_tables_mat_quote() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            UPDATE
+                combined_tables_mat m
+            SET
+                quote = n.body,
+                source = n.source
+            FROM
+                new_quotes n
+            INNER JOIN
+                old_quotes o ON o.id = n.id
+            WHERE
+                m.quote_id = n.id
+            AND
+                (n.body, n.source) IS DISTINCT FROM (o.body, o.source);
+        ELSE
+            DELETE FROM
+                combined_tables_mat m
+            USING
+                old_quotes o
+            WHERE
+                m.quote_id = o.id;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- tag: renamed or removed
+    CREATE OR REPLACE FUNCTION combined_tables_mat_tag() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            UPDATE
+                combined_tables_mat m
+            SET
+                tag = n.name
+            FROM
+                new_tags n
+            WHERE
+                m.tag_id = n.id;
+        ELSE
+            DELETE FROM
+                combined_tables_mat m
+            USING
+                old_tags o
+            WHERE
+                m.tag_id = o.id;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- a trigger with transition tables handles a single event, so each event gets its own
+    DROP TRIGGER IF EXISTS combined_tables_mat_link_insert ON quote_tag;
+    DROP TRIGGER IF EXISTS combined_tables_mat_link_update ON quote_tag;
+    DROP TRIGGER IF EXISTS combined_tables_mat_link_delete ON quote_tag;
+    DROP TRIGGER IF EXISTS combined_tables_mat_quote_update ON quote;
+    DROP TRIGGER IF EXISTS combined_tables_mat_quote_delete ON quote;
+    DROP TRIGGER IF EXISTS combined_tables_mat_tag_update ON tag;
+    DROP TRIGGER IF EXISTS combined_tables_mat_tag_delete ON tag;
+
+    CREATE TRIGGER combined_tables_mat_link_insert AFTER INSERT ON quote_tag
+        REFERENCING NEW TABLE AS new_links
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_link();
+
+    CREATE TRIGGER combined_tables_mat_link_update AFTER UPDATE ON quote_tag
+        REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_link();
+
+    CREATE TRIGGER combined_tables_mat_link_delete AFTER DELETE ON quote_tag
+        REFERENCING OLD TABLE AS old_links
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_link();
+
+    CREATE TRIGGER combined_tables_mat_quote_update AFTER UPDATE ON quote
+        REFERENCING OLD TABLE AS old_quotes NEW TABLE AS new_quotes
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_quote();
+
+    CREATE TRIGGER combined_tables_mat_quote_delete AFTER DELETE ON quote
+        REFERENCING OLD TABLE AS old_quotes
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_quote();
+
+    CREATE TRIGGER combined_tables_mat_tag_update AFTER UPDATE ON tag
+        REFERENCING NEW TABLE AS new_tags
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_tag();
+
+    CREATE TRIGGER combined_tables_mat_tag_delete AFTER DELETE ON tag
+        REFERENCING OLD TABLE AS old_tags
+        FOR EACH STATEMENT EXECUTE FUNCTION combined_tables_mat_tag();
+"""
@@ -0,0 +1,310 @@
+import bisect
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from mmap import ACCESS_READ, mmap
+
+# quote corpus: the quote, tag and quote_tag tables packed into one binary file, so a local
+# copy can be read by memory-mapping it instead of fetching and parsing rows again.
+#
+#   header      magic, format version, number of quotes, tags and links, size of the strings
+#   quote ids   int32 per quote, ascending
+#   tag ids     int32 per tag, ascending
+#   tag order   uint32 tag positions sorted by case-folded name, for lookups by name
+#   postings    uint32 per tag + 1: where each tag's quote positions start in the links
+#   links       uint32 quote positions of each tag's quotes, ascending within a tag
+#   strings     uint64 offsets into the UTF-8 text: body and source of each quote, then
+#               the name of each tag, then the end of the text
+#   text        UTF-8 bytes of every string, back to back
+#
+# Integers are little-endian and every section starts on an 8-byte boundary, so the reader
+# uses the arrays in place (memoryview casts of the mapping). A missing source is stored as
+# an empty string.
+#
+# v1 imports this module from here, so both read and write the same corpora.
+
+CORPUS_MAGIC = b'QSCORPUS'
+CORPUS_VERSION = 1
+CORPUS_HEADER = struct.Struct('<8sIIIIQ') # magic, version, quotes, tags, links, text size
+
+def _layout(quotes, tags, links):
+    # (name, array type, length, offset) of each section, in file order
+    sections = (
+        ('quote_ids', 'i', quotes),
+        ('tag_ids', 'i', tags),
+        ('tag_order', 'I', tags),
+        ('postings', 'I', tags + 1),
+        ('links', 'I', links),
+        ('strings', 'Q', 2 * quotes + tags + 1),
+    )
+    offset = CORPUS_HEADER.size
+    layout = []
+
+    for name, typecode, length in sections:
+        offset = -(-offset // 8) * 8
+        layout.append((name, typecode, length, offset))
+        offset += length * array(typecode).itemsize
+
+    return layout, -(-offset // 8) * 8
+
+def write_corpus(path, quotes, tags, links):
+    '''
+    Writes a corpus file. It is written next to `path` and renamed over it, so readers never
+    see half a corpus.
+
+    Args:
+        path (str): corpus file path
+        quotes (iterable): (id, body, source) of every quote, in ascending id order
+        tags (iterable): (id, name) of every tag, in ascending id order
+        links (iterable): (quote_id, tag_id) of every link; links to unknown ids are skipped
+
+    Returns:
+        counts (tuple): number of quotes, tags and links written
+
+    Raises:
+        ValueError: if the quotes or tags are not in ascending id order
+    '''
+    quote_ids, tag_ids, names = array('i'), array('i'), []
+    strings = array('Q', [0])
+
+    # the text goes to a scratch file as it is read, so only offsets are kept in memory
+    with tempfile.TemporaryFile() as text:
+        def put(string):
+            data = (string or '').encode()
+            text.write(data)
+            strings.append(strings[-1] + len(data))
+
+        for id, body, source in quotes:
+            if quote_ids and id <= quote_ids[-1]:
+                raise ValueError(f'quote ids must be ascending: {id} after {quote_ids[-1]}')
+
+            quote_ids.append(id)
+            put(body)
+            put(source)
+
+        for id, name in tags:
+            if tag_ids and id <= tag_ids[-1]:
+                raise ValueError(f'tag ids must be ascending: {id} after {tag_ids[-1]}')
+
+            tag_ids.append(id)
+            names.append(name)
+            put(name)
+
+        quote_pos = {id: i for i, id in enumerate(quote_ids)}
+        tag_pos = {id: i for i, id in enumerate(tag_ids)}
+        tagged = [array('I') for _ in tag_ids]
+
+        for quote_id, tag_id in links:
+            if quote_id in quote_pos and tag_id in tag_pos:
+                tagged[tag_pos[tag_id]].append(quote_pos[quote_id])
+
+        postings, positions = array('I', [0]), array('I')
+
+        for quotes_of_tag in tagged:
+            positions.extend(sorted(set(quotes_of_tag)))
+            postings.append(len(positions))
+
+        tag_order = array('I', sorted(range(len(names)), key=lambda i: (names[i].casefold(), i)))
+        arrays = {
+            'quote_ids': quote_ids,
+            'tag_ids': tag_ids,
+            'tag_order': tag_order,
+            'postings': postings,
+            'links': positions,
+            'strings': strings,
+        }
+        layout, text_offset = _layout(len(quote_ids), len(tag_ids), len(positions))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(CORPUS_HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION, len(quote_ids), len(tag_ids),
+                                              len(positions), strings[-1]))
+
+                for name, typecode, length, offset in layout:
+                    values = arrays[name]
+
+                    if sys.byteorder == 'big':
+                        values = array(typecode, values)
+                        values.byteswap()
+
+                    file.write(b'\0' * (offset - file.tell()))
+                    file.write(values.tobytes())
+
+                file.write(b'\0' * (text_offset - file.tell()))
+                text.seek(0)
+                shutil.copyfileobj(text, file)
+
+            os.replace(tmp, path)
+
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    return len(quote_ids), len(tag_ids), len(positions)
+
+class Corpus:
+    '''
+    Read-only view of a corpus file.
+
+    The file is memory-mapped and its arrays are used in place, so opening it costs the same
+    however many quotes it holds, and no per-row objects are built: a lookup by id is a
+    binary search over the id array, a random pick is one random index, and only the strings of
+    the quotes returned are decoded. Iterating yields (id, body, source) of every quote in id
+    order, with body and source as memoryviews of the UTF-8 text rather than decoded strings.
+    Views returned by tagged() or by iteration must be released before close().
+
+    Args:
+        path (str): corpus file path
+
+    Raises:
+        OSError: if the file cannot be read
+        ValueError: if the file is not a corpus of this version or is truncated
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._map = mmap(file.fileno(), 0, access=ACCESS_READ)
+
+        self._views = [memoryview(self._map)]
+        self._buffer = self._views[0]
+
+        try:
+            magic, version, quotes, tags, links, size = CORPUS_HEADER.unpack_from(self._buffer)
+
+            if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+                raise ValueError(f'{path} is not a version {CORPUS_VERSION} quote corpus')
+
+            layout, text_offset = _layout(quotes, tags, links)
+
+            if len(self._buffer) != text_offset + size:
+                raise ValueError(f'{path} is not the size its header gives')
+
+            for name, typecode, length, offset in layout:
+                view = self._buffer[offset:offset + length * array(typecode).itemsize].cast(typecode)
+
+                self._views.append(view)
+
+                # the arrays are little-endian; elsewhere they are copied and swapped once
+                if sys.byteorder == 'big':
+                    view = array(typecode, view)
+                    view.byteswap()
+
+                setattr(self, f'_{name}', view)
+
+            self._text = self._buffer[text_offset:]
+            self._views.append(self._text)
+
+        except struct.error:
+            self.close()
+            raise ValueError(f'{path} is not a quote corpus') from None
+
+        except ValueError:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self._quote_ids)
+
+    def __iter__(self):
+        ids, strings, text = self._quote_ids, self._strings, self._text
+
+        for i in range(len(ids)):
+            yield ids[i], text[strings[2 * i]:strings[2 * i + 1]], text[strings[2 * i + 1]:strings[2 * i + 2]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+
+        self._map.close()
+
+    @property
+    def ids(self):
+        # every quote id, ascending (a view of the file)
+        return self._quote_ids
+
+    def tags(self):
+        '''
+        Returns:
+            tags (generator): dict with id and name of every tag, in id order
+        '''
+        return ({'id': self._tag_ids[i], 'name': self._string(2 * len(self._quote_ids) + i)}
+                for i in range(len(self._tag_ids)))
+
+    def quote(self, id):
+        '''
+        Returns:
+            quote (dict): id, body and source of the quote, or None if there is none with that id
+        '''
+        i = bisect.bisect_left(self._quote_ids, id)
+
+        return self._quote(i) if i < len(self._quote_ids) and self._quote_ids[i] == id else None
+
+    def pick(self, rng=random):
+        '''
+        Returns:
+            quote (dict): a uniformly random quote, or None if there are no quotes
+        '''
+        return self._quote(rng.randrange(len(self._quote_ids))) if len(self._quote_ids) else None
+
+    def pick_by_tag(self, name, rng=random):
+        '''
+        Args:
+            name (str): tag name (case-insensitive)
+
+        Returns:
+            quote (dict): a uniformly random quote with the tag, or None if it has none
+        '''
+        positions = self.tagged(name)
+
+        try:
+            return self._quote(positions[rng.randrange(len(positions))]) if len(positions) else None
+
+        finally:
+            if isinstance(positions, memoryview):
+                positions.release()
+
+    def tagged(self, name):
+        '''
+        Args:
+            name (str): tag name (case-insensitive)
+
+        Returns:
+            positions (memoryview): ascending positions (in ids) of the tag's quotes; empty if
+                there is no such tag
+        '''
+        name = name.casefold()
+        base = 2 * len(self._quote_ids)
+        order = self._tag_order
+        lo, hi = 0, len(order)
+
+        # binary search over the names in tag order, decoding only the names it visits
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self._string(base + order[mid]).casefold() < name:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == len(order) or self._string(base + order[lo]).casefold() != name:
+            return self._links[0:0]
+
+        tag = order[lo]
+
+        return self._links[self._postings[tag]:self._postings[tag + 1]]
+
+    def _quote(self, i):
+        return {'id': self._quote_ids[i], 'body': self._string(2 * i), 'source': self._string(2 * i + 1)}
+
+    def _string(self, k):
+        return str(self._text[self._strings[k]:self._strings[k + 1]], 'utf-8')
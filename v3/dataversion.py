@@ -0,0 +1,64 @@
+import threading
+import time
+
+# data version: a number every write method bumps (the data_version sequence), so a page's
+# content can be identified by the version it was rendered from. Each write takes the next
+# value in its change event, so every app process learns the latest version from the change
+# feed without asking the database.
+
+DATA_VERSION_SETUP_SQL = """
+    CREATE SEQUENCE IF NOT EXISTS data_version;
+"""
+
+DATA_VERSION_SQL = """
+    SELECT
+        last_value AS version
+    FROM
+        data_version
+    ;
+"""
+
+class DataVersion:
+    '''
+    The latest data version seen by this process and when it changed.
+
+    Versions only move forward: update() ignores a version older than the current one, so
+    change events that arrive out of order cannot make pages look older than they are.
+
+    `missing` is set once reading the version has found no data_version sequence, so it is
+    not looked for again on every request; a DDL change event or a resync clears it.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        '''
+        Returns:
+            version (tuple): (version, modified) with modified as a Unix time, or None if
+                not loaded
+        '''
+        with self._lock:
+            return (self._value, self._modified) if self._value is not None else None
+
+    def update(self, value):
+        '''
+        Args:
+            value (int): a version read from the database or a change event
+        '''
+        with self._lock:
+            if self._value is None or value > self._value:
+                self._value = value
+                # HTTP dates have whole seconds
+                self._modified = float(int(time.time()))
+
+    def reset(self):
+        # after missed change events the version is unknown until read again
+        with self._lock:
+            self._value = None
+            self._modified = None
+            self.missing = False
@@ -1,24 +1,100 @@
 import os
 import json
+import hashlib
+import functools
+import random
+import threading
+from array import array
+from contextlib import contextmanager
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError
+
+from cache import QueryCache
+from changefeed import ChangeFeed
+from combined import COMBINED_REBUILD_SQL
+from dataversion import DATA_VERSION_SETUP_SQL, DATA_VERSION_SQL, DataVersion
+from paging import PAGE_SIZE, Page, clamp_limit, make_page
+from pool import BoundedConnectionPool
+from prepared import PreparingConnection, StatementCache
+from schema import SCHEMA_SQL, SchemaRegistry
+from search import HEADLINE_OPTIONS, SEARCH_SETUP_SQL, SearchIndex
+from selector import RandomSelector
+from sources import SIMILARITY_THRESHOLD, SOURCES_SETUP_SQL, SOURCES_TRGM_SQL, similarity, word_similarity
+from tagindex import TagIndex
+from weighted import WeightedSelector
 
 # TODO set up logging
 # TODO add docstrings
 # TODO clean up exception-handling
 
+RANDOM_RETRIES = 5 # picks of already-deleted ids tolerated before reloading ids
+ITERSIZE = 1000 # rows fetched per round trip when streaming a whole table
+ID_ITERSIZE = 100000 # ids fetched per round trip when loading every quote id
+SAMPLE_CHUNK = 1000 # ids looked up per query by quote_sample
+
+def cached(*tables):
+    # serves the result from self.cache until a write to one of `tables` invalidates it;
+    # errors (returned as strings) are never cached
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            hit, result = self.cache.get(key)
+
+            if hit:
+                return result
+
+            generation = self.cache.generation
+            result = method(self, *args, **kwargs)
+
+            if not isinstance(result, str):
+                self.cache.set(key, result, tables, generation)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
 class PostgresDB:
     ###########################################################
     #   constructors/destructors                              #
     ###########################################################
-    def __init__(self, db_name, db_user, db_password):
-        self.conn = psycopg2.connect(cursor_factory=RealDictCursor, # rows as dicts instead of tuples
+    def __init__(self, db_name, db_user, db_password, minconn=1, maxconn=10, timeout=30, ids_ttl=300,
+                 cache_size=1024, cache_ttl=60, search_fallback=True):
+        self.pool = None
+        self.selector = RandomSelector(ttl=ids_ttl)
+        self._ids_loading = threading.Lock()
+        self.cache = QueryCache(maxsize=cache_size, ttl=cache_ttl)
+        self.schema = SchemaRegistry()
+        self.tags = TagIndex(ttl=ids_ttl)
+        self.version = DataVersion()
+
+        # weighted random picks, once weights are set with self.weights.set_weights()
+        self.weights = WeightedSelector(ttl=ids_ttl)
+        self._weights_pending = set() # quotes added or edited since, whose source may be weighted
+
+        # in-process copy of the search index, for searches while the database is unreachable
+        self.search = SearchIndex() if search_fallback else None
+        self._search_pending = set() # quotes added or edited since the copy was synced
+        self._search_loading = threading.Lock()
+
+        # change events from this and every other app process (see start_listener)
+        self.changes = ChangeFeed(dbname=db_name, user=db_user, password=db_password)
+        self.changes.subscribe(self._apply_change)
+        self.statements = StatementCache()
+        self.pool = BoundedConnectionPool(minconn, maxconn, 
+            timeout=timeout,
+            connection_factory=PreparingConnection, # tracks statements prepared on each connection
+            cursor_factory=RealDictCursor, # rows as dicts instead of tuples
             dbname=db_name,
             user=db_user,
             password=db_password
         )
-        self.cur = self.conn.cursor()
     
     def __del__(self):
         self.db_close()
@@ -38,55 +114,630 @@ class PostgresDB:
     
     def db_close(self):
         print('close initiated...')
-        if self.cur:
-            self.cur.close()
+        if hasattr(self, 'changes'):
+            self.changes.stop()
+
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+
+    @contextmanager
+    def connection(self):
+        # each operation checks out its own connection, so routes running in
+        # different threads never share a connection or cursor
+        conn = self.pool.getconn()
+
+        try:
+            yield conn
         
-        if self.conn:
-            self.conn.close()
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def stats(self):
+        # counters for measuring the caches under load
+        return {
+            'cache': {'hits': self.cache.hits, 'misses': self.cache.misses, 'entries': len(self.cache)},
+            'statements': self.statements.stats(),
+            'random_ids': len(self.selector),
+            'tag_links': len(self.tags),
+            'weighted_ids': len(self.weights),
+            'search_fallback': len(self.search) if self.search is not None else None,
+            'data_version': self.version.get(),
+        }
+
+    def load_schema(self):
+        # (re)reads table and column names into self.schema; called at startup and again
+        # on first use after a DDL change
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(SCHEMA_SQL)
+                self.schema.load(cur.fetchall())
+                conn.commit()
+
+                return
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def data_version(self):
+        # (version, modified) of the data, from the change feed once read; None if unknown
+        if not self.version.loaded and not self.version.missing:
+            with self.connection() as conn, conn.cursor() as cur:
+                try:
+                    cur.execute(DATA_VERSION_SQL)
+                    self.version.update(cur.fetchone()['version'])
+                    conn.commit()
+
+                except psycopg2.errors.UndefinedTable:
+                    # no sequence until `flask init-db`, which announces it with a DDL event
+                    conn.rollback()
+                    self.version.missing = True
+
+                except Exception:
+                    conn.rollback()
+
+        return self.version.get()
+
+    def data_version_setup(self):
+        # creates the data_version sequence the write methods take versions from
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(DATA_VERSION_SETUP_SQL)
+                conn.commit()
+                self.on_write(cur, None, 'ddl')
+
+                return
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def start_listener(self):
+        # applies writes made by other app processes to this process's caches
+        self.changes.start()
+
+    def on_write(self, cur, table, op, **key):
+        # called by every write method once its transaction has committed, on the same
+        # cursor; never raises, since the write itself has already succeeded
+        event = self.changes.event(table, op, **key)
+
+        try:
+            # the event carries the new data version to every process (see data_version())
+            cur.execute("SELECT nextval('data_version') AS version;")
+            event['version'] = cur.fetchone()['version']
+
+        except Exception:
+            # no data_version sequence; the change is still published, without a version
+            cur.connection.rollback()
+
+        try:
+            self.changes.publish(event, cur)
+            cur.connection.commit()
+
+        except Exception:
+            # local state was updated by publish(); other processes catch up when their caches expire
+            cur.connection.rollback()
+
+    def on_write_many(self, cur, table, op, field, keys):
+        # change events for a batch write, as many keys per event as fit in a NOTIFY payload
+        for chunk in self.changes.chunks(table, op, field, keys):
+            self.on_write(cur, table, op, **{field: chunk})
+
+    def _apply_change(self, event):
+        table, op, key = event['table'], event['op'], event['key']
+
+        # events from write methods carry the new data version; after missed events it is unknown
+        if event.get('version') is not None:
+            self.version.update(event['version'])
+        elif op == 'resync':
+            self.version.reset()
+
+        # after a DDL change (or missed events) the table structure may have changed as well
+        if op in ('resync', 'ddl'):
+            self.version.missing = False
+            self.schema.invalidate()
+            self.cache.clear()
+            # the ids still serve picks (deleted ones are skipped) until they are read again
+            self.selector.expire()
+            self.tags.reset()
+            self.weights.reset()
+
+            if self.search is not None:
+                self.search.reset()
+
+            return
+
+        self.cache.invalidate(table)
+
+        if table == 'quote_tag':
+            pairs = key['pairs'] if 'pairs' in key else [(key.get('quote_id'), key.get('tag_id'))]
+
+            if op == 'insert':
+                self.tags.add(pairs)
+                self.weights.link(pairs)
+            elif op == 'delete':
+                self.tags.remove(pairs)
+                self.weights.unlink(pairs)
+
+        elif table == 'tag':
+            # tag names are only read on load, so a renamed or new tag reloads the index
+            self.tags.reset()
+            self.weights.reset()
+
+        # batch writes carry a list of ids instead of a single id
+        ids = key['ids'] if 'ids' in key else [key.get('id')]
+
+        if table == 'quote' and op == 'insert':
+            for id in ids:
+                self.selector.add(id)
+
+            self.weights.add(ids)
+        
+        elif table == 'quote' and op == 'delete':
+            for id in ids:
+                self.selector.remove(id)
+
+            self.weights.remove(ids)
+
+        if table == 'quote' and op in ('insert', 'update') and self.weights.sources:
+            # events do not carry the source; it is read by the next weighted pick
+            self._weights_pending.update(ids)
+
+        if table == 'quote' and self.search is not None:
+            # changed quotes are re-read by the next search that reaches the database
+            self._search_pending.update(ids)
+
+            if op == 'delete':
+                for id in ids:
+                    self.search.remove(id)
             
+    def _select_page(self, select, keys, after=None, before=None, limit=PAGE_SIZE, where=None, data=()):
+        # keyset (seek) pagination: rows are found through the index on `keys` with
+        # WHERE (keys) > cursor, so page N costs the same as page 1 (unlike OFFSET)
+        limit = clamp_limit(limit)
+        conditions = [where] if where else []
+        params = list(data)
+        descending = before is not None and after is None
+
+        cols = ', '.join(keys)
+        placeholders = ', '.join(['%s'] * len(keys))
+
+        if after is not None:
+            conditions.append(f'({cols}) > ({placeholders})')
+            params.extend(after)
+        
+        elif before is not None:
+            conditions.append(f'({cols}) < ({placeholders})')
+            params.extend(before)
+
+        sql = f"""
+            {select}
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY
+                {', '.join(f'{key} DESC' if descending else key for key in keys)}
+            LIMIT %s
+            ;
+        """
+        params.append(limit + 1)
+
+        # each method has at most three page queries (first, after, before), so they are prepared too
+        name = 'page_' + hashlib.md5(sql.encode()).hexdigest()[:16]
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, name, sql, params)
+                rows = cur.fetchall()
+                cols = tuple(column.name for column in cur.description)
+                conn.commit()
+
+                return make_page(rows, keys, limit, after, before, cols)
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def _select_iter(self, sql, data=(), itersize=ITERSIZE):
+        # streams rows through a named (server-side) cursor, `itersize` rows per round trip,
+        # so memory use stays flat however large the result is; the connection stays
+        # checked out until the generator is exhausted or closed
+        with self.connection() as conn:
+            try:
+                with conn.cursor('table_stream') as cur:
+                    cur.itersize = itersize
+                    cur.execute(sql, data)
+
+                    for row in cur:
+                        yield row
+
+            finally:
+                conn.rollback()
+
+    ###########################################################
+    #   bulk operations                                       #
+    ###########################################################
+
+    def quote_search_setup(self):
+        # adds quote.search (tsvector of body and source), its GIN index and the trigger that
+        # keeps it current; safe to run again
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(SEARCH_SETUP_SQL)
+                conn.commit()
+                self.on_write(cur, None, 'ddl')
+
+                return
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def source_setup(self):
+        # creates (or recounts) the source table and the triggers that keep it current, then
+        # tries to add its trigram index; without pg_trgm, lookups are matched in Python
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(SOURCES_SETUP_SQL)
+                conn.commit()
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+            try:
+                cur.execute(SOURCES_TRGM_SQL)
+                conn.commit()
+
+            except Exception:
+                conn.rollback()
+
+            self.on_write(cur, None, 'ddl')
+
+    def combined_tables_rebuild(self):
+        # (re)creates combined_tables_mat from scratch, with its indexes and the triggers that
+        # keep it current; readers are not blocked while the new copy is built
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(COMBINED_REBUILD_SQL)
+                conn.commit()
+                self.on_write(cur, None, 'ddl')
+
+                return
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def bulk_load(self, quote_file, tag_file, quotetag_file):
+        # streams files in the data/*.csv format through COPY FROM STDIN into temporary
+        # staging tables, then merges them into quote, tag and quote_tag in one transaction;
+        # memory use does not depend on file size, and rows already present are skipped,
+        # so loading the same files twice is harmless.
+        #
+        # quote_tag.csv refers to quotes and tags by their position in quote.csv and tag.csv,
+        # so staged rows are numbered in file order and mapped to the ids they end up with.
+        # returns {table: (rows read, rows inserted)}, or the error message
+        sql_stage = """
+            CREATE TEMP TABLE quote_stage (ord bigserial, body text, source text) ON COMMIT DROP;
+            CREATE TEMP TABLE tag_stage (ord bigserial, name text) ON COMMIT DROP;
+            CREATE TEMP TABLE quotetag_stage (quote_ord bigint, tag_ord bigint) ON COMMIT DROP;
+        """
+        copy = "COPY {} FROM STDIN WITH (FORMAT CSV, HEADER TRUE);"
+
+        sql_quote = """
+            INSERT INTO 
+                quote(body, source)
+            SELECT 
+                body, 
+                source
+            FROM (
+                SELECT DISTINCT ON (body, coalesce(source, ''))
+                    ord, body, source
+                FROM 
+                    quote_stage
+                ORDER BY 
+                    body, coalesce(source, ''), ord
+            ) s
+            WHERE NOT EXISTS (
+                SELECT 1 
+                FROM quote q 
+                WHERE q.body = s.body AND coalesce(q.source, '') = coalesce(s.source, '')
+            )
+            ORDER BY 
+                ord
+            ;
+        """
+        sql_quote_map = """
+            CREATE TEMP TABLE quote_map ON COMMIT DROP AS
+            SELECT 
+                s.ord, 
+                min(q.id) AS id
+            FROM 
+                quote_stage s
+            INNER JOIN 
+                quote q
+            ON 
+                q.body = s.body AND coalesce(q.source, '') = coalesce(s.source, '')
+            GROUP BY 
+                s.ord
+            ;
+        """
+        # tag names are capitalized the same way as tag_insert_one
+        sql_tag = """
+            INSERT INTO 
+                tag(name)
+            SELECT 
+                upper(left(name, 1)) || lower(substr(name, 2))
+            FROM 
+                tag_stage
+            ORDER BY 
+                ord
+            ON CONFLICT (name) DO NOTHING
+            ;
+        """
+        sql_tag_map = """
+            CREATE TEMP TABLE tag_map ON COMMIT DROP AS
+            SELECT 
+                s.ord, 
+                t.id
+            FROM 
+                tag_stage s
+            INNER JOIN 
+                tag t
+            ON 
+                t.name = upper(left(s.name, 1)) || lower(substr(s.name, 2))
+            ;
+        """
+        sql_quotetag = """
+            INSERT INTO 
+                quote_tag(quote_id, tag_id)
+            SELECT DISTINCT
+                qm.id, 
+                tm.id
+            FROM 
+                quotetag_stage l
+            INNER JOIN 
+                quote_map qm ON qm.ord = l.quote_ord
+            INNER JOIN 
+                tag_map tm ON tm.ord = l.tag_ord
+            ON CONFLICT DO NOTHING
+            ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                result = {}
+                cur.execute(sql_stage)
+
+                for table, staging, file in (('quote', 'quote_stage(body, source)', quote_file),
+                                             ('tag', 'tag_stage(name)', tag_file),
+                                             ('quote_tag', 'quotetag_stage(quote_ord, tag_ord)', quotetag_file)):
+                    cur.copy_expert(copy.format(staging), file)
+                    result[table] = cur.rowcount
+
+                # temp tables have no statistics until analyzed, which leads to poor join plans
+                cur.execute('ANALYZE quote_stage, tag_stage, quotetag_stage;')
+
+                for table, sql, sql_map in (('quote', sql_quote, sql_quote_map),
+                                            ('tag', sql_tag, sql_tag_map),
+                                            ('quote_tag', sql_quotetag, None)):
+                    cur.execute(sql)
+                    result[table] = (result[table], cur.rowcount)
+
+                    if sql_map:
+                        cur.execute(sql_map)
+
+                conn.commit()
+                self.on_write(cur, None, 'resync')
+
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def quote_insert_many(self, rows):
+        # inserts [(body, source), ...] with one statement; returns a result per row
+        sql = """
+            INSERT INTO 
+                quote(body, source)
+            VALUES 
+                %s
+            RETURNING
+                id
+            ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                ids = [row['id'] for row in execute_values(cur, sql, rows, page_size=max(len(rows), 1), fetch=True)]
+                conn.commit()
+                self.on_write_many(cur, 'quote', 'insert', 'ids', ids)
+
+                return [{'row': row, 'status': 'inserted', 'id': id} for row, id in zip(rows, ids)]
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def tag_insert_many(self, names):
+        # inserts tag names with one statement, skipping names that already exist
+        sql = """
+            INSERT INTO 
+                tag(name)
+            VALUES
+                %s
+            ON CONFLICT (name) DO NOTHING
+            RETURNING
+                id,
+                name
+            ;
+        """
+        names = [name.capitalize() for name in names]
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                inserted = execute_values(cur, sql, [(name,) for name in dict.fromkeys(names)],
+                                          page_size=max(len(names), 1), fetch=True)
+                conn.commit()
+                self.on_write_many(cur, 'tag', 'insert', 'ids', [row['id'] for row in inserted])
+
+                ids = {row['name']: row['id'] for row in inserted}
+                results = []
+
+                for name in names:
+                    id = ids.pop(name, None)
+                    results.append({'row': (name,), 'status': 'inserted' if id else 'duplicate', 'id': id})
+
+                return results
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def quotetag_insert_many(self, pairs):
+        # links [(quote_id, tag_id), ...] with one statement; pairs that already exist or
+        # refer to a missing quote or tag are reported instead of failing the whole batch
+        sql = """
+            WITH v(quote_id, tag_id) AS (
+                VALUES %s
+            ), 
+            ins AS (
+                INSERT INTO 
+                    quote_tag(quote_id, tag_id)
+                SELECT DISTINCT
+                    v.quote_id, 
+                    v.tag_id
+                FROM 
+                    v
+                INNER JOIN 
+                    quote q ON q.id = v.quote_id
+                INNER JOIN 
+                    tag t ON t.id = v.tag_id
+                ON CONFLICT DO NOTHING
+                RETURNING 
+                    quote_id, 
+                    tag_id
+            )
+            SELECT
+                v.quote_id,
+                v.tag_id,
+                ins.quote_id IS NOT NULL AS inserted,
+                EXISTS (SELECT 1 FROM quote WHERE id = v.quote_id) AS quote_exists,
+                EXISTS (SELECT 1 FROM tag WHERE id = v.tag_id) AS tag_exists
+            FROM 
+                v
+            LEFT JOIN 
+                ins USING (quote_id, tag_id)
+            ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                rows = execute_values(cur, sql, pairs, template='(%s::int, %s::int)',
+                                      page_size=max(len(pairs), 1), fetch=True)
+                conn.commit()
+
+                inserted = [(row['quote_id'], row['tag_id']) for row in rows if row['inserted']]
+                self.on_write_many(cur, 'quote_tag', 'insert', 'pairs', list(dict.fromkeys(inserted)))
+
+                results = []
+                seen = set()
+
+                for row in rows:
+                    pair = (row['quote_id'], row['tag_id'])
+
+                    if not row['quote_exists']:
+                        status = 'unknown quote id'
+                    elif not row['tag_exists']:
+                        status = 'unknown tag id'
+                    elif row['inserted'] and pair not in seen:
+                        status = 'inserted'
+                    else:
+                        status = 'duplicate'
+
+                    seen.add(pair)
+                    results.append({'row': pair, 'status': status})
+
+                return results
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def quotetag_delete_many(self, pairs):
+        # unlinks [(quote_id, tag_id), ...] with one statement
+        sql = """
+            DELETE FROM
+                quote_tag qt
+            USING 
+                (VALUES %s) AS v(quote_id, tag_id)
+            WHERE 
+                qt.quote_id = v.quote_id
+            AND 
+                qt.tag_id = v.tag_id
+            RETURNING
+                qt.quote_id,
+                qt.tag_id
+            ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                rows = execute_values(cur, sql, pairs, template='(%s::int, %s::int)',
+                                      page_size=max(len(pairs), 1), fetch=True)
+                conn.commit()
+
+                deleted = [(row['quote_id'], row['tag_id']) for row in rows]
+                self.on_write_many(cur, 'quote_tag', 'delete', 'pairs', deleted)
+
+                deleted = set(deleted)
+                results = []
+
+                for pair in pairs:
+                    pair = tuple(pair)
+                    results.append({'row': pair, 'status': 'deleted' if pair in deleted else 'not found'})
+                    deleted.discard(pair)
+
+                return results
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
     ###########################################################
     #   functions to query from db                            #
     ###########################################################
     
     def db_get_tablenames(self):
-        sql = """
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema='public'
-        AND table_type='BASE TABLE';
-        """
-        self.cur.execute(sql)
-        result = self.cur.fetchall() 
-        self.conn.commit()
+        # served from the schema registry; information_schema is only read after DDL changes
+        if not self.schema.loaded:
+            response = self.load_schema()
 
-        return result
+            if response:
+                return response
+
+        return [{'table_name': name} for name in self.schema.tables()]
     
     def table_get_all_colnames(self, tablename):
         # may want to block queries of users table
-        sql = """
-        SELECT 
-            column_name
-        FROM 
-            information_schema.columns
-        WHERE 
-            table_schema = %s
-        AND 
-            table_name   = %s
-        ;
-        """
-        data = ('public', tablename)
+        if not self.schema.loaded:
+            response = self.load_schema()
 
-        try:
-            self.cur.execute(sql, data)
-            result = self.cur.fetchall()
-            self.conn.commit()
-            
-            return result
-        
-        except Exception as exc:
-            self.conn.rollback()
-            
-            return str(exc)
+            if response:
+                return response
+
+        return [{'column_name': name} for name in self.schema.columns(tablename)]
 
     def quote_delete_one(self, id):
         sql = """
@@ -96,16 +747,18 @@ class PostgresDB:
             id = (%s)
         ;
         """
-        try:
-            self.cur.execute(sql, (id,))
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quote_delete_one', sql, (id,))
+                conn.commit()
+                self.on_write(cur, 'quote', 'delete', id=id)
 
-            return
+                return
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
             
     def quote_insert_one(self, quote, source):
         sql = """
@@ -113,20 +766,26 @@ class PostgresDB:
                 quote(body, source)
             VALUES 
                 (%s, %s)
+            RETURNING
+                id
             ;
         """
         data = (quote, source)
-        try:
-            self.cur.execute(sql, data)
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quote_insert_one', sql, data)
+                id = cur.fetchone()['id']
+                conn.commit()
+                self.on_write(cur, 'quote', 'insert', id=id)
 
-            return 
+                return 
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
  
+    @cached('quote')
     def quote_select_all(self):
         sql = """
             SELECT 
@@ -137,18 +796,48 @@ class PostgresDB:
                 quote
             ;
         """
-        try:
-            self.cur.execute(sql)
-            result = self.cur.fetchall()
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql)
+                result = cur.fetchall()
+                conn.commit()
         
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
     
+    def quote_select_iter(self, itersize=ITERSIZE):
+        sql = """
+            SELECT 
+                id,
+                body, 
+                source
+            FROM 
+                quote
+            ORDER BY
+                id
+            ;
+        """
+
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('quote')
+    def quote_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT 
+                id,
+                body, 
+                source
+            FROM 
+                quote
+        """
+
+        return self._select_page(select, ('id',), after, before, limit)
+    
+    @cached('quote')
     def quote_select_by_id(self, id):
         sql = """
             SELECT 
@@ -162,45 +851,452 @@ class PostgresDB:
         """
         data = (id,)
 
-        try:
-            self.cur.execute(sql, data)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quote_select_by_id', sql, data)
         
-            result = self.cur.fetchone()
-            self.conn.commit()
+                result = cur.fetchone()
+                conn.commit()
             
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
 
-    def quote_select_random(self):
-        sql ="""
-                SELECT 
-                    body,
-                    source
-                FROM 
-                    quote
-                OFFSET 
-                    floor(random() * (SELECT COUNT(id) FROM quote))
-                LIMIT 1
-                ;
-            """
+    def quote_select_ids(self):
+        sql = """
+            SELECT 
+                id
+            FROM 
+                quote
+            ;
+        """
 
-        try:
-            self.cur.execute(sql)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quote_select_ids', sql)
 
-            result = self.cur.fetchone()
-            self.conn.commit()
+                result = cur.fetchall()
+                conn.commit()
             
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
+                return str(exc)
+
+    def quote_select_id_array(self):
+        # every quote id, ascending, streamed through a server-side cursor of plain tuples
+        # into a 32-bit array: 4 bytes per quote, and no dict per row
+        sql = """
+            SELECT
+                id
+            FROM
+                quote
+            ORDER BY
+                id
+            ;
+        """
+
+        with self.connection() as conn:
+            try:
+                ids = array('i')
+
+                with conn.cursor('quote_ids', cursor_factory=psycopg2.extensions.cursor) as cur:
+                    cur.itersize = ID_ITERSIZE
+                    cur.execute(sql)
+
+                    while True:
+                        rows = cur.fetchmany(ID_ITERSIZE)
+
+                        if not rows:
+                            break
+
+                        ids.extend(row[0] for row in rows)
+
+                conn.commit()
+
+                return ids
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def _read_random_ids(self):
+        self.selector.begin_load()
+        ids = self.quote_select_id_array()
+
+        if isinstance(ids, str):
+            return ids
+
+        self.selector.load(ids, ordered=True)
+
+    def _load_random_ids(self):
+        # the ids are read on first use; when they go stale (RANDOM_IDS_TTL, missed change
+        # events), the old ids, which change events keep up to date, go on serving picks
+        # while they are read again in the background
+        if self.selector.loaded:
+            return None
+
+        if not self.selector.ready:
+            return self._read_random_ids()
+
+        if self._ids_loading.acquire(blocking=False):
+            def load():
+                try:
+                    self._read_random_ids()
+
+                finally:
+                    self._ids_loading.release()
+
+            threading.Thread(target=load, name='random-ids', daemon=True).start()
+
+        return None
+
+    def quote_select_random(self):
+        # picks a random id from the in-memory id array (O(1)) and fetches it by primary key,
+        # instead of COUNT(id) + OFFSET, which scans the table twice on every call
+        for _ in range(2):
+            error = self._load_random_ids()
+
+            if error:
+                return error
+            
+            for _ in range(RANDOM_RETRIES):
+                id = self.selector.pick()
+
+                if id is None:
+                    return None
+
+                result = self.quote_select_by_id(id)
+
+                if isinstance(result, str):
+                    return result
+
+                if result:
+                    # with its id, in a copy, since the row is shared with the query cache
+                    return dict(result, id=id)
+                
+                # deleted by another process since the ids were loaded
+                self.selector.remove(id)
+            
+            self.selector.reset()
+
+        return None
+
+    def quote_select_weighted(self):
+        # like quote_select_random, with each quote picked in proportion to its weight (see
+        # weighted.py); the pick is O(1) from the alias table, then a cached primary key lookup
+        for _ in range(2):
+            if not self.weights.loaded:
+                quotes = self.quote_select_weights(self.weights.tags, self.weights.sources)
+                tags = self.tag_select_by_names(self.weights.tags)
+
+                for rows in (quotes, tags):
+                    if isinstance(rows, str):
+                        return rows
+
+                self._weights_pending.clear()
+                self.weights.load(quotes, tags)
+
+            if self._weights_pending:
+                ids = list(self._weights_pending)
+                rows = self.quote_select_by_ids(ids)
+
+                if isinstance(rows, str):
+                    return rows
+
+                self._weights_pending.difference_update(ids)
+
+                for row in rows:
+                    self.weights.set_source(row['id'], row['source'])
+
+            for _ in range(RANDOM_RETRIES):
+                id = self.weights.pick()
+
+                if id is None:
+                    return None
+
+                result = self.quote_select_by_id(id)
+
+                if isinstance(result, str):
+                    return result
+
+                if result:
+                    return dict(result, id=id)
+
+                # deleted by another process since the ids were loaded
+                self.weights.remove([id])
+
+            self.weights.reset()
+
+        return None
+
+    def quote_select_weights(self, tags, sources):
+        # every quote id, with its source if that is one of `sources` and the names of its
+        # tags that are among `tags` (both lowercase), for loading self.weights
+        sql = """
+            SELECT
+                q.id,
+                CASE WHEN lower(q.source) = ANY(%s) THEN q.source END AS source,
+                w.tags
+            FROM
+                quote q
+            LEFT JOIN (
+                SELECT
+                    qt.quote_id,
+                    array_agg(t.name) AS tags
+                FROM
+                    quote_tag qt
+                INNER JOIN
+                    tag t
+                ON
+                    t.id = qt.tag_id
+                WHERE
+                    lower(t.name) = ANY(%s)
+                GROUP BY
+                    qt.quote_id
+            ) w
+            ON
+                w.quote_id = q.id
+            ORDER BY
+                q.id
+            ;
+        """
+        data = (list(sources), list(tags))
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql, data)
+                result = cur.fetchall()
+                conn.commit()
+
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def quote_sample(self, n, tag=None, seed=None):
+        # n distinct quotes drawn uniformly at random (of those tagged `tag`, if given), in
+        # the order drawn, with one query; a seed draws the same quotes while the quotes
+        # (and their tags) stay the same
+        for _ in range(RANDOM_RETRIES):
+            if tag is None:
+                error = self._load_random_ids()
+
+                if error:
+                    return error
+
+                ids = self.selector.sample(n, random.Random(seed))
+
+            else:
+                if not self.tags.loaded:
+                    rows = self.tag_select_index()
+
+                    if isinstance(rows, str):
+                        return rows
+
+                    self.tags.load(rows)
+
+                tagged = self.tags.query((tag,))
+                ids = random.Random(seed).sample(tagged, min(max(n, 0), len(tagged)))
+
+            # large samples are looked up a chunk at a time, so no query carries a huge id array
+            rows = []
+
+            for start in range(0, len(ids), SAMPLE_CHUNK):
+                chunk = self.quote_select_by_ids(ids[start:start + SAMPLE_CHUNK])
+
+                if isinstance(chunk, str):
+                    return chunk
+
+                rows.extend(chunk)
+
+            if len(rows) == len(ids):
+                break
+
+            # some were deleted by another process since the ids were loaded; draw again without them
+            if tag is None:
+                found = {row['id'] for row in rows}
+
+                for id in ids:
+                    if id not in found:
+                        self.selector.remove(id)
+            else:
+                # the tag index does not know which tags a deleted quote had, so it is read again
+                self.tags.reset()
+
+        order = {id: i for i, id in enumerate(ids)}
+
+        return sorted(rows, key=lambda row: order[row['id']])
+
+    def quote_search(self, query, offset=0, limit=PAGE_SIZE):
+        # ranked full-text search; while the database cannot be reached, searches are answered
+        # by the in-process index (once it has been loaded by an earlier search)
+        limit = clamp_limit(limit)
+        offset = max(int(offset), 0)
+        result = self._quote_search(query, offset, limit)
+
+        if isinstance(result, str):
+            if self.search is None or not self.search.loaded:
+                return result
+
+            rows = self.search.search(query, offset, limit + 1)
+            result = (rows, ('quote_id', 'quote', 'source', 'rank'))
+
+        else:
+            self._sync_search_index()
+
+        rows, cols = result
+        more = len(rows) > limit
+
+        # cursors are offsets, since results are ordered by rank rather than by a key
+        return Page(rows[:limit],
+                    str(offset + limit) if more else None,
+                    str(max(offset - limit, 0)) if offset > 0 else None,
+                    cols)
+
+    @cached('quote')
+    def _quote_search(self, query, offset, limit):
+        # matches are ranked in the database, but only the page's rows are highlighted
+        sql = """
+        SELECT
+            id AS quote_id,
+            ts_headline('english', body, q, %s) AS quote,
+            ts_headline('english', coalesce(source, ''), q, %s) AS source,
+            rank
+        FROM (
+            SELECT
+                id,
+                body,
+                source,
+                q,
+                ts_rank(search, q, 1) AS rank
+            FROM
+                quote,
+                websearch_to_tsquery('english', %s) q
+            WHERE
+                search @@ q
+            ORDER BY
+                rank DESC,
+                id
+            LIMIT %s
+            OFFSET %s
+        ) matches
+        ORDER BY
+            rank DESC,
+            quote_id
+        ;
+        """
+        data = (HEADLINE_OPTIONS, HEADLINE_OPTIONS, query, limit + 1, offset)
+
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                try:
+                    self.statements.execute(cur, 'quote_search', sql, data)
+                    rows = cur.fetchall()
+                    cols = tuple(column.name for column in cur.description)
+                    conn.commit()
+
+                    return rows, cols
+
+                except Exception as exc:
+                    conn.rollback()
+
+                    return str(exc)
+
+        # no connection could be opened: returned as an error, so quote_search() falls back
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError) as exc:
             return str(exc)
 
+    def _sync_search_index(self):
+        # loads the in-process search index in the background on first use, and afterwards
+        # brings it up to date with quotes added or edited since
+        if self.search is None or not self._search_loading.acquire(blocking=False):
+            return
+
+        if not self.search.loaded:
+            # changes made while loading stay pending and are applied by the next sync
+            self._search_pending.clear()
+
+            def load():
+                try:
+                    self.search.load(self.quote_select_iter())
+
+                finally:
+                    self._search_loading.release()
+
+            threading.Thread(target=load, name='search-index', daemon=True).start()
+            return
+
+        try:
+            ids = list(self._search_pending)
+
+            if ids:
+                rows = self.quote_select_by_ids(ids)
+
+                if not isinstance(rows, str):
+                    self._search_pending.difference_update(ids)
+                    found = set()
+
+                    for row in rows:
+                        found.add(row['id'])
+                        self.search.add(row['id'], row['body'], row['source'])
+
+                    for id in set(ids) - found:
+                        self.search.remove(id)
+
+        finally:
+            self._search_loading.release()
+
+    def quote_select_by_ids(self, ids):
+        sql = """
+            SELECT
+                id,
+                body,
+                source
+            FROM
+                quote
+            WHERE
+                id = ANY(%s)
+            ORDER BY
+                id
+            ;
+        """
+        data = (list(ids),)
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql, data)
+                result = cur.fetchall()
+                conn.commit()
+
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    @cached('quote')
+    def quote_select_page_by_source(self, source, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT
+                id,
+                body AS quote,
+                source
+            FROM
+                quote
+        """
+
+        return self._select_page(select, ('id',), after, before, limit, where='source = %s', data=(source,))
+
     def quote_update_one(self, body, source, id):
         sql = """
             UPDATE
@@ -214,16 +1310,18 @@ class PostgresDB:
         """
         data = (body, source, id)
         
-        try:
-            self.cur.execute(sql, data)
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quote_update_one', sql, data)
+                conn.commit()
+                self.on_write(cur, 'quote', 'update', id=id)
             
-            return
+                return
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
 
     def quotetag_delete_one(self, quote_id, tag_id):
         sql = """
@@ -235,16 +1333,18 @@ class PostgresDB:
                 tag_id = (%s)
             ;
         """
-        try:
-            self.cur.execute(sql, (quote_id, tag_id))
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quotetag_delete_one', sql, (quote_id, tag_id))
+                conn.commit()
+                self.on_write(cur, 'quote_tag', 'delete', quote_id=quote_id, tag_id=tag_id)
 
-            return
+                return
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
     
     def quotetag_insert_one(self, quote_id, tag_id):
         sql ="""
@@ -253,19 +1353,22 @@ class PostgresDB:
         VALUES(%s, %s)
         """
 
-        try:
-            self.cur.execute(sql, (quote_id, tag_id))
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quotetag_insert_one', sql, (quote_id, tag_id))
+                conn.commit()
+                self.on_write(cur, 'quote_tag', 'insert', quote_id=quote_id, tag_id=tag_id)
             
-            return
+                return
 
-        except psycopg2.IntegrityError as err:
-            self.conn.rollback()
+            except psycopg2.IntegrityError as err:
+                conn.rollback()
 
-            return str(err)
+                return str(err)
         
         
     
+    @cached('quote_tag')
     def quotetag_select_all(self):
         sql = """
             SELECT 
@@ -277,20 +1380,49 @@ class PostgresDB:
             ;
         """
 
-        try:
-            self.cur.execute(sql)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql)
 
-            result = self.cur.fetchall()
-            self.conn.commit()
+                result = cur.fetchall()
+                conn.commit()
 
-            return result
+                return result
 
-        except Exception as exc:
-            conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
+
+
+    def quotetag_select_iter(self, itersize=ITERSIZE):
+        sql = """
+            SELECT 
+                quote_id,
+                tag_id
+            FROM 
+                quote_tag
+            ORDER BY
+                quote_id,
+                tag_id
+            ;
+        """
+
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('quote_tag')
+    def quotetag_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT 
+                quote_id,
+                tag_id
+            FROM 
+                quote_tag
+        """
 
+        return self._select_page(select, ('quote_id', 'tag_id'), after, before, limit)
             
+    @cached('quote_tag')
     def quotetag_select_by_ids(self, quote_id, tag_id):
         sql = """
             SELECT
@@ -306,19 +1438,21 @@ class PostgresDB:
         """
         data = (quote_id, tag_id)
 
-        try:
-            self.cur.execute(sql, data)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quotetag_select_by_ids', sql, data)
             
-            result = self.cur.fetchone()
-            self.conn.commit()
+                result = cur.fetchone()
+                conn.commit()
             
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
     
+    @cached('quote_tag')
     def quotetag_select_by_qid(self, quote_id):
         sql = """
             SELECT
@@ -332,18 +1466,19 @@ class PostgresDB:
         """
         data = (quote_id,)
 
-        try:
-            self.cur.execute(sql, data)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'quotetag_select_by_qid', sql, data)
             
-            result = self.cur.fetchall()
-            self.conn.commit()
+                result = cur.fetchall()
+                conn.commit()
             
-            return result
+                return result
         
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
     
     def tag_delete_one(self, id):
         sql = """
@@ -355,16 +1490,19 @@ class PostgresDB:
         """
         data = (id,)
         
-        try:
-            self.cur.execute(sql, data)
-            self.conn.commit()
-            return
-
-        except Exception as exc:
-            self.conn.rollback()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'tag_delete_one', sql, data)
+                conn.commit()
+                self.on_write(cur, 'tag', 'delete', id=id)
+                return
+
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
         
+    @cached('tag')
     def tag_select_all(self):
         sql = """
             SELECT 
@@ -379,18 +1517,19 @@ class PostgresDB:
             ;
         """
 
-        try:
-            self.cur.execute(sql)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql)
             
-            result = self.cur.fetchall()
-            self.conn.commit()
+                result = cur.fetchall()
+                conn.commit()
 
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
 
     def tag_insert_one(self, tag_name):
         sql = """
@@ -398,19 +1537,78 @@ class PostgresDB:
                 tag(name)
             VALUES
                 (%s)
+            RETURNING
+                id
             ;
         """
         data = (tag_name.capitalize(),)
 
-        try:
-            self.cur.execute(sql, data)
-            self.conn.commit()
-            return
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'tag_insert_one', sql, data)
+                id = cur.fetchone()['id']
+                conn.commit()
+                self.on_write(cur, 'tag', 'insert', id=id)
+                return
         
-        except Exception as exc:
-            self.conn.rollback()
-            return str(exc)
+            except Exception as exc:
+                conn.rollback()
+                return str(exc)
+
+    def tag_select_iter(self, itersize=ITERSIZE):
+        sql = """
+            SELECT 
+                id, 
+                name
+            FROM 
+                tag
+            ORDER BY 
+                id 
+            ;
+        """
+
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('tag')
+    def tag_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT 
+                id, 
+                name
+            FROM 
+                tag
+        """
+
+        return self._select_page(select, ('id',), after, before, limit)
+
+    def tag_select_by_names(self, names):
+        # tags whose lowercase name is in `names`
+        sql = """
+            SELECT
+                id,
+                name
+            FROM
+                tag
+            WHERE
+                lower(name) = ANY(%s)
+            ;
+        """
+        data = (list(names),)
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql, data)
+                result = cur.fetchall()
+                conn.commit()
 
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    @cached('tag')
     def tag_select_by_id(self, id):
         sql = """
         SELECT 
@@ -424,18 +1622,19 @@ class PostgresDB:
         """
         data = (id,)
 
-        try:
-            self.cur.execute(sql, data)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'tag_select_by_id', sql, data)
             
-            result = self.cur.fetchone()
-            self.conn.commit()
+                result = cur.fetchone()
+                conn.commit()
 
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
     
     def tag_update_one(self, id, name):
         sql = """
@@ -449,17 +1648,20 @@ class PostgresDB:
         """
         data = (name, id)
 
-        try:
-            self.cur.execute(sql, data)
-            self.conn.commit()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'tag_update_one', sql, data)
+                conn.commit()
+                self.on_write(cur, 'tag', 'update', id=id)
 
-            return
+                return
             
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
 
+    @cached('users')
     def users_select_by_username(self, username):
         sql = """
         SELECT 
@@ -473,23 +1675,25 @@ class PostgresDB:
         """
         data = (username,)
         
-        try:
-            self.cur.execute(sql, data)
-            result = self.cur.fetchone()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'users_select_by_username', sql, data)
+                result = cur.fetchone()
             
-            self.conn.commit()
+                conn.commit()
 
-            return result
+                return result
 
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
             
-            return str(exc)
+                return str(exc)
 
     def users_verify_password(self, username, password):
         sql = """
         SELECT
-            id
+            id,
+            password
         FROM
             users
         WHERE
@@ -500,29 +1704,82 @@ class PostgresDB:
         """
         data = (username, password)
 
-        try:
-            self.cur.execute(sql, data)
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'users_verify_password', sql, data)
             
-            result = self.cur.fetchone()
-            self.conn.commit()
+                result = cur.fetchone()
+                conn.commit()
             
-            return result
+                return result
             
-        except Exception as exc:
-            self.conn.rollback()
+            except Exception as exc:
+                conn.rollback()
 
-            return str(exc)
+                return str(exc)
+
+    def users_update_password(self, username, password):
+        sql = """
+        UPDATE
+            users
+        SET
+            password = crypt(%s, gen_salt('md5'))
+        WHERE
+            username = %s
+        ;
+        """
+        data = (password, username)
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql, data)
+                conn.commit()
+                self.on_write(cur, 'users', 'update', username=username)
+
+                return
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    def users_delete_one(self, username):
+        sql = """
+        DELETE FROM
+            users
+        WHERE
+            username = %s
+        ;
+        """
+        data = (username,)
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql, data)
+                conn.commit()
+                self.on_write(cur, 'users', 'delete', username=username)
+
+                return
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
     
-    # note: combined_tables is a VIEW created in Postgres
+    # note: combined_tables_mat is a table copy of the combined_tables VIEW, kept current by
+    # triggers (see combined.py)
+    @cached('quote', 'quote_tag', 'tag')
     def combined_tables_select_all(self, distinct=True):
         if distinct:
             sql = """
-            SELECT DISTINCT
+            SELECT DISTINCT ON (quote_id)
                 quote_id,
                 quote,
                 source
             FROM
-                combined_tables
+                combined_tables_mat
+            ORDER BY
+                quote_id
             ;
             """    
         else:
@@ -534,22 +1791,24 @@ class PostgresDB:
                 tag,
                 tag_id
             FROM
-                combined_tables
+                combined_tables_mat
             ORDER BY
                 quote_id
             ;
             """
 
-        try:
-            self.cur.execute(sql)
-            result = self.cur.fetchall()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql)
+                result = cur.fetchall()
 
-            return result
+                return result
         
-        except Exception as exc:
-            self.conn.rollback()
-            return str(exc)
+            except Exception as exc:
+                conn.rollback()
+                return str(exc)
     
+    @cached('quote', 'quote_tag', 'tag')
     def combined_tables_select_by_tag(self, tag):
         sql = """
         SELECT
@@ -559,21 +1818,304 @@ class PostgresDB:
             tag,
             tag_id
         FROM
-            combined_tables
+            combined_tables_mat
         WHERE
             tag = %s
         ;
         """
         data = (tag,)
 
-        try:
-            self.cur.execute(sql, data)
-            result = self.cur.fetchall()
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'combined_tables_select_by_tag', sql, data)
+                result = cur.fetchall()
 
-            return result
+                return result
         
-        except Exception as exc:
-            self.conn.rollback()
-            return str(exc)
+            except Exception as exc:
+                conn.rollback()
+                return str(exc)
+
+    def combined_tables_select_iter(self, distinct=True, itersize=ITERSIZE):
+        if distinct:
+            sql = """
+            SELECT DISTINCT ON (quote_id)
+                quote_id,
+                quote,
+                source
+            FROM
+                combined_tables_mat
+            ORDER BY
+                quote_id
+            ;
+            """    
+        else:
+            sql = """
+            SELECT
+                quote_id,
+                quote,
+                source,
+                tag,
+                tag_id
+            FROM
+                combined_tables_mat
+            ORDER BY
+                quote_id,
+                tag_id
+            ;
+            """
+
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('quote', 'quote_tag', 'tag')
+    def combined_tables_select_page(self, distinct=True, after=None, before=None, limit=PAGE_SIZE):
+        if distinct:
+            select = """
+            SELECT DISTINCT ON (quote_id)
+                quote_id,
+                quote,
+                source
+            FROM
+                combined_tables_mat
+            """
+            keys = ('quote_id',)
+        else:
+            select = """
+            SELECT
+                quote_id,
+                quote,
+                source,
+                tag,
+                tag_id
+            FROM
+                combined_tables_mat
+            """
+            keys = ('quote_id', 'tag_id')
+
+        return self._select_page(select, keys, after, before, limit)
+
+    @cached('quote', 'quote_tag', 'tag')
+    def combined_tables_select_page_by_tag(self, tag, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+        SELECT
+            quote_id,
+            quote,
+            source,
+            tag,
+            tag_id
+        FROM
+            combined_tables_mat
+        """
+
+        return self._select_page(select, ('quote_id',), after, before, limit, where='tag = %s', data=(tag,))
+
+    def tag_select_index(self):
+        # every tag with the ids of its quotes, for loading self.tags
+        sql = """
+        SELECT
+            t.id,
+            t.name,
+            array_agg(qt.quote_id) FILTER (WHERE qt.quote_id IS NOT NULL) AS quote_ids
+        FROM
+            tag t
+        LEFT JOIN
+            quote_tag qt
+        ON
+            qt.tag_id = t.id
+        GROUP BY
+            t.id
+        ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql)
+                result = cur.fetchall()
+                conn.commit()
+
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    @cached('quote', 'quote_tag', 'tag')
+    def combined_tables_select_page_by_tags(self, tags, mode='all', exclude=(), after=None, before=None, limit=PAGE_SIZE):
+        # the matching ids come from the in-memory tag index (see tagindex.py); only the
+        # quotes on the page are read from the database, by primary key
+        if not self.tags.loaded:
+            rows = self.tag_select_index()
+
+            if isinstance(rows, str):
+                return rows
+
+            self.tags.load(rows)
+
+        limit = clamp_limit(limit)
+        descending = before is not None and after is None
+
+        ids = self.tags.query(tags, mode, exclude,
+                              after=after[0] if after is not None else None,
+                              before=before[0] if before is not None else None,
+                              limit=limit + 1)
+
+        sql = f"""
+        SELECT
+            id AS quote_id,
+            body AS quote,
+            source
+        FROM
+            quote
+        WHERE
+            id = ANY(%s)
+        ORDER BY
+            id {'DESC' if descending else 'ASC'}
+        ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, f"quote_select_by_ids_{'desc' if descending else 'asc'}", sql, (ids,))
+                rows = cur.fetchall()
+                cols = tuple(column.name for column in cur.description)
+                conn.commit()
+
+                # a quote deleted since its links were indexed is simply missing from the page
+                return make_page(rows, ('quote_id',), limit, after, before, cols)
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    # note: source is a table of distinct quote sources, kept current by triggers on quote
+    # (see sources.py), so its cached reads are invalidated by quote writes
+    @cached('quote')
+    def source_select_all(self):
+        sql = """
+        SELECT
+            id,
+            name,
+            quotes
+        FROM
+            source
+        WHERE
+            quotes > 0
+        ORDER BY
+            name
+        ;
+        """
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql)
+                result = cur.fetchall()
+                conn.commit()
+
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    @cached('quote')
+    def source_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+        SELECT
+            id,
+            name,
+            quotes
+        FROM
+            source
+        """
+
+        return self._select_page(select, ('name',), after, before, limit, where='quotes > 0')
+
+    @cached('quote')
+    def source_select_by_id(self, id):
+        sql = """
+        SELECT
+            id,
+            name,
+            quotes
+        FROM
+            source
+        WHERE
+            id = %s
+        ;
+        """
+        data = (id,)
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                self.statements.execute(cur, 'source_select_by_id', sql, data)
+                result = cur.fetchone()
+                conn.commit()
+
+                return result
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+    @cached('quote')
+    def source_lookup(self, query, limit=20):
+        # typo-tolerant lookup: sources whose name, or a run of words in it, is similar to the
+        # query by trigrams; 'shakspeare' finds 'William Shakespeare'. Uses the trigram index
+        # when pg_trgm is installed, and compares trigrams in Python otherwise.
+        sql = """
+        SELECT
+            id,
+            name,
+            quotes,
+            greatest(similarity(name, %s), word_similarity(%s, name)) AS score
+        FROM
+            source
+        WHERE
+            (name %% %s OR %s <%% name)
+        AND
+            quotes > 0
+        ORDER BY
+            score DESC,
+            quotes DESC,
+            name
+        LIMIT %s
+        ;
+        """
+        data = (query, query, query, query, limit)
+
+        with self.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute(sql, data)
+                result = cur.fetchall()
+                conn.commit()
+
+                return result
+
+            except psycopg2.errors.UndefinedFunction:
+                conn.rollback()
+
+            except Exception as exc:
+                conn.rollback()
+
+                return str(exc)
+
+        rows = self.source_select_all()
+
+        if isinstance(rows, str):
+            return rows
+
+        matches = []
+
+        for row in rows:
+            score = max(similarity(row['name'], query), word_similarity(query, row['name']))
+
+            if score >= SIMILARITY_THRESHOLD:
+                matches.append(dict(row, score=score))
+
+        matches.sort(key=lambda row: (-row['score'], -row['quotes'], row['name']))
 
-    
\ No newline at end of file
+        return matches[:limit]
@@ -0,0 +1,758 @@
+import json
+import asyncio
+import functools
+from array import array
+
+import asyncpg
+
+from cache import QueryCache
+from changefeed import ChangeFeed
+from dataversion import DATA_VERSION_SQL, DataVersion
+from paging import PAGE_SIZE, clamp_limit, make_page
+from schema import SCHEMA_SQL, SchemaRegistry
+from selector import RandomSelector
+
+# asyncio counterpart of db.PostgresDB, with the same method surface; every query method
+# is a coroutine, so a request waiting on Postgres does not hold a thread
+
+RANDOM_RETRIES = 5 # picks of already-deleted ids tolerated before reloading ids
+ITERSIZE = 1000 # rows prefetched per round trip when streaming a whole table
+ID_ITERSIZE = 100000 # ids fetched per round trip when loading every quote id
+
+def cached(*tables):
+    # same as db.cached, for coroutine methods; the cache may be shared with a PostgresDB,
+    # whose entries have the same keys and row shapes
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            hit, result = self.cache.get(key)
+
+            if hit:
+                return result
+
+            generation = self.cache.generation
+            result = await method(self, *args, **kwargs)
+
+            if not isinstance(result, str):
+                self.cache.set(key, result, tables, generation)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+class AsyncPostgresDB:
+    ###########################################################
+    #   constructors/destructors                              #
+    ###########################################################
+    def __init__(self, db_name, db_user, db_password, minconn=1, maxconn=10, timeout=30, ids_ttl=300,
+                 cache_size=1024, cache_ttl=60, cache=None, selector=None, changes=None, schema=None, version=None):
+        self.pool = None
+        self.timeout = timeout
+        self._connect_kwargs = dict(database=db_name, user=db_user, password=db_password,
+                                    min_size=minconn, max_size=maxconn)
+
+        # pass a PostgresDB's cache, selector, schema registry, data version and change feed
+        # to share them with it; otherwise this instance keeps its own and subscribes them
+        # to its feed
+        self.cache = cache if cache is not None else QueryCache(maxsize=cache_size, ttl=cache_ttl)
+        self.selector = selector if selector is not None else RandomSelector(ttl=ids_ttl)
+        self._ids_task = None
+        self.schema = schema if schema is not None else SchemaRegistry()
+        self.version = version if version is not None else DataVersion()
+
+        if changes is None:
+            changes = ChangeFeed(dbname=db_name, user=db_user, password=db_password)
+            changes.subscribe(self._apply_change)
+
+        self.changes = changes
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.db_close()
+
+    async def open(self):
+        # the pool belongs to the running event loop, so it is created here rather than in __init__
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(**self._connect_kwargs)
+
+    async def db_close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def connection(self):
+        return self.pool.acquire(timeout=self.timeout)
+
+    async def on_write(self, conn, table, op, **key):
+        # called by every write method once it has committed; never raises
+        event = self.changes.event(table, op, **key)
+
+        try:
+            event['version'] = await conn.fetchval("SELECT nextval('data_version');")
+
+        except Exception:
+            pass
+
+        self.changes.dispatch(event)
+
+        try:
+            await conn.execute('SELECT pg_notify($1, $2);', self.changes.channel, json.dumps(event))
+
+        except Exception:
+            pass
+
+    def _apply_change(self, event):
+        table, op, key = event['table'], event['op'], event['key']
+
+        if event.get('version') is not None:
+            self.version.update(event['version'])
+        elif op == 'resync':
+            self.version.reset()
+
+        if op in ('resync', 'ddl'):
+            self.version.missing = False
+            self.schema.invalidate()
+            self.cache.clear()
+            self.selector.expire()
+            return
+
+        self.cache.invalidate(table)
+
+        # batch writes carry a list of ids instead of a single id
+        ids = key['ids'] if 'ids' in key else [key.get('id')]
+
+        if table == 'quote' and op == 'insert':
+            for id in ids:
+                self.selector.add(id)
+
+        elif table == 'quote' and op == 'delete':
+            for id in ids:
+                self.selector.remove(id)
+
+    async def data_version(self):
+        # (version, modified) of the data, from the change feed once read; None if unknown
+        if not self.version.loaded and not self.version.missing:
+            try:
+                async with self.connection() as conn:
+                    self.version.update(await conn.fetchval(DATA_VERSION_SQL))
+
+            except asyncpg.UndefinedTableError:
+                self.version.missing = True
+
+            except Exception:
+                pass
+
+        return self.version.get()
+
+    async def _fetch(self, sql, *args):
+        try:
+            async with self.connection() as conn:
+                return [dict(record) for record in await conn.fetch(sql, *args)]
+
+        except Exception as exc:
+            return str(exc)
+
+    async def _fetchrow(self, sql, *args):
+        try:
+            async with self.connection() as conn:
+                record = await conn.fetchrow(sql, *args)
+
+                return dict(record) if record is not None else None
+
+        except Exception as exc:
+            return str(exc)
+
+    async def _write(self, sql, args, table, op, returning=None, **key):
+        # runs a write statement and publishes its change event; returns None on success
+        # and the error message on failure, like the PostgresDB write methods
+        try:
+            async with self.connection() as conn:
+                value = await conn.fetchval(sql, *args)
+
+                if returning:
+                    key[returning] = value
+
+                await self.on_write(conn, table, op, **key)
+
+        except Exception as exc:
+            return str(exc)
+
+    async def _select_page(self, select, keys, after=None, before=None, limit=PAGE_SIZE, where=None, data=()):
+        # keyset pagination, see PostgresDB._select_page
+        limit = clamp_limit(limit)
+        conditions = [where] if where else []
+        params = list(data)
+        descending = before is not None and after is None
+
+        cursor = after if after is not None else before
+
+        if cursor is not None:
+            placeholders = ', '.join(f'${len(params) + i + 1}' for i in range(len(keys)))
+            conditions.append(f'({", ".join(keys)}) {">" if after is not None else "<"} ({placeholders})')
+            params.extend(cursor)
+
+        sql = f"""
+            {select}
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY
+                {', '.join(f'{key} DESC' if descending else key for key in keys)}
+            LIMIT ${len(params) + 1}
+            ;
+        """
+        params.append(limit + 1)
+
+        try:
+            async with self.connection() as conn:
+                statement = await conn.prepare(sql)
+                rows = [dict(record) for record in await statement.fetch(*params)]
+                cols = tuple(attribute.name for attribute in statement.get_attributes())
+
+        except Exception as exc:
+            return str(exc)
+
+        return make_page(rows, keys, limit, after, before, cols)
+
+    async def _select_iter(self, sql, *args, itersize=ITERSIZE):
+        # streams rows through a server-side cursor, prefetching `itersize` rows at a time
+        async with self.connection() as conn:
+            async with conn.transaction():
+                async for record in conn.cursor(sql, *args, prefetch=itersize):
+                    yield dict(record)
+
+    ###########################################################
+    #   functions to query from db                            #
+    ###########################################################
+
+    async def load_schema(self):
+        rows = await self._fetch(SCHEMA_SQL)
+
+        if isinstance(rows, str):
+            return rows
+
+        self.schema.load(rows)
+
+    async def db_get_tablenames(self):
+        if not self.schema.loaded:
+            response = await self.load_schema()
+
+            if response:
+                return response
+
+        return [{'table_name': name} for name in self.schema.tables()]
+
+    async def table_get_all_colnames(self, tablename):
+        if not self.schema.loaded:
+            response = await self.load_schema()
+
+            if response:
+                return response
+
+        return [{'column_name': name} for name in self.schema.columns(tablename)]
+
+    async def quote_delete_one(self, id):
+        sql = """
+        DELETE FROM
+            quote
+        WHERE
+            id = $1
+        ;
+        """
+        return await self._write(sql, (id,), 'quote', 'delete', id=id)
+
+    async def quote_insert_one(self, quote, source):
+        sql = """
+            INSERT INTO
+                quote(body, source)
+            VALUES
+                ($1, $2)
+            RETURNING
+                id
+            ;
+        """
+        return await self._write(sql, (quote, source), 'quote', 'insert', returning='id')
+
+    @cached('quote')
+    async def quote_select_all(self):
+        sql = """
+            SELECT
+                id,
+                body,
+                source
+            FROM
+                quote
+            ;
+        """
+        return await self._fetch(sql)
+
+    def quote_select_iter(self, itersize=ITERSIZE):
+        sql = """
+            SELECT
+                id,
+                body,
+                source
+            FROM
+                quote
+            ORDER BY
+                id
+            ;
+        """
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('quote')
+    async def quote_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT
+                id,
+                body,
+                source
+            FROM
+                quote
+        """
+        return await self._select_page(select, ('id',), after, before, limit)
+
+    @cached('quote')
+    async def quote_select_by_id(self, id):
+        sql = """
+            SELECT
+                body,
+                source
+            FROM
+                quote
+            WHERE
+                id = $1
+            ;
+        """
+        return await self._fetchrow(sql, id)
+
+    async def quote_select_ids(self):
+        sql = """
+            SELECT
+                id
+            FROM
+                quote
+            ;
+        """
+        return await self._fetch(sql)
+
+    async def quote_select_id_array(self):
+        # see PostgresDB.quote_select_id_array
+        sql = """
+            SELECT
+                id
+            FROM
+                quote
+            ORDER BY
+                id
+            ;
+        """
+        try:
+            ids = array('i')
+
+            async with self.connection() as conn:
+                async with conn.transaction():
+                    cur = await conn.cursor(sql)
+
+                    while True:
+                        records = await cur.fetch(ID_ITERSIZE)
+
+                        if not records:
+                            break
+
+                        ids.extend(record[0] for record in records)
+
+            return ids
+
+        except Exception as exc:
+            return str(exc)
+
+    async def _read_random_ids(self):
+        self.selector.begin_load()
+        ids = await self.quote_select_id_array()
+
+        if isinstance(ids, str):
+            return ids
+
+        self.selector.load(ids, ordered=True)
+
+    async def _load_random_ids(self):
+        # see PostgresDB._load_random_ids; stale ids are read again in a background task
+        if self.selector.loaded:
+            return None
+
+        if not self.selector.ready:
+            return await self._read_random_ids()
+
+        if self._ids_task is None or self._ids_task.done():
+            self._ids_task = asyncio.ensure_future(self._read_random_ids())
+
+        return None
+
+    async def quote_select_random(self):
+        # see PostgresDB.quote_select_random
+        for _ in range(2):
+            error = await self._load_random_ids()
+
+            if error:
+                return error
+
+            for _ in range(RANDOM_RETRIES):
+                id = self.selector.pick()
+
+                if id is None:
+                    return None
+
+                result = await self.quote_select_by_id(id)
+
+                if isinstance(result, str):
+                    return result
+
+                if result:
+                    # with its id, in a copy, since the row is shared with the query cache
+                    return dict(result, id=id)
+
+                self.selector.remove(id)
+
+            self.selector.reset()
+
+        return None
+
+    async def quote_update_one(self, body, source, id):
+        sql = """
+            UPDATE
+                quote
+            SET
+                body = $1,
+                source = $2
+            WHERE
+                id = $3
+            ;
+        """
+        return await self._write(sql, (body, source, id), 'quote', 'update', id=id)
+
+    async def quotetag_delete_one(self, quote_id, tag_id):
+        sql = """
+            DELETE FROM
+                quote_tag
+            WHERE
+                quote_id = $1
+            AND
+                tag_id = $2
+            ;
+        """
+        return await self._write(sql, (quote_id, tag_id), 'quote_tag', 'delete', quote_id=quote_id, tag_id=tag_id)
+
+    async def quotetag_insert_one(self, quote_id, tag_id):
+        sql = """
+        INSERT INTO
+            quote_tag(quote_id, tag_id)
+        VALUES($1, $2)
+        """
+        return await self._write(sql, (quote_id, tag_id), 'quote_tag', 'insert', quote_id=quote_id, tag_id=tag_id)
+
+    @cached('quote_tag')
+    async def quotetag_select_all(self):
+        sql = """
+            SELECT
+                quote_id,
+                tag_id
+            FROM
+                quote_tag
+            ;
+        """
+        return await self._fetch(sql)
+
+    def quotetag_select_iter(self, itersize=ITERSIZE):
+        sql = """
+            SELECT
+                quote_id,
+                tag_id
+            FROM
+                quote_tag
+            ORDER BY
+                quote_id,
+                tag_id
+            ;
+        """
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('quote_tag')
+    async def quotetag_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT
+                quote_id,
+                tag_id
+            FROM
+                quote_tag
+        """
+        return await self._select_page(select, ('quote_id', 'tag_id'), after, before, limit)
+
+    @cached('quote_tag')
+    async def quotetag_select_by_ids(self, quote_id, tag_id):
+        sql = """
+            SELECT
+                quote_id,
+                tag_id
+            FROM
+                quote_tag
+            WHERE
+                quote_id = $1
+            AND
+                tag_id = $2
+            ;
+        """
+        return await self._fetchrow(sql, quote_id, tag_id)
+
+    @cached('quote_tag')
+    async def quotetag_select_by_qid(self, quote_id):
+        sql = """
+            SELECT
+                quote_id,
+                tag_id
+            FROM
+                quote_tag
+            WHERE
+                quote_id = $1
+            ;
+        """
+        return await self._fetch(sql, quote_id)
+
+    async def tag_delete_one(self, id):
+        sql = """
+            DELETE FROM
+                tag
+            WHERE
+                id = $1
+            ;
+        """
+        return await self._write(sql, (id,), 'tag', 'delete', id=id)
+
+    @cached('tag')
+    async def tag_select_all(self):
+        sql = """
+            SELECT
+                id,
+                name
+            FROM
+                tag
+            ORDER BY
+                id
+            ASC
+            ;
+        """
+        return await self._fetch(sql)
+
+    async def tag_insert_one(self, tag_name):
+        sql = """
+            INSERT INTO
+                tag(name)
+            VALUES
+                ($1)
+            RETURNING
+                id
+            ;
+        """
+        return await self._write(sql, (tag_name.capitalize(),), 'tag', 'insert', returning='id')
+
+    def tag_select_iter(self, itersize=ITERSIZE):
+        sql = """
+            SELECT
+                id,
+                name
+            FROM
+                tag
+            ORDER BY
+                id
+            ;
+        """
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('tag')
+    async def tag_select_page(self, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+            SELECT
+                id,
+                name
+            FROM
+                tag
+        """
+        return await self._select_page(select, ('id',), after, before, limit)
+
+    @cached('tag')
+    async def tag_select_by_id(self, id):
+        sql = """
+        SELECT
+            id,
+            name
+        FROM
+            tag
+        WHERE
+            id = $1
+        ;
+        """
+        return await self._fetchrow(sql, id)
+
+    async def tag_update_one(self, id, name):
+        sql = """
+        UPDATE
+            tag
+        SET
+            name = $1
+        WHERE
+            id = $2
+        ;
+        """
+        return await self._write(sql, (name, id), 'tag', 'update', id=id)
+
+    async def users_select_by_username(self, username):
+        sql = """
+        SELECT
+            username,
+            password
+        FROM
+            users
+        WHERE
+            username = $1
+        ;
+        """
+        return await self._fetchrow(sql, username)
+
+    async def users_verify_password(self, username, password):
+        sql = """
+        SELECT
+            id,
+            password
+        FROM
+            users
+        WHERE
+            username = $1
+        AND
+            password = crypt($2, password)
+        ;
+        """
+        return await self._fetchrow(sql, username, password)
+
+    # note: combined_tables_mat is a table copy of the combined_tables VIEW, kept current by
+    # triggers (see combined.py)
+    @cached('quote', 'quote_tag', 'tag')
+    async def combined_tables_select_all(self, distinct=True):
+        if distinct:
+            sql = """
+            SELECT DISTINCT ON (quote_id)
+                quote_id,
+                quote,
+                source
+            FROM
+                combined_tables_mat
+            ORDER BY
+                quote_id
+            ;
+            """
+        else:
+            sql = """
+            SELECT
+                quote_id,
+                quote,
+                source,
+                tag,
+                tag_id
+            FROM
+                combined_tables_mat
+            ORDER BY
+                quote_id
+            ;
+            """
+        return await self._fetch(sql)
+
+    @cached('quote', 'quote_tag', 'tag')
+    async def combined_tables_select_by_tag(self, tag):
+        sql = """
+        SELECT
+            quote_id,
+            quote,
+            source,
+            tag,
+            tag_id
+        FROM
+            combined_tables_mat
+        WHERE
+            tag = $1
+        ;
+        """
+        return await self._fetch(sql, tag)
+
+    def combined_tables_select_iter(self, distinct=True, itersize=ITERSIZE):
+        if distinct:
+            sql = """
+            SELECT DISTINCT ON (quote_id)
+                quote_id,
+                quote,
+                source
+            FROM
+                combined_tables_mat
+            ORDER BY
+                quote_id
+            ;
+            """
+        else:
+            sql = """
+            SELECT
+                quote_id,
+                quote,
+                source,
+                tag,
+                tag_id
+            FROM
+                combined_tables_mat
+            ORDER BY
+                quote_id,
+                tag_id
+            ;
+            """
+        return self._select_iter(sql, itersize=itersize)
+
+    @cached('quote', 'quote_tag', 'tag')
+    async def combined_tables_select_page(self, distinct=True, after=None, before=None, limit=PAGE_SIZE):
+        if distinct:
+            select = """
+            SELECT DISTINCT ON (quote_id)
+                quote_id,
+                quote,
+                source
+            FROM
+                combined_tables_mat
+            """
+            keys = ('quote_id',)
+        else:
+            select = """
+            SELECT
+                quote_id,
+                quote,
+                source,
+                tag,
+                tag_id
+            FROM
+                combined_tables_mat
+            """
+            keys = ('quote_id', 'tag_id')
+
+        return await self._select_page(select, keys, after, before, limit)
+
+    @cached('quote', 'quote_tag', 'tag')
+    async def combined_tables_select_page_by_tag(self, tag, after=None, before=None, limit=PAGE_SIZE):
+        select = """
+        SELECT
+            quote_id,
+            quote,
+            source,
+            tag,
+            tag_id
+        FROM
+            combined_tables_mat
+        """
+        return await self._select_page(select, ('quote_id',), after, before, limit, where='tag = $1', data=(tag,))
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField
 from wtforms import StringField, SubmitField, TextAreaField, IntegerField, PasswordField, SelectField
 from wtforms.validators import DataRequired
 
@@ -31,3 +32,14 @@ class PublicSelectTagForm(FlaskForm):
     tag_select = SelectField('Tag')
     tag_submit = SubmitField('Submit')
 
+class BulkForm(FlaskForm):
+    bulk_action = SelectField('Action', choices=[
+        ('quote_insert', 'insert quotes (body, source)'),
+        ('tag_insert', 'insert tags (name)'),
+        ('quotetag_insert', 'insert quote_tags (quote_id, tag_id)'),
+        ('quotetag_delete', 'delete quote_tags (quote_id, tag_id)'),
+    ])
+    bulk_format = SelectField('Format', choices=[('csv', 'CSV'), ('json', 'JSON')])
+    bulk_data = TextAreaField('Rows') # pasted rows; ignored when a file is uploaded
+    bulk_file = FileField('File')
+    bulk_submit = SubmitField('Submit')
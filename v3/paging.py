@@ -0,0 +1,77 @@
+import base64
+import binascii
+from collections import namedtuple
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# rows of one page plus the cursors of the neighbouring pages (None at either end) and the
+# column names of the rows, taken from the query result
+Page = namedtuple('Page', ['rows', 'next', 'prev', 'cols'], defaults=[()])
+
+def encode_cursor(row, keys):
+    '''
+    Encodes the key columns of a row as a URL-safe cursor, e.g. {'quote_id': 3, 'tag_id': 17} -> '3.17'.
+    Text keys are base64-encoded behind a '~', e.g. {'name': 'Seneca'} -> '~U2VuZWNh'
+    '''
+    return '.'.join(_encode_value(row[key]) for key in keys)
+
+def decode_cursor(cursor, keys):
+    '''
+    Decodes a cursor made by encode_cursor() back into a tuple of ints (and strings).
+
+    Raises:
+        ValueError: if the cursor is malformed or has the wrong number of keys
+    '''
+    values = tuple(_decode_value(value) for value in cursor.split('.'))
+
+    if len(values) != len(keys):
+        raise ValueError(f'cursor {cursor!r} does not match keys {keys}')
+
+    return values
+
+def _encode_value(value):
+    if isinstance(value, str):
+        return '~' + base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    return str(value)
+
+def _decode_value(value):
+    if value.startswith('~'):
+        try:
+            encoded = value[1:] + '=' * (-len(value[1:]) % 4)
+
+            return base64.b64decode(encoded, altchars=b'-_', validate=True).decode()
+
+        except (binascii.Error, UnicodeDecodeError) as exc:
+            raise ValueError(f'malformed cursor value {value!r}') from exc
+
+    return int(value)
+
+def clamp_limit(limit):
+    if limit is None:
+        return PAGE_SIZE
+
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def make_page(rows, keys, limit, after=None, before=None, cols=()):
+    '''
+    Builds a Page from rows fetched with LIMIT limit + 1 (the extra row only signals that
+    another page exists). Rows fetched for a `before` cursor arrive in descending key order.
+    '''
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    if before is not None:
+        rows.reverse()
+
+    if not rows:
+        return Page(rows, None, None, cols)
+
+    first = encode_cursor(rows[0], keys)
+    last = encode_cursor(rows[-1], keys)
+
+    if before is not None:
+        return Page(rows, last, first if more else None, cols)
+
+    return Page(rows, last if more else None, first if after is not None else None, cols)
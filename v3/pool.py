@@ -0,0 +1,67 @@
+import select
+import threading
+
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+class BoundedConnectionPool(ThreadedConnectionPool):
+    '''
+    Thread-safe connection pool that holds between minconn and maxconn connections.
+
+    psycopg2's ThreadedConnectionPool raises PoolError as soon as every connection is
+    checked out. This pool makes the caller wait for a connection to be returned instead,
+    up to `timeout` seconds (None waits forever), before giving up with PoolError.
+
+    Args:
+        minconn (int): connections opened up front and kept open
+        maxconn (int): upper bound on open connections
+        timeout (float): seconds to wait for a free connection on checkout
+        *args, **kwargs: passed through to psycopg2.connect()
+    '''
+    def __init__(self, minconn, maxconn, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f'connection pool exhausted (no connection free after {self.timeout}s)')
+
+        try:
+            conn = super().getconn(key)
+
+            # an idle connection may have been closed (e.g. dropped by the server); replace it
+            while dropped(conn):
+                super().putconn(conn, key, close=True)
+                conn = super().getconn(key)
+
+            return conn
+
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+
+        finally:
+            self._slots.release()
+
+
+def dropped(conn):
+    '''
+    Tells whether an idle connection can no longer be used, without a round trip to the server.
+
+    A connection the server has terminated still reports closed == 0 until it is next used.
+    But an idle connection has nothing to read unless the server has sent it an error or
+    closed the socket, so a readable socket means the connection is gone.
+    '''
+    if conn.closed:
+        return True
+
+    try:
+        return bool(select.select([conn], [], [], 0)[0])
+
+    except (OSError, ValueError):
+        return True
@@ -0,0 +1,72 @@
+import re
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+class PreparingConnection(psycopg2.extensions.connection):
+    '''
+    psycopg2 connection that remembers which statements have been PREPAREd on it. Prepared
+    statements live as long as the server session, so a replacement connection starts with
+    an empty set and statements are prepared again on first use.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def rollback(self):
+        # a connection the server dropped has nothing left to roll back: it is closed instead
+        # of raising out of the caller's error handling, so the pool discards it on return
+        try:
+            super().rollback()
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if not self.closed:
+                self.close()
+
+class StatementCache:
+    '''
+    Runs fixed SQL statements as server-side prepared statements: each statement is parsed and
+    planned once per connection (PREPARE) and afterwards executed by name (EXECUTE).
+
+    Statements are written with psycopg2 %s placeholders, which are rewritten to $1, $2, ...
+    for PREPARE. Connections must be PreparingConnection instances.
+    '''
+    def __init__(self):
+        self.hits = 0   # executions of an already prepared statement
+        self.misses = 0 # executions that had to PREPARE first
+        self._lock = threading.Lock()
+
+    def execute(self, cur, name, sql, data=()):
+        conn = cur.connection
+
+        if name in conn.prepared:
+            hit = True
+        else:
+            cur.execute(f'PREPARE {name} AS {to_positional(sql)}')
+            conn.prepared.add(name)
+            hit = False
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if data:
+            cur.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(data))});', data)
+        else:
+            cur.execute(f'EXECUTE {name};')
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+def to_positional(sql):
+    '''
+    Rewrites %s placeholders to $1, $2, ... and drops the trailing semicolon, e.g.
+    'SELECT * FROM quote WHERE id = (%s);' -> 'SELECT * FROM quote WHERE id = ($1)'
+    '''
+    counter = iter(range(1, sql.count('%s') + 1))
+
+    return re.sub(r'%s', lambda match: f'${next(counter)}', sql).strip().rstrip(';')
@@ -0,0 +1,231 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import tempfile
+
+# quote of the day: a schedule of one quote per day, worked out ahead of time and kept in a
+# JSON file, so the day's quote is served from memory without a query.
+#
+# The schedule walks through a seeded shuffle of every quote id (a round), so no quote is
+# shown twice until every quote has been shown once; then the next round starts, so there is
+# a quote for every day however few quotes there are. The same ids and seed always give the
+# same schedule. Quotes added later are slotted into the rest of the round at a position
+# worked out from their id; a deleted quote's days go to the next quote in the round. Days
+# already scheduled never move otherwise, unless the horizon is shortened.
+#
+# v1 imports this module from here, so both read the same schedules.
+
+HORIZON = 365 # days scheduled ahead
+
+class QuoteSchedule:
+    '''
+    Quote-of-the-day schedule.
+
+    reconcile() brings the schedule up to date with the current quote ids (and extends it
+    to `horizon` days from today); fill() then takes the text of the quotes it scheduled,
+    and quote() returns the quote of a day. add(), remove() and update() adjust a loaded
+    schedule for single quote changes.
+
+    Args:
+        seed (str): seed of the shuffles; schedules with the same seed and ids are the same
+        horizon (int): days scheduled ahead of today
+    '''
+    def __init__(self, seed='quote-shufl', horizon=HORIZON):
+        self.seed = str(seed)
+        self.horizon = int(horizon)
+        self.start = None   # date of days[0]
+        self.days = []      # quote id per day from start (None if there was none left)
+        self.queue = []     # ids of the round not scheduled yet, next first
+        self.used = set()   # ids of the round already scheduled
+        self.round = 0      # number of shuffles so far
+        self.quotes = {}    # id -> {'body', 'source'} of the scheduled quotes
+
+    ###########################################################
+    #   persistence                                           #
+    ###########################################################
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Raises:
+            OSError, ValueError: if the file cannot be read or is not a schedule
+        '''
+        with open(path) as file:
+            data = json.load(file)
+
+        schedule = cls(data['seed'], data['horizon'])
+        schedule.start = datetime.date.fromisoformat(data['start']) if data['start'] else None
+        schedule.days = data['days']
+        schedule.queue = data['queue']
+        schedule.used = set(data['used'])
+        schedule.round = data['round']
+        schedule.quotes = {int(id): quote for id, quote in data['quotes'].items()}
+
+        return schedule
+
+    def save(self, path):
+        data = {
+            'seed': self.seed,
+            'horizon': self.horizon,
+            'start': self.start.isoformat() if self.start else None,
+            'days': self.days,
+            'queue': self.queue,
+            'used': sorted(self.used),
+            'round': self.round,
+            'quotes': {str(id): quote for id, quote in self.quotes.items()},
+        }
+
+        # written next to the file and renamed over it, so readers never see half a schedule
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(data, file, ensure_ascii=False)
+
+            os.replace(tmp, path)
+
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    ###########################################################
+    #   scheduling                                            #
+    ###########################################################
+
+    def reconcile(self, ids, today=None):
+        '''
+        Drops deleted quotes, adds new ones, forgets days before today and schedules days
+        up to `horizon` days ahead (dropping days beyond it, if the horizon was shortened).
+
+        Args:
+            ids (iterable): ids of every quote
+            today (date): defaults to the local date
+
+        Returns:
+            ids (list): scheduled ids whose text is not known yet (see fill())
+        '''
+        today = today or datetime.date.today()
+        live = set(ids)
+
+        if self.start is None:
+            self.start = today
+        elif self.start < today:
+            self.days = self.days[(today - self.start).days:]
+            self.start = today
+
+        for id in [id for id in self.queue + self.days if id is not None and id not in live]:
+            self.remove(id)
+
+        for id in sorted(live - self.used - set(self.queue)):
+            self.add(id)
+
+        if len(self.days) > self.horizon:
+            # days dropped go back to the front of the queue, so they come back in the same
+            # order if the horizon is lengthened again
+            queued = set(self.queue)
+            dropped = [id for id in dict.fromkeys(self.days[self.horizon:]) if id is not None and id not in queued]
+            del self.days[self.horizon:]
+            self.queue[:0] = dropped
+            self.used.difference_update(dropped)
+
+        while len(self.days) < self.horizon:
+            if not self.queue and not self._next_round(live):
+                break
+
+            self.days.append(self.queue.pop(0))
+            self.used.add(self.days[-1])
+
+        return self.missing()
+
+    def missing(self):
+        # scheduled ids without text; text of quotes no longer scheduled is dropped
+        scheduled = set(self.days)
+        self.quotes = {id: quote for id, quote in self.quotes.items() if id in scheduled}
+
+        return [id for id in dict.fromkeys(self.days) if id is not None and id not in self.quotes]
+
+    def fill(self, rows):
+        '''
+        Args:
+            rows (iterable): dict rows with id, body and source
+        '''
+        for row in rows:
+            self.quotes[row['id']] = {'body': row['body'], 'source': row['source']}
+
+    def add(self, id):
+        # a new quote joins the rest of the round at a position that depends only on its id
+        if id in self.used or id in self.queue:
+            return
+
+        digest = hashlib.sha256(f'{self.seed}:{id}'.encode()).digest()
+        self.queue.insert(int.from_bytes(digest[:8], 'big') % (len(self.queue) + 1), id)
+
+    def remove(self, id):
+        '''
+        Returns:
+            ids (list): ids that took over the deleted quote's days (see fill())
+        '''
+        if id in self.queue:
+            self.queue.remove(id)
+
+        self.used.discard(id)
+        self.quotes.pop(id, None)
+        replaced = []
+
+        for i, day in enumerate(self.days):
+            if day == id:
+                self.days[i] = self.queue.pop(0) if self.queue else None
+
+                if self.days[i] is not None:
+                    self.used.add(self.days[i])
+                    replaced.append(self.days[i])
+
+        return replaced
+
+    def update(self, id):
+        # an edited quote's text is read again
+        self.quotes.pop(id, None)
+
+    def quote(self, day=None):
+        '''
+        Args:
+            day (date): defaults to the local date
+
+        Returns:
+            quote (dict): id, body and source of the day's quote (body and source are None
+                until fill() is given its text), or None if the day is not scheduled
+        '''
+        day = day or datetime.date.today()
+
+        if self.start is None or not 0 <= (day - self.start).days < len(self.days):
+            return None
+
+        id = self.days[(day - self.start).days]
+
+        if id is None:
+            return None
+
+        quote = self.quotes.get(id, {'body': None, 'source': None})
+
+        return {'id': id, 'body': quote['body'], 'source': quote['source']}
+
+    def _next_round(self, live):
+        # a new shuffle of every quote; quotes only repeat across rounds
+        ids = sorted(live)
+
+        if not ids:
+            return False
+
+        random.Random(f'{self.seed}:{self.round}').shuffle(ids)
+
+        # nor on two days running, where a round starts with the quote the last one ended on
+        if len(ids) > 1 and self.days and ids[0] == self.days[-1]:
+            ids.append(ids.pop(0))
+
+        self.queue = ids
+        self.used = set()
+        self.round += 1
+
+        return True
@@ -0,0 +1,76 @@
+import threading
+
+# every column of every table and view in the public schema, in table order
+SCHEMA_SQL = """
+    SELECT
+        c.table_name,
+        t.table_type,
+        c.column_name
+    FROM
+        information_schema.columns c
+    JOIN
+        information_schema.tables t
+    ON
+        t.table_schema = c.table_schema
+    AND
+        t.table_name = c.table_name
+    WHERE
+        c.table_schema = 'public'
+    ORDER BY
+        c.table_name,
+        c.ordinal_position
+    ;
+"""
+
+class SchemaRegistry:
+    '''
+    In-memory copy of the table and column names of the public schema, so pages that need
+    them do not query information_schema on every request.
+
+    The registry is filled from the rows of SCHEMA_SQL by load() and stays valid until
+    invalidate() is called, which the change feed does on 'ddl' and 'resync' events.
+    '''
+    def __init__(self):
+        self._tables = {}   # table name -> (table type, tuple of column names)
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, rows):
+        '''
+        Args:
+            rows (list): dict rows with table_name, table_type and column_name
+        '''
+        tables = {}
+
+        for row in rows:
+            table_type, columns = tables.setdefault(row['table_name'], (row['table_type'], []))
+            columns.append(row['column_name'])
+
+        with self._lock:
+            self._tables = {name: (table_type, tuple(columns)) for name, (table_type, columns) in tables.items()}
+            self._loaded = True
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def tables(self, table_type='BASE TABLE'):
+        '''
+        Returns:
+            tables (list): names of the tables of `table_type` (every table and view if None)
+        '''
+        with self._lock:
+            return [name for name, (kind, columns) in sorted(self._tables.items())
+                    if table_type is None or kind == table_type]
+
+    def columns(self, table):
+        '''
+        Returns:
+            columns (tuple): column names of `table` in table order, empty if it is unknown
+        '''
+        with self._lock:
+            return self._tables.get(table, (None, ()))[1]
@@ -0,0 +1,251 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from array import array
+
+from markupsafe import Markup, escape
+
+from tagindex import match_ids
+
+# full-text search over quote.body and quote.source
+#
+# In Postgres, quote.search is a tsvector of the body (weight A) and source (weight B),
+# kept current by a trigger and indexed with GIN. SearchIndex is an in-process inverted
+# index over the same text, used when the database cannot be reached.
+
+SEARCH_SETUP_SQL = """
+    ALTER TABLE quote ADD COLUMN IF NOT EXISTS search tsvector;
+
+    CREATE OR REPLACE FUNCTION quote_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search :=
+            setweight(to_tsvector('english', coalesce(NEW.body, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.source, '')), 'B');
+
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS quote_search_update ON quote;
+
+    CREATE TRIGGER quote_search_update BEFORE INSERT OR UPDATE OF body, source ON quote
+        FOR EACH ROW EXECUTE FUNCTION quote_search_update();
+
+    -- quotes added before the column existed
+    UPDATE
+        quote
+    SET
+        search =
+            setweight(to_tsvector('english', coalesce(body, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(source, '')), 'B')
+    WHERE
+        search IS NULL
+    ;
+
+    CREATE INDEX IF NOT EXISTS quote_search_idx ON quote USING GIN (search);
+"""
+
+# matches are wrapped in these by ts_headline() and SearchIndex, and turned into <mark>
+# tags by highlight() after the text has been escaped
+MARK_START = '\x02'
+MARK_STOP = '\x03'
+HEADLINE_OPTIONS = f'StartSel={MARK_START}, StopSel={MARK_STOP}, HighlightAll=true'
+
+SOURCE_WEIGHT = 0.4 # ts_rank's default weight for B (source) relative to A (body)
+
+WORD = re.compile(r"\w+(?:'\w+)?")
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from has have he her his i if in into is it its me my
+    no not of on or our she so that the their them then there these they this to was we
+    were what when which who will with you your
+'''.split())
+
+def highlight(text):
+    '''
+    Escapes text for HTML and turns the match markers into <mark> tags.
+    '''
+    if text is None:
+        return ''
+
+    return Markup(str(escape(text)).replace(MARK_START, '<mark>').replace(MARK_STOP, '</mark>'))
+
+def tokenize(text):
+    '''
+    Lowercase words of text, without stopwords and possessive 's, e.g.
+    "The Art of War's" -> ['art', 'war']
+    '''
+    words = (word.lower() for word in WORD.findall(text or ''))
+
+    return [word[:-2] if word.endswith("'s") else word for word in words if word not in STOPWORDS]
+
+class SearchIndex:
+    '''
+    In-process inverted index from word to the sorted ids of the quotes containing it, with
+    the quote texts packed into one UTF-8 buffer, so searches can be answered without the
+    database.
+
+    A query matches quotes containing every query word (in the body or source, as in
+    Postgres). Matching ids are found with tagindex.match_ids(), and every match is ranked
+    like ts_rank: body matches count 1, source matches SOURCE_WEIGHT, scaled by the words'
+    rarity and divided by the log of the quote's length. Only the best offset + limit
+    matches are sorted, so a page costs one pass over the matches.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, rows):
+        '''
+        Args:
+            rows (iterable): dict rows with id, body and source, in ascending id order
+        '''
+        # built aside and swapped in, so searches keep using the old index meanwhile
+        index = SearchIndex()
+
+        for row in rows:
+            index._append(row['id'], row['body'], row['source'])
+
+        with self._lock:
+            self._body, self._source = index._body, index._source
+            self._ids, self._lengths = index._ids, index._lengths
+            self._offsets, self._text = index._offsets, index._text
+            self._loaded = True
+
+    def reset(self):
+        with self._lock:
+            self._body = {}             # word -> sorted array of ids of quotes whose body has it
+            self._source = {}           # word -> sorted array of ids of quotes whose source has it
+            self._ids = array('i')      # quote ids, ascending
+            self._lengths = array('H')  # words per quote
+            self._offsets = array('q')  # start of each quote's text in _text
+            self._text = bytearray()    # body + '\0' + source + '\0' of every quote, UTF-8
+            self._loaded = False
+
+    def _append(self, id, body, source):
+        # quotes must arrive in ascending id order, so every posting list stays sorted
+        body_words = tokenize(body)
+        source_words = tokenize(source)
+
+        for postings, words in ((self._body, body_words), (self._source, source_words)):
+            for word in set(words):
+                postings.setdefault(word, array('i')).append(id)
+
+        self._ids.append(id)
+        self._lengths.append(min(len(body_words) + len(source_words), 65535))
+        self._offsets.append(len(self._text))
+        self._text += f'{body or ""}\0{source or ""}\0'.encode()
+
+    def add(self, id, body, source):
+        with self._lock:
+            if not self._ids or id > self._ids[-1]:
+                self._append(id, body, source)
+                return
+
+        # an id out of order (or an edited quote): rebuild its entries
+        self.remove(id)
+
+        with self._lock:
+            i = bisect.bisect_left(self._ids, id)
+            body_words = tokenize(body)
+            source_words = tokenize(source)
+
+            for postings, words in ((self._body, body_words), (self._source, source_words)):
+                for word in set(words):
+                    ids = postings.setdefault(word, array('i'))
+                    ids.insert(bisect.bisect_left(ids, id), id)
+
+            # edited text is appended to the buffer; the old bytes are left unused
+            self._ids.insert(i, id)
+            self._lengths.insert(i, min(len(body_words) + len(source_words), 65535))
+            self._offsets.insert(i, len(self._text))
+            self._text += f'{body or ""}\0{source or ""}\0'.encode()
+
+    def remove(self, id):
+        with self._lock:
+            i = bisect.bisect_left(self._ids, id)
+
+            if i == len(self._ids) or self._ids[i] != id:
+                return
+
+            body, source = self._quote(i)
+
+            for postings, words in ((self._body, tokenize(body)), (self._source, tokenize(source))):
+                for word in set(words):
+                    ids = postings[word]
+                    del ids[bisect.bisect_left(ids, id)]
+
+            del self._ids[i]
+            del self._lengths[i]
+            del self._offsets[i]
+
+    def _quote(self, i):
+        start = self._offsets[i]
+        stop = self._text.find(b'\0', self._text.find(b'\0', start) + 1)
+        body, source = self._text[start:stop].decode().split('\0')
+
+        return body, source or None
+
+    def search(self, query, offset=0, limit=20):
+        '''
+        Returns:
+            rows (list): up to `limit` dicts with quote_id, quote, source (with matches
+                marked, see highlight()) and rank, best first, skipping `offset` matches
+        '''
+        words = list(dict.fromkeys(tokenize(query)))
+
+        if not words:
+            return []
+
+        with self._lock:
+            postings = [(self._body.get(word, array('i')), self._source.get(word, array('i'))) for word in words]
+            total = len(self._ids)
+
+            candidates = match_ids([list(pair) for pair in postings])
+
+            # rarer words weigh more, like an idf
+            weights = [math.log(1 + total / (1 + len(body) + len(source))) for body, source in postings]
+            scored = []
+
+            for id in candidates:
+                i = bisect.bisect_left(self._ids, id)
+                score = sum(weight * ((1.0 if _contains(body, id) else 0.0) + (SOURCE_WEIGHT if _contains(source, id) else 0.0))
+                            for weight, (body, source) in zip(weights, postings))
+                scored.append((score / math.log(2 + self._lengths[i]), id, i))
+
+            best = heapq.nsmallest(offset + limit, scored, key=lambda match: (-match[0], match[1]))
+            rows = []
+
+            for score, id, i in best[offset:]:
+                body, source = self._quote(i)
+                rows.append({'quote_id': id, 'quote': _mark(body, words), 'source': _mark(source, words), 'rank': score})
+
+        return rows
+
+def _mark(text, words):
+    # wraps the words of text that match a query word in MARK_START/MARK_STOP
+    if text is None:
+        return None
+
+    words = set(words)
+
+    def replace(match):
+        word = match.group(0).lower()
+        word = word[:-2] if word.endswith("'s") else word
+
+        return f'{MARK_START}{match.group(0)}{MARK_STOP}' if word in words else match.group(0)
+
+    return WORD.sub(replace, text)
+
+def _contains(ids, id):
+    i = bisect.bisect_left(ids, id)
+
+    return i < len(ids) and ids[i] == id
@@ -0,0 +1,131 @@
+import bisect
+import random
+import threading
+import time
+from array import array
+
+class RandomSelector:
+    '''
+    Picks a uniformly random quote id in constant time.
+
+    Ids are kept in a sorted array of 32-bit ints (quote.id is a serial), so a pick is a
+    single random index into the array no matter how many quotes there are or how many
+    gaps deletes have left in the id sequence. New serial ids are always the largest,
+    so inserts are appends; deletes find their slot with a binary search.
+
+    Args:
+        ttl (float): seconds before the ids are considered stale and should be reloaded
+            from the database (None never expires)
+    '''
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def loaded(self):
+        if self._loaded_at is None or self._stale:
+            return False
+
+        if self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl:
+            return False
+
+        return True
+
+    @property
+    def ready(self):
+        # ids were loaded once, so picks can be served while fresh ones are read
+        return self._loaded_at is not None
+
+    def begin_load(self):
+        # ids passed to the next load() are read from a snapshot that may miss changes
+        # committed while it is taken; adds and removes from now on are replayed on them
+        with self._lock:
+            self._pending = []
+
+    def load(self, ids, ordered=False):
+        '''
+        Args:
+            ids (iterable): every quote id
+            ordered (bool): ids is an array('i') in ascending order (read with ORDER BY id),
+                which is used as is instead of being sorted into a new array
+        '''
+        ids = ids if ordered else array('i', sorted(ids))
+
+        with self._lock:
+            self._ids = ids
+
+            for added, id in self._pending or ():
+                if added:
+                    self._add(id)
+                else:
+                    self._remove(id)
+
+            self._pending = None
+            self._loaded_at = time.monotonic()
+            self._stale = False
+
+    def expire(self):
+        # the ids may be out of date (e.g. change events were missed): loaded turns False,
+        # but the ids keep serving picks until they are loaded again
+        with self._lock:
+            self._stale = True
+
+    def reset(self):
+        with self._lock:
+            self._ids = array('i')
+            self._pending = None    # (added, id) of changes made since begin_load()
+            self._loaded_at = None
+            self._stale = False
+
+    def add(self, id):
+        with self._lock:
+            self._add(id)
+
+            if self._pending is not None:
+                self._pending.append((True, id))
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+            if self._pending is not None:
+                self._pending.append((False, id))
+
+    def _add(self, id):
+        # serial ids arrive in increasing order, so this is almost always an append
+        if not self._ids or id > self._ids[-1]:
+            self._ids.append(id)
+            return
+
+        i = bisect.bisect_left(self._ids, id)
+
+        if i == len(self._ids) or self._ids[i] != id:
+            self._ids.insert(i, id)
+
+    def _remove(self, id):
+        i = bisect.bisect_left(self._ids, id)
+
+        if i < len(self._ids) and self._ids[i] == id:
+            del self._ids[i]
+
+    def pick(self, rng=random):
+        with self._lock:
+            if not self._ids:
+                return None
+
+            return self._ids[rng.randrange(len(self._ids))]
+
+    def sample(self, n, rng=random):
+        '''
+        Picks min(n, len(self)) distinct ids, each set of ids equally likely, in O(n) time.
+        A seeded rng (random.Random(seed)) picks the same ids for the same set of ids.
+
+        Returns:
+            ids (list): the picked ids, in the order they were drawn
+        '''
+        with self._lock:
+            return rng.sample(self._ids, min(max(n, 0), len(self._ids)))
@@ -0,0 +1,141 @@
+import re
+
+# source: one row per distinct quote.source, with the number of quotes it has, so authors
+# can be browsed and looked up without scanning quote. Triggers on quote keep the counts
+# current in the writing transaction; rows are kept at 0 quotes so their ids stay stable.
+#
+# Lookups match names by trigram similarity (pg_trgm) through a GIN index. SOURCES_TRGM_SQL
+# is run separately, so the table works without the extension, and lookups then fall back
+# to comparing trigrams in Python.
+
+SOURCES_SETUP_SQL = """
+    LOCK TABLE quote IN SHARE MODE;
+
+    CREATE TABLE IF NOT EXISTS source (
+        id serial PRIMARY KEY,
+        name varchar(40) NOT NULL UNIQUE,
+        quotes integer NOT NULL DEFAULT 0
+    );
+
+    -- recount from scratch, keeping the ids of names already known
+    UPDATE
+        source
+    SET
+        quotes = 0
+    ;
+
+    INSERT INTO
+        source(name, quotes)
+    SELECT
+        source,
+        count(*)
+    FROM
+        quote
+    WHERE
+        source IS NOT NULL
+    GROUP BY
+        source
+    ORDER BY
+        source
+    ON CONFLICT (name) DO UPDATE SET
+        quotes = EXCLUDED.quotes
+    ;
+
+    -- an author's quotes in id order, for keyset pages of an author
+    CREATE INDEX IF NOT EXISTS quote_source_id_idx ON quote (source, id);
+
+    CREATE OR REPLACE FUNCTION source_count() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE
+                source s
+            SET
+                quotes = s.quotes - o.quotes
+            FROM (
+                SELECT source, count(*) AS quotes FROM old_quotes GROUP BY source
+            ) o
+            WHERE
+                s.name = o.source;
+        END IF;
+
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO
+                source(name, quotes)
+            SELECT
+                source, count(*)
+            FROM
+                new_quotes
+            WHERE
+                source IS NOT NULL
+            GROUP BY
+                source
+            ON CONFLICT (name) DO UPDATE SET
+                quotes = source.quotes + EXCLUDED.quotes;
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS source_count_insert ON quote;
+    DROP TRIGGER IF EXISTS source_count_update ON quote;
+    DROP TRIGGER IF EXISTS source_count_delete ON quote;
+
+    CREATE TRIGGER source_count_insert AFTER INSERT ON quote
+        REFERENCING NEW TABLE AS new_quotes
+        FOR EACH STATEMENT EXECUTE FUNCTION source_count();
+
+    CREATE TRIGGER source_count_update AFTER UPDATE ON quote
+        REFERENCING OLD TABLE AS old_quotes NEW TABLE AS new_quotes
+        FOR EACH STATEMENT EXECUTE FUNCTION source_count();
+
+    CREATE TRIGGER source_count_delete AFTER DELETE ON quote
+        REFERENCING OLD TABLE AS old_quotes
+        FOR EACH STATEMENT EXECUTE FUNCTION source_count();
+"""
+
+SOURCES_TRGM_SQL = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+    CREATE INDEX IF NOT EXISTS source_name_trgm_idx ON source USING GIN (name gin_trgm_ops);
+"""
+
+SIMILARITY_THRESHOLD = 0.3 # pg_trgm's default for the % operator
+
+def trigrams(text):
+    '''
+    Trigrams of text the way pg_trgm makes them: each lowercased word is padded with two
+    spaces in front and one behind, e.g. 'Cat' -> {'  c', ' ca', 'cat', 'at '}
+    '''
+    result = set()
+
+    for word in re.findall(r'\w+', (text or '').lower()):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    return result
+
+def similarity(a, b):
+    '''
+    Share of trigrams the two texts have in common, from 0 to 1, like pg_trgm's similarity()
+    '''
+    a, b = trigrams(a), trigrams(b)
+
+    if not a or not b:
+        return 0.0
+
+    return len(a & b) / len(a | b)
+
+def word_similarity(query, text):
+    '''
+    Best similarity() between the query and any run of consecutive words in text, so that
+    'shakespeare' matches 'William Shakespeare' well (close to pg_trgm's word_similarity())
+    '''
+    words = re.findall(r'\w+', text or '')
+    best = similarity(query, text)
+
+    for size in range(1, len(words)):
+        for start in range(len(words) - size + 1):
+            best = max(best, similarity(query, ' '.join(words[start:start + size])))
+
+    return best
@@ -0,0 +1,227 @@
+import bisect
+import functools
+import operator
+import threading
+import time
+from array import array
+
+class TagIndex:
+    '''
+    In-memory inverted index from tag to the ids of the quotes linked to it, for multi-tag
+    queries that never touch the database.
+
+    Each tag's quote ids are a sorted array of 32-bit ints (4 bytes per link). query() walks
+    the id range from a cursor and stops as soon as it has `limit` ids, so the cost of a page
+    depends on the page size rather than on the size of the index:
+
+        all  - ids found in every tag's array (intersection)
+        any  - ids found in any tag's array (union)
+        exclude - drops ids found in any of the excluded tags' arrays
+
+    Writes replace a tag's array with an updated copy instead of changing it in place, so a
+    query can keep reading the arrays it started with without holding the lock.
+
+    Args:
+        ttl (float): seconds before the index is considered stale and should be reloaded
+            from the database (None never expires)
+    '''
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._quotes.values())
+
+    @property
+    def loaded(self):
+        if self._loaded_at is None:
+            return False
+
+        if self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl:
+            return False
+
+        return True
+
+    def load(self, rows):
+        '''
+        Args:
+            rows (iterable): dict rows with a tag's id, name and quote_ids (None if it has no quotes)
+        '''
+        names = {}
+        quotes = {}
+
+        for row in rows:
+            names[row['name'].lower()] = row['id']
+            quotes[row['id']] = array('i', sorted(row['quote_ids'] or ()))
+
+        with self._lock:
+            self._names = names
+            self._quotes = quotes
+            self._loaded_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._names = {}    # lowercase tag name -> tag id
+            self._quotes = {}   # tag id -> sorted array of quote ids
+            self._loaded_at = None
+
+    def add(self, pairs):
+        '''
+        Args:
+            pairs (iterable): (quote_id, tag_id) links that were inserted
+        '''
+        self._update(pairs, _insert)
+
+    def remove(self, pairs):
+        '''
+        Args:
+            pairs (iterable): (quote_id, tag_id) links that were deleted
+        '''
+        self._update(pairs, _delete)
+
+    def _update(self, pairs, change):
+        changes = {}
+
+        for quote_id, tag_id in pairs:
+            changes.setdefault(tag_id, set()).add(quote_id)
+
+        with self._lock:
+            for tag_id, changed in changes.items():
+                # a link to a tag created since the last load; its name arrives with the next load
+                ids = array('i', self._quotes.get(tag_id, ()))
+
+                # the copy is changed in place, one id at a time, and then replaces the array
+                # queries may be reading
+                for id in sorted(changed):
+                    change(ids, id)
+
+                self._quotes[tag_id] = ids
+
+    def query(self, tags, mode='all', exclude=(), after=None, before=None, limit=None):
+        '''
+        Finds the ids of the quotes linked to all (mode='all') or any (mode='any') of `tags`,
+        minus those linked to any of `exclude`, in ascending id order.
+
+        Args:
+            tags (iterable): tag names (case-insensitive); unknown names match no quotes
+            mode (str): 'all' or 'any'
+            exclude (iterable): tag names whose quotes are left out
+            after (int): only ids greater than this
+            before (int): only ids less than this; the ids are then returned in descending
+                order, nearest first (as paging.make_page() expects)
+            limit (int): maximum number of ids returned (None for all)
+
+        Returns:
+            ids (list): matching quote ids
+        '''
+        if mode not in ('all', 'any'):
+            raise ValueError(f'unknown mode {mode!r}')
+
+        with self._lock:
+            included = [self._quotes.get(self._names.get(name.lower()), array('i')) for name in tags]
+            excluded = [self._quotes[self._names[name.lower()]] for name in exclude
+                        if self._names.get(name.lower()) in self._quotes]
+
+        groups = [[ids] for ids in included] if mode == 'all' else [included]
+
+        return match_ids(groups, excluded, after, before, limit)
+
+def match_ids(groups, excluded=(), after=None, before=None, limit=None):
+    '''
+    Finds the ids found in at least one array of every group (e.g. [[a], [b]] is a AND b,
+    [[a, b]] is a OR b) and in none of the `excluded` arrays, in ascending id order.
+
+    Args:
+        groups (list): lists of sorted arrays of ids
+        excluded (list): sorted arrays of ids to leave out
+        after (int): only ids greater than this
+        before (int): only ids less than this; the ids are then returned in descending
+            order, nearest first (as paging.make_page() expects)
+        limit (int): maximum number of ids returned (None for all)
+
+    Returns:
+        ids (list): matching ids
+    '''
+    groups = [[ids for ids in group if ids] for group in groups]
+
+    if not groups or not all(groups):
+        return []
+
+    first = min(ids[0] for group in groups for ids in group)
+    last = max(ids[-1] for group in groups for ids in group)
+    start = max(first, after + 1) if after is not None else first
+    stop = min(last + 1, before) if before is not None else last + 1
+    reverse = before is not None and after is None
+
+    # ids are matched a window of the id range at a time: each window's slice of every
+    # array is combined with C-level set operations, and the window doubles until enough
+    # ids are found. The first window is sized from the expected share of matching ids
+    # (treating arrays as independent), so a page usually takes one or two windows.
+    if limit is None:
+        width = stop - start
+    else:
+        span = last - first + 1
+        density = functools.reduce(operator.mul, (
+            1 - functools.reduce(operator.mul, (1 - len(ids) / span for ids in group))
+            for group in groups
+        ))
+        width = max(int(2 * limit / max(density, 1 / span)), 64)
+
+    results = []
+    low, high = (stop - width, stop) if reverse else (start, start + width)
+
+    while (high > start if reverse else low < stop) and (limit is None or len(results) < limit):
+        low, high = max(low, start), min(high, stop)
+        found = None
+
+        # smallest groups first, so the working set shrinks as early as possible; once it is
+        # much smaller than a group's slices, its ids are looked up by binary search instead
+        for group in sorted(groups, key=lambda group: sum(map(len, group))):
+            bounds = [_bounds(ids, low, high) for ids in group]
+
+            if found is not None and len(found) * 16 < sum(stop - start for start, stop in bounds):
+                found = {id for id in found if any(_contains(ids, id) for ids in group)}
+            else:
+                matched = set().union(*(ids[start:stop] for ids, (start, stop) in zip(group, bounds)))
+                found = matched if found is None else found & matched
+
+            if not found:
+                break
+
+        for ids in excluded:
+            found.difference_update(_slice(ids, low, high))
+
+        results.extend(sorted(found, reverse=reverse))
+
+        width *= 2
+        low, high = (low - width, low) if reverse else (high, high + width)
+
+    return results[:limit] if limit is not None else results
+
+def _insert(ids, id):
+    i = bisect.bisect_left(ids, id)
+
+    if i == len(ids) or ids[i] != id:
+        ids.insert(i, id)
+
+def _delete(ids, id):
+    i = bisect.bisect_left(ids, id)
+
+    if i < len(ids) and ids[i] == id:
+        del ids[i]
+
+def _bounds(ids, low, high):
+    # start and stop index of the ids of a sorted array in [low, high)
+    return bisect.bisect_left(ids, low), bisect.bisect_left(ids, high)
+
+def _slice(ids, low, high):
+    # the ids of a sorted array in [low, high)
+    start, stop = _bounds(ids, low, high)
+
+    return ids[start:stop]
+
+def _contains(ids, id):
+    i = bisect.bisect_left(ids, id)
+
+    return i < len(ids) and ids[i] == id
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app's modules are flat (imported as `db`, `paging`, ...), as when run from v3/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
@@ -0,0 +1,28 @@
+import json
+
+from changefeed import NOTIFY_LIMIT, ChangeFeed
+
+def payloads(feed, table, op, field, keys):
+    # the payloads on_write_many() sends, with the largest possible data version
+    for chunk in feed.chunks(table, op, field, keys):
+        event = feed.event(table, op, **{field: chunk})
+        event['version'] = 2 ** 63 - 1
+
+        yield json.dumps(event)
+
+def test_large_link_batch_fits_notify():
+    feed = ChangeFeed()
+    pairs = [(9_000_000 + i, 8_000_000 + i) for i in range(5000)]
+    sent = list(payloads(feed, 'quote_tag', 'insert', 'pairs', pairs))
+
+    assert all(len(payload.encode()) < NOTIFY_LIMIT for payload in sent)
+    assert [tuple(pair) for payload in sent for pair in json.loads(payload)['key']['pairs']] == pairs
+
+    # runs are filled up to the limit rather than to a fixed count
+    assert len(sent) > 1 and all(len(payload) > NOTIFY_LIMIT - 100 for payload in sent[:-1])
+
+def test_small_batch_is_one_event():
+    feed = ChangeFeed()
+
+    assert list(feed.chunks('quote', 'insert', 'ids', [1, 2, 3])) == [[1, 2, 3]]
+    assert list(feed.chunks('quote', 'insert', 'ids', [])) == []
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from corpus import Corpus, write_corpus
+
+QUOTES = [
+    (1, 'Waste no more time arguing what a good man should be. Be one.', 'Marcus Aurelius'),
+    (4, 'Luck is what happens when preparation meets opportunity.', 'Seneca'),
+    (9, 'Ein Ausspruch über Größe – ünd Ümlaute.', None),
+    (12, 'A line\nand another', ''),
+]
+TAGS = [(2, 'Wisdom'), (3, 'courage'), (7, 'Empty')]
+LINKS = [(1, 2), (4, 2), (9, 3), (1, 3), (12, 2), (4, 2), (99, 2), (1, 99)]
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'quotes.corpus'
+    assert write_corpus(str(path), iter(QUOTES), iter(TAGS), iter(LINKS)) == (4, 3, 5)
+
+    return str(path)
+
+def test_round_trip(path):
+    with Corpus(path) as corpus:
+        assert len(corpus) == 4
+        assert list(corpus.ids) == [1, 4, 9, 12]
+        assert list(corpus.tags()) == [{'id': id, 'name': name} for id, name in TAGS]
+
+        for id, body, source in QUOTES:
+            assert corpus.quote(id) == {'id': id, 'body': body, 'source': source or ''}
+
+        assert corpus.quote(5) is None and corpus.quote(100) is None
+
+def test_iteration_yields_views(path):
+    with Corpus(path) as corpus:
+        rows = [(id, str(body, 'utf-8'), str(source, 'utf-8')) for id, body, source in corpus]
+
+    assert rows == [(id, body, source or '') for id, body, source in QUOTES]
+
+def test_tags_by_name(path):
+    with Corpus(path) as corpus:
+        assert [corpus.ids[i] for i in corpus.tagged('WISDOM')] == [1, 4, 12]
+        assert [corpus.ids[i] for i in corpus.tagged('Courage')] == [1, 9]
+        assert len(corpus.tagged('empty')) == 0
+        assert len(corpus.tagged('nope')) == 0
+
+        rng = random.Random(1)
+        assert {corpus.pick_by_tag('courage', rng)['id'] for _ in range(50)} == {1, 9}
+        assert {corpus.pick(rng)['id'] for _ in range(100)} == {1, 4, 9, 12}
+        assert corpus.pick_by_tag('empty') is None
+
+def test_empty_corpus(tmp_path):
+    path = str(tmp_path / 'empty.corpus')
+    write_corpus(path, [], [], [])
+
+    with Corpus(path) as corpus:
+        assert len(corpus) == 0 and list(corpus) == []
+        assert corpus.pick() is None and corpus.pick_by_tag('any') is None
+
+def test_unordered_ids_are_rejected(tmp_path):
+    path = tmp_path / 'bad.corpus'
+
+    with pytest.raises(ValueError):
+        write_corpus(str(path), [(2, 'b', None), (1, 'a', None)], [], [])
+
+    assert list(tmp_path.iterdir()) == []
+
+def test_not_a_corpus(tmp_path, path):
+    other = tmp_path / 'other'
+    other.write_bytes(b'not a corpus at all, just some bytes')
+
+    with pytest.raises(ValueError):
+        Corpus(str(other))
+
+    truncated = tmp_path / 'truncated'
+    truncated.write_bytes(open(path, 'rb').read()[:-3])
+
+    with pytest.raises(ValueError):
+        Corpus(str(truncated))
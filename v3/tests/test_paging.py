@@ -0,0 +1,56 @@
+import pytest
+
+from paging import clamp_limit, decode_cursor, encode_cursor, make_page
+
+KEYS = ('quote_id', 'tag_id')
+
+def rows(*ids):
+    return [{'quote_id': id, 'tag_id': id * 10} for id in ids]
+
+def test_cursor_round_trip():
+    assert encode_cursor({'quote_id': 3, 'tag_id': 17}, KEYS) == '3.17'
+    assert decode_cursor('3.17', KEYS) == (3, 17)
+
+    # text keys are base64 behind a '~', so dots and other characters survive
+    row = {'source': 'Marcus Aurelius. Meditations ~ö', 'id': 5}
+    cursor = encode_cursor(row, ('source', 'id'))
+
+    assert cursor.startswith('~') and cursor.count('.') == 1
+    assert decode_cursor(cursor, ('source', 'id')) == (row['source'], 5)
+
+@pytest.mark.parametrize('cursor', ['3', '3.17.4', 'x.1', '~!!.1', '~/w.1', ''])
+def test_malformed_cursor_raises(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, KEYS)
+
+def test_first_middle_and_last_pages():
+    # fetched with LIMIT limit + 1
+    first = make_page(rows(1, 2, 3), KEYS, 2)
+    assert [row['quote_id'] for row in first.rows] == [1, 2]
+    assert (first.next, first.prev) == ('2.20', None)
+
+    middle = make_page(rows(3, 4, 5), KEYS, 2, after=decode_cursor(first.next, KEYS))
+    assert [row['quote_id'] for row in middle.rows] == [3, 4]
+    assert (middle.next, middle.prev) == ('4.40', '3.30')
+
+    last = make_page(rows(5), KEYS, 2, after=decode_cursor(middle.next, KEYS))
+    assert [row['quote_id'] for row in last.rows] == [5]
+    assert (last.next, last.prev) == (None, '5.50')
+
+def test_before_page_is_reversed():
+    # rows for a `before` cursor arrive in descending key order
+    page = make_page(rows(4, 3, 2), KEYS, 2, before=(5, 50))
+    assert [row['quote_id'] for row in page.rows] == [3, 4]
+    assert (page.next, page.prev) == ('4.40', '3.30')
+
+    start = make_page(rows(2, 1), KEYS, 2, before=(3, 30))
+    assert [row['quote_id'] for row in start.rows] == [1, 2]
+    assert (start.next, start.prev) == ('2.20', None)
+
+def test_empty_page_has_no_cursors():
+    assert make_page([], KEYS, 2, after=(9, 90)) == ([], None, None, ())
+
+def test_clamp_limit():
+    assert clamp_limit(None) == 50
+    assert clamp_limit('0') == 1
+    assert clamp_limit(10_000) == 500
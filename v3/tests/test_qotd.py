@@ -0,0 +1,64 @@
+import datetime
+
+from qotd import QuoteSchedule
+
+TODAY = datetime.date(2024, 1, 1)
+
+def test_schedule_fills_horizon_with_fewer_quotes_than_days():
+    schedule = QuoteSchedule('test', horizon=30)
+    schedule.reconcile(range(1, 8), TODAY)
+
+    assert len(schedule.days) == 30
+
+    # each round of 7 days shows every quote once, and no quote shows on two days running
+    for start in range(0, 28, 7):
+        assert sorted(schedule.days[start:start + 7]) == list(range(1, 8))
+
+    assert all(a != b for a, b in zip(schedule.days, schedule.days[1:]))
+
+def test_same_seed_and_ids_give_same_schedule():
+    a, b = QuoteSchedule('test', horizon=50), QuoteSchedule('test', horizon=50)
+    a.reconcile(range(1, 20), TODAY)
+    b.reconcile(range(1, 20), TODAY)
+
+    assert a.days == b.days
+
+def test_shorter_horizon_trims_and_longer_restores():
+    schedule = QuoteSchedule('test', horizon=40)
+    schedule.reconcile(range(1, 100), TODAY)
+    days = list(schedule.days)
+
+    schedule.horizon = 10
+    schedule.reconcile(range(1, 100), TODAY)
+    assert schedule.days == days[:10]
+
+    schedule.horizon = 40
+    schedule.reconcile(range(1, 100), TODAY)
+    assert schedule.days == days
+
+def test_deleted_quote_days_are_replaced():
+    schedule = QuoteSchedule('test', horizon=10)
+    schedule.reconcile(range(1, 6), TODAY)
+    deleted = schedule.days[0]
+
+    schedule.reconcile([id for id in range(1, 6) if id != deleted], TODAY)
+
+    assert deleted not in schedule.days
+    assert len(schedule.days) == 10
+
+def test_days_before_today_are_dropped(tmp_path):
+    schedule = QuoteSchedule('test', horizon=5)
+    schedule.reconcile(range(1, 50), TODAY)
+    schedule.fill({'id': id, 'body': f'quote {id}', 'source': None} for id in schedule.days)
+    path = tmp_path / 'qotd.json'
+    schedule.save(path)
+
+    loaded = QuoteSchedule.load(path)
+    tomorrow = TODAY + datetime.timedelta(days=1)
+
+    assert loaded.quote(tomorrow) == schedule.quote(tomorrow)
+
+    loaded.reconcile(range(1, 50), tomorrow)
+
+    assert loaded.days[0] == schedule.days[1]
+    assert len(loaded.days) == 5
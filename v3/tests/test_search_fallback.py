@@ -0,0 +1,44 @@
+import pytest
+
+from db import PostgresDB
+
+QUOTES = [
+    {'id': 1, 'body': 'Knowledge is not wisdom, unless used wisely.', 'source': 'J.D. Anderson'},
+    {'id': 2, 'body': 'Get happiness out of your work.', 'source': 'Elbert Hubbard'},
+]
+
+@pytest.fixture
+def unreachable_db(tmp_path, monkeypatch):
+    # libpq looks for the server's socket in an empty directory, so every connect fails
+    monkeypatch.setenv('PGHOST', str(tmp_path))
+    monkeypatch.setenv('PGCONNECT_TIMEOUT', '1')
+    db = PostgresDB('quotes', 'nobody', '', minconn=0, maxconn=2, timeout=1)
+
+    yield db
+
+    db.db_close()
+
+def test_search_falls_back_to_index_when_database_is_unreachable(unreachable_db):
+    unreachable_db.search.load(QUOTES)
+
+    for _ in range(2):
+        page = unreachable_db.quote_search('wisdom')
+
+        assert not isinstance(page, str)
+        assert [row['quote_id'] for row in page.rows] == [1]
+
+def test_search_returns_error_without_index(unreachable_db):
+    assert isinstance(unreachable_db.quote_search('wisdom'), str)
+
+def test_fallback_ranks_every_match(unreachable_db):
+    # 3000 matches; the best one (short, and matched in its source too) has the highest id
+    quotes = [{'id': id, 'body': f'wisdom comes with many long winters number {id}', 'source': None}
+              for id in range(1, 3000)]
+    quotes.append({'id': 3000, 'body': 'wisdom', 'source': 'wisdom'})
+    unreachable_db.search.load(quotes)
+
+    assert unreachable_db.quote_search('wisdom').rows[0]['quote_id'] == 3000
+
+    page = unreachable_db.quote_search('wisdom', offset=2950, limit=100)
+
+    assert len(page.rows) == 50 and page.next is None and page.prev == '2850'
@@ -0,0 +1,69 @@
+from array import array
+
+from tagindex import TagIndex, match_ids
+
+def make_index():
+    index = TagIndex()
+    index.load([
+        {'id': 1, 'name': 'Courage', 'quote_ids': [1, 2, 3, 5, 8, 13]},
+        {'id': 2, 'name': 'Wisdom', 'quote_ids': [2, 3, 5, 7, 11, 13]},
+        {'id': 3, 'name': 'Humor', 'quote_ids': [3, 6, 9, 13]},
+        {'id': 4, 'name': 'Empty', 'quote_ids': None},
+    ])
+
+    return index
+
+def test_all_intersects():
+    assert make_index().query(['courage', 'Wisdom']) == [2, 3, 5, 13]
+    assert make_index().query(['courage', 'wisdom', 'humor']) == [3, 13]
+
+def test_any_unites():
+    assert make_index().query(['courage', 'humor'], mode='any') == [1, 2, 3, 5, 6, 8, 9, 13]
+
+def test_exclude_drops_quotes_of_any_excluded_tag():
+    index = make_index()
+
+    assert index.query(['courage', 'wisdom'], exclude=['humor']) == [2, 5]
+    assert index.query(['courage'], mode='any', exclude=['wisdom', 'humor']) == [1, 8]
+
+def test_unknown_or_empty_tag_matches_nothing():
+    index = make_index()
+
+    assert index.query(['courage', 'nope']) == []
+    assert index.query(['courage', 'empty']) == []
+    assert index.query(['courage', 'nope'], mode='any') == [1, 2, 3, 5, 8, 13]
+    assert index.query(['courage'], exclude=['nope']) == [1, 2, 3, 5, 8, 13]
+
+def test_pages_match_the_full_result():
+    # large, sparse arrays, so the windows grow over several rounds
+    a = array('i', range(0, 100_000, 3))
+    b = array('i', range(0, 100_000, 7))
+    c = array('i', range(0, 100_000, 2))
+    full = match_ids([[a], [b]], [c])
+    assert full == [id for id in range(0, 100_000, 21) if id % 2]
+
+    pages, after = [], None
+
+    while True:
+        page = match_ids([[a], [b]], [c], after=after, limit=25)
+
+        if not page:
+            break
+
+        pages.extend(page)
+        after = page[-1]
+
+    assert pages == full
+    assert match_ids([[a], [b]], [c], before=full[30], limit=5) == full[25:30][::-1]
+
+def test_add_and_remove_links():
+    index = make_index()
+    humor = index._quotes[3]
+    index.add([(4, 3), (7, 1), (3, 3), (20, 3), (0, 3), (1, 5)])
+    index.remove([(13, 2), (100, 2), (9, 3)])
+
+    assert index.query(['humor']) == [0, 3, 4, 6, 13, 20]
+    assert index.query(['courage', 'wisdom']) == [2, 3, 5, 7]
+
+    # a query that read the old array keeps seeing it unchanged
+    assert list(humor) == [3, 6, 9, 13]
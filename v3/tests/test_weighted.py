@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from weighted import WeightedSelector
+
+def probabilities(selector):
+    # exact chance of each id being picked, from the alias table
+    chances = {}
+    table, aliases, classes = selector._table
+
+    for i, ids in enumerate(classes):
+        for slot, share in ((i, table[i]), (aliases[i], 1 - table[i])):
+            for id in classes[slot]:
+                chances[id] = chances.get(id, 0) + share / len(classes) / len(classes[slot])
+
+    return chances
+
+def make_selector(tags, sources=None):
+    selector = WeightedSelector()
+    selector.set_weights(tags=tags, sources=sources)
+    selector.load(
+        [
+            {'id': 1, 'source': None, 'tags': ['Courage']},
+            {'id': 2, 'source': 'Seneca', 'tags': None},
+            {'id': 3, 'source': None, 'tags': None},
+            {'id': 4, 'source': 'Seneca', 'tags': ['courage', 'Boring']},
+            {'id': 5, 'source': None, 'tags': ['Boring']},
+        ],
+        [{'id': 10, 'name': 'Courage'}, {'id': 11, 'name': 'Boring'}],
+    )
+
+    return selector
+
+def test_alias_table_matches_weights():
+    # weights 3, 2, 1, 6 (3 * 2) and 1; a total of 13
+    chances = probabilities(make_selector({'Courage': 3}, {'seneca': 2}))
+
+    assert chances.keys() == {1, 2, 3, 4, 5}
+    assert chances[1] == pytest.approx(3 / 13)
+    assert chances[2] == pytest.approx(2 / 13)
+    assert chances[3] == pytest.approx(1 / 13)
+    assert chances[4] == pytest.approx(6 / 13)
+    assert chances[5] == pytest.approx(1 / 13)
+
+def test_weight_zero_is_never_picked():
+    selector = make_selector({'Courage': 3, 'boring': 0})
+    rng = random.Random(1)
+    picks = {selector.pick(rng) for _ in range(2000)}
+
+    assert picks == {1, 2, 3}
+    assert 4 not in probabilities(selector) and 5 not in probabilities(selector)
+
+def test_reweighting_and_relinking_move_quotes():
+    selector = make_selector({'Courage': 3, 'Boring': 0})
+    selector.set_weights(tags={'Courage': 1, 'Boring': 2})
+
+    assert probabilities(selector)[5] == pytest.approx(2 / 7)
+
+    selector.unlink([(5, 11)])
+    selector.link([(3, 10)])
+
+    assert probabilities(selector) == pytest.approx({1: 1 / 6, 2: 1 / 6, 3: 1 / 6, 4: 2 / 6, 5: 1 / 6})
+
+def test_all_zero_picks_nothing():
+    selector = make_selector({'Courage': 0, 'Boring': 0}, {'Seneca': 0})
+    selector.remove([3])
+
+    assert selector.pick() is None
+
+def test_negative_weight_is_rejected():
+    with pytest.raises(ValueError):
+        WeightedSelector().set_weights(tags={'Courage': -1})
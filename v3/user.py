@@ -1,5 +1,12 @@
+import hashlib
+
 from flask_login import UserMixin
 
 class User(UserMixin):
     def __init__(self, username):
         self.id = username
+
+def password_fingerprint(password_hash):
+    # short digest of the stored password hash, kept in the signed session: it changes
+    # whenever the password does, without putting the hash itself in the cookie
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:16]
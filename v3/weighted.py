@@ -0,0 +1,287 @@
+import bisect
+import random
+import threading
+import time
+from array import array
+
+class WeightedSelector:
+    '''
+    Picks a random quote id with probability proportional to its weight, in constant time.
+
+    A quote's weight is the product of the configured weights of its tags and of its source
+    (1 for those not configured), so {"tags": {"Courage": 3}} makes quotes tagged Courage
+    three times as likely, and a weight of 0 leaves them out.
+
+    Quotes of equal weight form a class, kept as a sorted array of ids like RandomSelector's.
+    A pick draws a class from an alias table (Vose's method) over the classes' total weights
+    and then a uniform id within the class: two random numbers and three list lookups, however
+    many quotes there are. Only the weighted tags' links and the weighted sources are kept
+    per quote, and a change to one of them moves a single id to another class and rebuilds
+    the alias table, which has one entry per distinct weight.
+
+    Args:
+        ttl (float): seconds before the ids are considered stale and should be reloaded
+            from the database (None never expires)
+    '''
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tag_weights = {}      # lowercase tag name -> weight
+        self._source_weights = {}   # lowercase source -> weight
+        self.reset()
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._classes.values())
+
+    @property
+    def configured(self):
+        return bool(self._tag_weights or self._source_weights)
+
+    @property
+    def loaded(self):
+        if self._loaded_at is None:
+            return False
+
+        if self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl:
+            return False
+
+        return True
+
+    @property
+    def tags(self):
+        return tuple(self._tag_weights)
+
+    @property
+    def sources(self):
+        return tuple(self._source_weights)
+
+    def set_weights(self, tags=None, sources=None):
+        '''
+        Args:
+            tags (dict): tag name -> weight (case-insensitive)
+            sources (dict): source -> weight (case-insensitive)
+
+        Raises:
+            ValueError: if a weight is negative or not a number
+        '''
+        tag_weights = {name.lower(): float(weight) for name, weight in (tags or {}).items()}
+        source_weights = {name.lower(): float(weight) for name, weight in (sources or {}).items()}
+
+        if any(weight < 0 for weight in (*tag_weights.values(), *source_weights.values())):
+            raise ValueError('weights must not be negative')
+
+        with self._lock:
+            # the same tags and sources with other weights: only the quotes they apply to move
+            if self._loaded_at is not None and tag_weights.keys() == self._tag_weights.keys() \
+                    and source_weights.keys() == self._source_weights.keys():
+                moves = [(id, self._weight(id)) for id in set(self._links) | set(self._sources)]
+                self._tag_weights, self._source_weights = tag_weights, source_weights
+
+                for id, old in moves:
+                    self._move(id, old, self._weight(id))
+
+                self._build()
+                return
+
+            # other tags or sources: which quotes they apply to is read again by the next load
+            self._tag_weights, self._source_weights = tag_weights, source_weights
+
+        self.reset()
+
+    def load(self, quotes, tags):
+        '''
+        Args:
+            quotes (iterable): dict rows with every quote's id, its source (None unless it is
+                weighted) and the names of its weighted tags (None if it has none), in
+                ascending id order
+            tags (iterable): dict rows with the id and name of every weighted tag
+        '''
+        with self._lock:
+            tag_weights, source_weights = self._tag_weights, self._source_weights
+
+        tag_names = {row['id']: row['name'].lower() for row in tags if row['name'].lower() in tag_weights}
+        links = {}
+        sources = {}
+        classes = {}
+
+        for row in quotes:
+            id = row['id']
+
+            if row['tags']:
+                links[id] = {name.lower() for name in row['tags']}
+
+            if row['source'] and row['source'].lower() in source_weights:
+                sources[id] = row['source'].lower()
+
+            weight = _product(tag_weights, links.get(id, ()), source_weights, sources.get(id))
+            classes.setdefault(weight, array('i')).append(id)
+
+        with self._lock:
+            self._tag_names = tag_names
+            self._links = links
+            self._sources = sources
+            self._classes = classes
+            self._build()
+            self._loaded_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._tag_names = {}    # weighted tag id -> lowercase name
+            self._links = {}        # quote id -> lowercase names of its weighted tags
+            self._sources = {}      # quote id -> lowercase source, if weighted
+            self._classes = {}      # weight -> sorted array of the ids of quotes with that weight
+            self._table = ([], [], [])  # alias table: per class, probability, alias and ids
+            self._loaded_at = None
+
+    def add(self, ids):
+        '''
+        Args:
+            ids (iterable): ids of new quotes (with weight 1 until link() or set_source())
+        '''
+        with self._lock:
+            for id in ids:
+                if self._find(id) is None:
+                    self._insert(id, self._weight(id))
+
+            self._build()
+
+    def remove(self, ids):
+        with self._lock:
+            for id in ids:
+                weight = self._find(id)
+
+                if weight is not None:
+                    self._delete(id, weight)
+
+                self._links.pop(id, None)
+                self._sources.pop(id, None)
+
+            self._build()
+
+    def link(self, pairs):
+        '''
+        Args:
+            pairs (iterable): (quote_id, tag_id) links that were inserted
+        '''
+        self._relink(pairs, lambda names, name: names | {name})
+
+    def unlink(self, pairs):
+        '''
+        Args:
+            pairs (iterable): (quote_id, tag_id) links that were deleted
+        '''
+        self._relink(pairs, lambda names, name: names - {name})
+
+    def _relink(self, pairs, merge):
+        with self._lock:
+            for quote_id, tag_id in pairs:
+                name = self._tag_names.get(tag_id)
+
+                if name is None:
+                    continue
+
+                old = self._weight(quote_id)
+                names = merge(self._links.get(quote_id, set()), name)
+
+                if names:
+                    self._links[quote_id] = names
+                else:
+                    self._links.pop(quote_id, None)
+
+                self._move(quote_id, old, self._weight(quote_id))
+
+            self._build()
+
+    def set_source(self, id, source):
+        with self._lock:
+            old = self._weight(id)
+
+            if source and source.lower() in self._source_weights:
+                self._sources[id] = source.lower()
+            else:
+                self._sources.pop(id, None)
+
+            self._move(id, old, self._weight(id))
+            self._build()
+
+    def pick(self, rng=random):
+        with self._lock:
+            probabilities, aliases, classes = self._table
+
+            if not classes:
+                return None
+
+            i = rng.randrange(len(classes))
+            ids = classes[i] if rng.random() < probabilities[i] else classes[aliases[i]]
+
+            return ids[rng.randrange(len(ids))]
+
+    def _weight(self, id):
+        return _product(self._tag_weights, self._links.get(id, ()), self._source_weights, self._sources.get(id))
+
+    def _find(self, id):
+        # the weight of the class holding id, or None; tracked quotes are looked up in their
+        # own class, others in the class of weight 1
+        weight = self._weight(id)
+        ids = self._classes.get(weight, ())
+        i = bisect.bisect_left(ids, id)
+
+        return weight if i < len(ids) and ids[i] == id else None
+
+    def _move(self, id, old, new):
+        if old != new and self._delete(id, old):
+            self._insert(id, new)
+
+    def _insert(self, id, weight):
+        ids = self._classes.setdefault(weight, array('i'))
+
+        # serial ids arrive in increasing order, so this is almost always an append
+        if not ids or id > ids[-1]:
+            ids.append(id)
+        else:
+            ids.insert(bisect.bisect_left(ids, id), id)
+
+    def _delete(self, id, weight):
+        ids = self._classes.get(weight, ())
+        i = bisect.bisect_left(ids, id)
+
+        if i == len(ids) or ids[i] != id:
+            return False
+
+        del ids[i]
+
+        if not ids:
+            del self._classes[weight]
+
+        return True
+
+    def _build(self):
+        # Vose's alias method: each class gets a slot of equal probability, holding part of
+        # its own weight and topped up by one heavier class (its alias)
+        classes = [ids for weight, ids in self._classes.items() if weight > 0]
+        weights = [weight * len(ids) for weight, ids in self._classes.items() if weight > 0]
+        total = sum(weights)
+        probabilities = [1.0] * len(classes)
+        aliases = list(range(len(classes)))
+
+        if total > 0:
+            scaled = [weight * len(weights) / total for weight in weights]
+            small = [i for i, p in enumerate(scaled) if p < 1]
+            large = [i for i, p in enumerate(scaled) if p >= 1]
+
+            while small and large:
+                s, l = small.pop(), large.pop()
+                probabilities[s], aliases[s] = scaled[s], l
+                scaled[l] += scaled[s] - 1
+                (small if scaled[l] < 1 else large).append(l)
+
+        self._table = (probabilities, aliases, classes)
+
+def _product(tag_weights, tags, source_weights, source):
+    # rounded, so the same weights multiplied in another order land in the same class
+    weight = source_weights.get(source, 1.0)
+
+    for name in sorted(tags):
+        weight *= tag_weights.get(name, 1.0)
+
+    return round(weight, 9)